@@ -18,21 +18,42 @@
 
 from typing import TYPE_CHECKING, cast
 
-from aqt import mw
-from aqt.gui_hooks import deck_browser_will_show_options_menu
-from aqt.qt import QAction, QMenu
+try:
+    from aqt import mw
+except ImportError:  # imported outside of Anki, e.g. by the simulation service
+    mw = None
 
 from ._version import __version__  # noqa: F401
-from .collection_simulator import CollectionSimulator
-from .gui.dialogs import SimulatorDialog
-from .review_simulator import ReviewSimulator
 
 if TYPE_CHECKING:
-    assert mw is not None
     from aqt.main import AnkiQt
+    from aqt.qt import QMenu
+
+    from .collection_simulator import CollectionSimulator  # noqa: F401
+    from .review_simulator import ReviewSimulator  # noqa: F401
+
+# Everything else is only imported when the simulator is first opened, so that
+# the add-on adds as little as possible to the startup time of Anki. See
+# tools/import_time.py.
+
+
+def __getattr__(name: str):
+    if name == "ReviewSimulator":
+        from .review_simulator import ReviewSimulator
+
+        return ReviewSimulator
+    if name == "CollectionSimulator":
+        from .collection_simulator import CollectionSimulator
+
+        return CollectionSimulator
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 
 def open_simulator_dialog(main_window: "AnkiQt", deck_id=None):
+    from .collection_simulator import CollectionSimulator
+    from .gui.dialogs import SimulatorDialog
+    from .review_simulator import ReviewSimulator
+
     dialog = SimulatorDialog(
         main_window, ReviewSimulator, CollectionSimulator, deck_id=deck_id
     )
@@ -40,24 +61,29 @@ def open_simulator_dialog(main_window: "AnkiQt", deck_id=None):
 
 
 def add_deck_menu_action_factory(main_window: "AnkiQt"):
-    def add_deck_menu_action(menu: QMenu, deck_id: int):
+    def add_deck_menu_action(menu: "QMenu", deck_id: int):
         action = cast(QAction, menu.addAction("Simulate"))
         action.triggered.connect(lambda _: open_simulator_dialog(main_window, deck_id))
 
     return add_deck_menu_action
 
 
-# Web exports
+if mw is not None:
+    # Already loaded by Anki at this point:
+    from aqt.gui_hooks import deck_browser_will_show_options_menu
+    from aqt.qt import QAction
+
+    # Web exports
 
-mw.addonManager.setWebExports(__name__, r"gui(/|\\)web(/|\\).*")
+    mw.addonManager.setWebExports(__name__, r"gui(/|\\)web(/|\\).*")
 
-# Main menu
+    # Main menu
 
-action = QAction("Anki Simulator", mw)
-action.triggered.connect(lambda _, mw=mw: open_simulator_dialog(mw))
-mw.form.menuTools.addAction(action)
+    action = QAction("Anki Simulator", mw)
+    action.triggered.connect(lambda _, mw=mw: open_simulator_dialog(mw))
+    mw.form.menuTools.addAction(action)
 
-# Deck options context menu
+    # Deck options context menu
 
-add_deck_menu = add_deck_menu_action_factory(mw)
-deck_browser_will_show_options_menu.append(add_deck_menu)
+    add_deck_menu = add_deck_menu_action_factory(mw)
+    deck_browser_will_show_options_menu.append(add_deck_menu)
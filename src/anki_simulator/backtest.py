@@ -0,0 +1,485 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Backtests of the forecasts of a deck against its review history
+
+Rebuilds the cards of the deck as they were on past start dates from the review
+log, simulates forward from each start date and compares the forecast with the
+reviews that were actually done. Needs the anki package (pip install anki) and
+runs from the directory that contains this package:
+
+    python -m anki_simulator.backtest collection.anki2 "Deck" --every 30
+
+The review log is read once, in id order and in chunks, while the state of
+every card is updated. The cards are taken whenever a start date is passed and
+simulated right away, and the actual reviews per day are counted in the same
+pass, so many start dates cost little more than one. Retention rates and answer
+times are estimated from the answers before each start date, so that no
+forecast sees the days it forecasts. Reviews of cards added after a start date
+do not count for it. The deck options are the current ones, and the collection
+file is copied to a temporary directory first, so it is never written to.
+"""
+
+import argparse
+import csv
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+from bisect import bisect_right
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from .collection_simulator import (
+    CARD_STATE_LEARNING,
+    CARD_STATE_MATURE,
+    CARD_STATE_NEW,
+    CARD_STATE_RELEARN,
+    CARD_STATE_YOUNG,
+    DATE_ARRAY_TYPE,
+    SimulatedCard,
+    index_notes,
+)
+from .deck_settings import deck_settings
+from .review_simulator import ReviewSimulator
+
+HORIZONS = (1, 7, 30, 90, 180)
+# Review log rows read per query:
+REVLOG_CHUNK = 50000
+_DAY_MS = 86400000
+
+
+class BacktestOptions(NamedTuple):
+    # Days after the start date at which the forecast is compared:
+    horizons: Tuple[int, ...] = HORIZONS
+    retention_cutoff_days: int = 365
+    study_start_hour: int = 8
+    seed: int = 0
+    jit: bool = False
+
+
+class StartResult(NamedTuple):
+    start: datetime.date
+    cards: int
+    # Reviews per day from the start date on, for the days that are over:
+    forecast: List[int]
+    actual: List[int]
+    seconds: float
+
+
+class HorizonError(NamedTuple):
+    horizon: int
+    # Start dates with at least `horizon` days after them:
+    starts: int
+    # Mean absolute error of the reviews per day over the first `horizon` days:
+    daily_error: float
+    # Mean absolute and mean signed error of the total reviews over the first
+    # `horizon` days, in percent of the actual total:
+    total_error: float
+    bias: float
+
+
+def revlog_rows(col, chunk_size: int = REVLOG_CHUNK) -> Iterator[Tuple]:
+    """(id, cid, ease, ivl, factor, type) of every review, in id order.
+    Only `chunk_size` rows are loaded at a time."""
+    lastId = -1
+    while True:
+        rows = col.db.all(
+            "select id, cid, ease, ivl, factor, type from revlog"
+            " where id > ? order by id limit ?",
+            lastId,
+            chunk_size,
+        )
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        lastId = rows[-1][0]
+
+
+class _Replay:
+    """State of the cards of a deck, updated review by review
+
+    Card states are lists of [state, interval, ease, step, due day], with days
+    counted from the current day (0) backwards. Cards that have not been
+    reviewed yet are new.
+    """
+
+    def __init__(
+        self,
+        notes: Dict[int, int],
+        starting_ease: int,
+        number_of_learning_steps: int,
+        number_of_lapse_steps: int,
+        new_lapse_interval: float,
+        scheduler_version: int,
+    ):
+        # Note of every card of the deck:
+        self.notes = notes
+        self.states: Dict[int, list] = {}
+        self.startingEase = starting_ease
+        self.lastLearningStep = max(number_of_learning_steps - 1, 0)
+        self.lastLapseStep = max(number_of_lapse_steps - 1, 0)
+        self.newLapseInterval = new_lapse_interval
+        # The v1 scheduler has no hard button in learning:
+        self.goodEase = 2 if scheduler_version == 1 else 3
+
+    def answer(self, cid: int, day: int, ease: int, ivl: int, factor: int, kind: int):
+        state = self.states.get(cid)
+        if ease == 0:
+            # Changed by hand, e.g. forgotten or given a due date:
+            if ivl <= 0:
+                self.states.pop(cid, None)
+            else:
+                self.states[cid] = [
+                    CARD_STATE_MATURE if ivl >= 21 else CARD_STATE_YOUNG,
+                    ivl,
+                    state[2] if state else self.startingEase,
+                    0,
+                    day + ivl,
+                ]
+            return
+        newEase = factor / 10 if factor else (state[2] if state else self.startingEase)
+        if ivl > 0:
+            self.states[cid] = [
+                CARD_STATE_MATURE if ivl >= 21 else CARD_STATE_YOUNG,
+                ivl,
+                newEase,
+                0,
+                day + ivl,
+            ]
+            return
+        if kind == 3:
+            return  # Previewed in a filtered deck
+        # In a learning step, logged as a negative number of seconds:
+        previous = state[0] if state else CARD_STATE_NEW
+        step = state[3] if state else 0
+        due = day + -ivl // 86400
+        if kind == 0 or previous == CARD_STATE_NEW or previous == CARD_STATE_LEARNING:
+            if ease == 1:
+                step = 0
+            elif ease >= self.goodEase:
+                step = min(step + 1, self.lastLearningStep)
+            self.states[cid] = [CARD_STATE_LEARNING, 0, newEase, step, due]
+        elif previous == CARD_STATE_RELEARN:
+            if ease == 1:
+                step = 0
+            elif ease >= self.goodEase:
+                step = min(step + 1, self.lastLapseStep)
+            self.states[cid] = [CARD_STATE_RELEARN, state[1], newEase, step, due]
+        else:
+            # Lapsed review, whose interval is cut like Anki does:
+            self.states[cid] = [
+                CARD_STATE_RELEARN,
+                max(int(state[1] * self.newLapseInterval), 1),
+                newEase,
+                0,
+                due,
+            ]
+
+    def cards(
+        self, start_day: int, start_ms: int, days: int, new_cards_per_day: int
+    ) -> Tuple[DATE_ARRAY_TYPE, int, int]:
+        """Date array of the cards that existed at the start, the number of them
+        and of the mature ones, like CollectionSimulator.generate_for_deck"""
+        dateArray: DATE_ARRAY_TYPE = [[] for _ in range(days)]
+        newCards = []
+        noteCards = []
+        total = 0
+        mature = 0
+        states = self.states
+        for cid, nid in self.notes.items():
+            # Card ids are creation times:
+            if cid >= start_ms:
+                continue
+            total += 1
+            state = states.get(cid)
+            if state is None:
+                card = SimulatedCard(id=cid, ease=self.startingEase)
+                newCards.append(card)
+                noteCards.append((nid, card))
+                continue
+            cardState, ivl, ease, step, due = state
+            if cardState == CARD_STATE_MATURE:
+                mature += 1
+            # Overdue cards are included:
+            due = max(due - start_day, 0)
+            if due >= days:
+                continue
+            card = SimulatedCard(
+                id=cid, ivl=ivl, ease=ease, state=cardState, step=step
+            )
+            dateArray[due].append(card)
+            noteCards.append((nid, card))
+        index_notes(noteCards)
+        if new_cards_per_day > 0:
+            newCards.sort(key=lambda card: card.id)
+            for index, card in enumerate(newCards):
+                day = index // new_cards_per_day
+                if day >= days:
+                    break
+                dateArray[day].append(card)
+        return dateArray, total, mature
+
+
+def backtest(
+    col,
+    did: int,
+    starts: Sequence[datetime.date],
+    options: BacktestOptions = BacktestOptions(),
+    log=None,
+) -> List[StartResult]:
+    """Forecasts of the deck (and its subdecks) from each start date, next to
+    the reviews actually done. Start dates must lie before the current day."""
+    # Days are counted from the start of the current day:
+    originMs = (col.sched.day_cutoff - 86400) * 1000
+    today = datetime.date.fromtimestamp(col.sched.day_cutoff - 86400)
+    starts = sorted(set(starts))
+    startDays = [(start - today).days for start in starts]
+    if not starts or startDays[-1] >= 0:
+        raise ValueError("Start dates must lie before the current day")
+    startMs = [originMs + day * _DAY_MS for day in startDays]
+    maxHorizon = max(options.horizons)
+
+    cids = set(col.decks.cids(did, True))
+    notes = {
+        cid: nid for cid, nid in col.db.all("select id, nid from cards") if cid in cids
+    }
+    conf = col.decks.config_dict_for_deck_id(did)
+    replay = _Replay(
+        notes,
+        int(conf["new"]["initialFactor"] / 10),
+        len(conf["new"]["delays"]),
+        len(conf["lapse"]["delays"]),
+        conf["lapse"]["mult"],
+        col.sched_ver(),
+    )
+    # Actual reviews per day, split by the number of start dates that lie before
+    # the card was added. Reviews of a card count for the start dates after it:
+    actualCounts: Dict[int, List[int]] = {}
+    forecasts: List[Tuple[int, List[int], float]] = []
+
+    def forecast(index: int):
+        began = time.perf_counter()
+        days = min(maxHorizon, -startDays[index])
+        settings = deck_settings(
+            col,
+            did,
+            options.retention_cutoff_days,
+            options.study_start_hour,
+            until=startMs[index] // 1000,
+        )
+        simulatorOptions = settings.options
+        dateArray, total, mature = replay.cards(
+            startDays[index],
+            startMs[index],
+            days,
+            simulatorOptions["new_cards_per_day"],
+        )
+        results = ReviewSimulator(
+            dateArray,
+            days,
+            total_number_of_cards=total,
+            current_number_mature_cards=mature,
+            seed=options.seed,
+            jit=options.jit,
+            **simulatorOptions,
+        ).simulate()
+        assert results is not None
+        forecasts.append(
+            (total, [day["y"] for day in results], time.perf_counter() - began)
+        )
+        if log:
+            log(
+                "{}: {} cards, {} days in {:.2f} s".format(
+                    starts[index], total, days, forecasts[-1][2]
+                )
+            )
+
+    nextStart = 0
+    firstDay = startDays[0]
+    buckets = len(starts) + 1
+    for revlogId, cid, ease, ivl, factor, kind in revlog_rows(col):
+        while nextStart < len(starts) and revlogId >= startMs[nextStart]:
+            forecast(nextStart)
+            nextStart += 1
+        if cid not in notes:
+            continue
+        day = (revlogId - originMs) // _DAY_MS
+        replay.answer(cid, day, ease, ivl, factor, kind)
+        if ease and firstDay <= day < 0:
+            counts = actualCounts.get(day)
+            if counts is None:
+                counts = actualCounts[day] = [0] * buckets
+            counts[bisect_right(startMs, cid)] += 1
+    while nextStart < len(starts):
+        forecast(nextStart)
+        nextStart += 1
+
+    results = []
+    for index, (start, startDay) in enumerate(zip(starts, startDays)):
+        total, forecasted, seconds = forecasts[index]
+        actual = [
+            sum(actualCounts.get(startDay + offset, ())[: index + 1])
+            for offset in range(len(forecasted))
+        ]
+        results.append(StartResult(start, total, forecasted, actual, seconds))
+    return results
+
+
+def horizon_errors(
+    results: Sequence[StartResult], horizons: Sequence[int] = HORIZONS
+) -> List[HorizonError]:
+    """Errors of the forecasts at each horizon, over the start dates with enough
+    days after them"""
+    errors = []
+    for horizon in sorted(horizons):
+        usable = [result for result in results if len(result.actual) >= horizon]
+        dailyErrors = []
+        totalErrors = []
+        for result in usable:
+            forecast = result.forecast[:horizon]
+            actual = result.actual[:horizon]
+            dailyErrors.append(
+                sum(abs(f - a) for f, a in zip(forecast, actual)) / horizon
+            )
+            if sum(actual):
+                totalErrors.append((sum(forecast) - sum(actual)) / sum(actual) * 100)
+        errors.append(
+            HorizonError(
+                horizon,
+                len(usable),
+                sum(dailyErrors) / len(dailyErrors) if dailyErrors else float("nan"),
+                sum(map(abs, totalErrors)) / len(totalErrors)
+                if totalErrors
+                else float("nan"),
+                sum(totalErrors) / len(totalErrors) if totalErrors else float("nan"),
+            )
+        )
+    return errors
+
+
+def report(errors: Sequence[HorizonError]) -> str:
+    lines = [
+        "{:>8} {:>7} {:>12} {:>12} {:>8}".format(
+            "horizon", "starts", "error/day", "total error", "bias"
+        )
+    ]
+    for error in errors:
+        lines.append(
+            "{:>7}d {:>7} {:>12.1f} {:>11.1f}% {:>+7.1f}%".format(
+                error.horizon,
+                error.starts,
+                error.daily_error,
+                error.total_error,
+                error.bias,
+            )
+        )
+    return "\n".join(lines)
+
+
+def write_csv(results: Sequence[StartResult], path: str):
+    """Forecast and actual reviews of every day of every start date"""
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["start", "day", "forecast", "actual"])
+        for result in results:
+            for day, (forecast, actual) in enumerate(
+                zip(result.forecast, result.actual)
+            ):
+                writer.writerow([result.start.isoformat(), day, forecast, actual])
+
+
+def _date(value: str) -> datetime.date:
+    return datetime.date.fromisoformat(value)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("collection", help="path of the .anki2 file")
+    parser.add_argument("deck", help="name of the deck, including its subdecks")
+    parser.add_argument(
+        "--start",
+        type=_date,
+        action="append",
+        default=[],
+        help="start date (YYYY-MM-DD), can be given several times",
+    )
+    parser.add_argument(
+        "--every",
+        type=int,
+        default=30,
+        help="without --start, a start date every this many days since --since",
+    )
+    parser.add_argument(
+        "--since", type=_date, help="first start date, defaults to a year ago"
+    )
+    parser.add_argument("--horizons", type=int, nargs="+", default=list(HORIZONS))
+    parser.add_argument("--csv", help="write the reviews per day to this file")
+    parser.add_argument("--retention-cutoff-days", type=int, default=365)
+    parser.add_argument("--study-start-hour", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--jit", action="store_true", help="use the compiled loop if Numba is installed"
+    )
+    arguments = parser.parse_args(argv)
+    options = BacktestOptions(
+        horizons=tuple(arguments.horizons),
+        retention_cutoff_days=arguments.retention_cutoff_days,
+        study_start_hour=arguments.study_start_hour,
+        seed=arguments.seed,
+        jit=arguments.jit,
+    )
+
+    from anki.collection import Collection
+
+    with tempfile.TemporaryDirectory() as directory:
+        copy = os.path.join(directory, "collection.anki2")
+        shutil.copyfile(arguments.collection, copy)
+        if os.path.exists(arguments.collection + "-wal"):
+            shutil.copyfile(arguments.collection + "-wal", copy + "-wal")
+        col = Collection(copy)
+        try:
+            did = next(
+                (
+                    deck.id
+                    for deck in col.decks.all_names_and_ids()
+                    if deck.name == arguments.deck
+                ),
+                None,
+            )
+            if did is None:
+                sys.exit("No deck named {!r}".format(arguments.deck))
+            starts = arguments.start
+            if not starts:
+                today = datetime.date.fromtimestamp(col.sched.day_cutoff - 86400)
+                start = arguments.since or today - datetime.timedelta(days=365)
+                while start < today:
+                    starts.append(start)
+                    start += datetime.timedelta(days=max(arguments.every, 1))
+            results = backtest(col, did, starts, options, log=print)
+        finally:
+            col.close()
+    print(report(horizon_errors(results, options.horizons)))
+    if arguments.csv:
+        write_csv(results, arguments.csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Forecasts for every deck of many collection files, e.g. nightly for many users
+
+Needs the anki package (pip install anki) and runs from the directory that
+contains this package:
+
+    python -m anki_simulator.batch COLLECTIONS_DIR summary.csv --workers 4
+
+Every .anki2 file below the directory is copied to a temporary directory and
+opened from there, so the original files are never written to. Each deck is
+simulated with its own deck options and retention rates, read like the simulator
+dialog reads them, and gets one row in the CSV file. Collections are simulated
+in a process pool with at most --max-in-flight of them loaded at once. The rows
+of a collection are written together once it is done, and collections that
+already have rows in the CSV file are skipped, so an interrupted run continues
+where it stopped when started again.
+"""
+
+import argparse
+import csv
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+from .collection_simulator import CollectionSimulator
+from .deck_settings import deck_settings
+from .review_simulator import ReviewSimulator
+
+FIELDS = [
+    "collection",
+    "deck_id",
+    "deck",
+    "cards",
+    "mature_cards",
+    "days",
+    "total_reviews",
+    "average_reviews",
+    "peak_reviews",
+    "peak_day",
+    "average_minutes",
+    "mature_cards_at_end",
+    "seconds",
+    "error",
+]
+
+
+class BatchOptions(NamedTuple):
+    days: int = 365
+    # Whether to simulate only top level decks (with their subdecks), or every
+    # deck. Rows of parent decks then include the cards of their subdecks.
+    all_decks: bool = False
+    include_overdue_cards: bool = True
+    retention_cutoff_days: int = 365
+    study_start_hour: int = 8
+    seed: int = 0
+    jit: bool = False
+
+
+class _MainWindow:
+    """Stands in for Anki's main window, which CollectionSimulator reads the
+    collection from"""
+
+    def __init__(self, col):
+        self.col = col
+
+
+def _deckRow(col, did: int, name: str, options: BatchOptions) -> Dict[str, Any]:
+    start = time.perf_counter()
+    settings = deck_settings(
+        col, did, options.retention_cutoff_days, options.study_start_hour
+    )
+    simulatorOptions = settings.options
+    dateArray, totalNumberOfCards, numberOfMatureCards = CollectionSimulator(
+        _MainWindow(col)
+    ).generate_for_deck(
+        did,
+        options.days,
+        simulatorOptions["new_cards_per_day"],
+        settings.starting_ease,
+        len(simulatorOptions["learning_steps"]),
+        len(simulatorOptions["lapse_steps"]),
+        options.include_overdue_cards,
+        False,
+        0,
+    )
+    results = ReviewSimulator(
+        dateArray,
+        options.days,
+        total_number_of_cards=totalNumberOfCards,
+        current_number_mature_cards=numberOfMatureCards,
+        seed=options.seed,
+        jit=options.jit,
+        **simulatorOptions,
+    ).simulate()
+    assert results is not None
+    peak = max(results, key=lambda day: day["y"])
+    last = results[-1]
+    return {
+        "deck_id": did,
+        "deck": name,
+        "cards": totalNumberOfCards,
+        "mature_cards": numberOfMatureCards,
+        "days": options.days,
+        "total_reviews": last["accumulate"],
+        "average_reviews": round(last["average"], 1),
+        "peak_reviews": peak["y"],
+        "peak_day": peak["dayNumber"],
+        "average_minutes": round(last["accumulateMinutes"] / options.days, 1),
+        "mature_cards_at_end": last["matureCount"],
+        "seconds": round(time.perf_counter() - start, 2),
+        "error": "",
+    }
+
+
+def forecast_collection(
+    path: str, name: str, options: BatchOptions
+) -> List[Dict[str, Any]]:
+    """One summary row per deck of the collection file, or a single row with the
+    error if it could not be opened"""
+    from anki.collection import Collection
+
+    with tempfile.TemporaryDirectory() as directory:
+        copy = os.path.join(directory, "collection.anki2")
+        shutil.copyfile(path, copy)
+        if os.path.exists(path + "-wal"):
+            shutil.copyfile(path + "-wal", copy + "-wal")
+        try:
+            col = Collection(copy)
+        except Exception as error:
+            return [{"collection": name, "error": _describe(error)}]
+        try:
+            decks = [
+                (deck.id, deck.name)
+                for deck in col.decks.all_names_and_ids(include_filtered=False)
+                if options.all_decks or "::" not in deck.name
+            ]
+            rows = []
+            for did, deckName in decks:
+                if not col.decks.cids(did, True):
+                    continue
+                try:
+                    row = _deckRow(col, did, deckName, options)
+                except Exception as error:
+                    row = {"deck_id": did, "deck": deckName, "error": _describe(error)}
+                rows.append({"collection": name, **row})
+            if not rows:
+                # Marks the collection as done:
+                rows.append({"collection": name, "error": "no cards"})
+            return rows
+        finally:
+            col.close()
+
+
+def _describe(error: BaseException) -> str:
+    return "{}: {}".format(type(error).__name__, error)
+
+
+def _csvText(rows: List[Dict[str, Any]], header: bool = False) -> str:
+    text = io.StringIO()
+    writer = csv.DictWriter(text, FIELDS, restval="")
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return text.getvalue()
+
+
+def collection_files(directory: str) -> List[str]:
+    """Paths of the .anki2 files below the directory, relative to it"""
+    paths = []
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.endswith(".anki2"):
+                paths.append(os.path.relpath(os.path.join(root, file), directory))
+    return sorted(paths)
+
+
+def finished_collections(output: str) -> Set[str]:
+    if not os.path.exists(output):
+        return set()
+    with open(output, newline="", encoding="utf-8") as file:
+        reader = csv.DictReader(file)
+        if reader.fieldnames and reader.fieldnames != FIELDS:
+            raise ValueError("{} was written with other columns".format(output))
+        return {row["collection"] for row in reader}
+
+
+def run_batch(
+    directory: str,
+    output: str,
+    options: BatchOptions,
+    workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    log=print,
+) -> int:
+    """Simulates the collections that are not in the output file yet, appending
+    their rows to it. Returns the number of collections simulated."""
+    finished = finished_collections(output)
+    files = collection_files(directory)
+    pending = [name for name in files if name not in finished]
+    log("{} collections, {} already done".format(len(files), len(files) - len(pending)))
+    workers = workers or os.cpu_count() or 1
+    maxInFlight = max(max_in_flight or workers, 1)
+    newFile = not os.path.exists(output) or os.path.getsize(output) == 0
+    done = 0
+    with open(output, "a", newline="", encoding="utf-8") as file, ProcessPoolExecutor(
+        workers
+    ) as pool:
+        if newFile:
+            file.write(_csvText([], header=True))
+        running: Dict[Future, str] = {}
+        queue = list(reversed(pending))
+        try:
+            while queue or running:
+                # Collections are only loaded while they are in flight:
+                while queue and len(running) < maxInFlight:
+                    name = queue.pop()
+                    future = pool.submit(
+                        forecast_collection,
+                        os.path.join(directory, name),
+                        name,
+                        options,
+                    )
+                    running[future] = name
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    name = running.pop(future)
+                    try:
+                        rows = future.result()
+                    except Exception as error:  # e.g. a crashed worker
+                        rows = [{"collection": name, "error": _describe(error)}]
+                    # In one write, so that an interruption does not leave some of
+                    # the rows of a collection behind:
+                    file.write(_csvText(rows))
+                    file.flush()
+                    os.fsync(file.fileno())
+                    done += 1
+                    log("[{}/{}] {}".format(done, len(pending), name))
+        except KeyboardInterrupt:
+            pool.shutdown(cancel_futures=True)
+            raise
+    return done
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("directory", help="directory with .anki2 files")
+    parser.add_argument("output", help="CSV file to append the rows to")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=None,
+        help="collections loaded at once, defaults to the number of workers",
+    )
+    parser.add_argument(
+        "--all-decks",
+        action="store_true",
+        help="simulate every deck instead of only top level decks",
+    )
+    parser.add_argument("--exclude-overdue-cards", action="store_true")
+    parser.add_argument("--retention-cutoff-days", type=int, default=365)
+    parser.add_argument("--study-start-hour", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--jit", action="store_true", help="use the compiled loop if Numba is installed"
+    )
+    arguments = parser.parse_args(argv)
+    options = BatchOptions(
+        days=arguments.days,
+        all_decks=arguments.all_decks,
+        include_overdue_cards=not arguments.exclude_overdue_cards,
+        retention_cutoff_days=arguments.retention_cutoff_days,
+        study_start_hour=arguments.study_start_hour,
+        seed=arguments.seed,
+        jit=arguments.jit,
+    )
+    try:
+        run_batch(
+            arguments.directory,
+            arguments.output,
+            options,
+            arguments.workers,
+            arguments.max_in_flight,
+        )
+    except KeyboardInterrupt:
+        sys.exit("Interrupted, run again to continue")
+
+
+if __name__ == "__main__":
+    main()
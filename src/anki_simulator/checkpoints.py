@@ -0,0 +1,298 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Checkpoints of a simulation run, to only re-simulate the days that change
+"""
+
+from datetime import date
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .collection_simulator import DATE_ARRAY_TYPE, SimulatedCard
+from .load_balancer import DueIndex
+
+if TYPE_CHECKING:
+    from .review_simulator import ReviewSimulator
+
+# Options that only matter once intervals get long enough. Changes to the others
+# re-simulate from the first day.
+_LATE_OPTIONS = ("max_interval", "total_number_of_cards", "current_number_mature_cards")
+
+def _restoreCards(states: List[tuple]) -> List[SimulatedCard]:
+    """Cards from tuples of their attributes, in the order of their slots"""
+    if not states:
+        return []
+    return SimulatedCard.from_columns(
+        len(states), **dict(zip(SimulatedCard.__slots__, zip(*states)))
+    )
+
+
+class Checkpoint(NamedTuple):
+    """State of a run at the start of a day"""
+
+    day: int
+    rng_state: tuple
+    # Number of cards that the run had scheduled onto this day and each day after
+    # it, following the initial cards of the day:
+    scheduled: List[int]
+    # Postponed reviews with the day they were due, see ReviewSimulator._overflow:
+    overflow: List[Tuple[int, SimulatedCard]]
+    due_index: Optional[DueIndex]
+    processed: int
+    # Per-day results of the days before:
+    outputs: Tuple[list, ...]
+
+
+def _dayDigests(date_array: DATE_ARRAY_TYPE) -> List[int]:
+    return [
+        hash(
+            tuple(
+                (
+                    card.id,
+                    card.ivl,
+                    card.ease,
+                    card.state,
+                    card.step,
+                    card.delay,
+                    card.reviews,
+                    card.stability,
+                    card.difficulty,
+                    card.note,
+                )
+                for card in cards
+            )
+        )
+        for cards in date_array
+    ]
+
+
+class SimulationCheckpoints:
+    """Checkpoints of the last run of a simulation, taken every `interval` days
+
+    Pass the same instance to ReviewSimulator.simulate for consecutive runs. A run
+    with the same seed and options as the last one, except for the maximum
+    interval or the cards it starts with, resumes from the last checkpoint before
+    the first day that could differ:
+
+    - initial cards: the first day whose cards differ, e.g. when additional new
+      cards are introduced later on
+    - maximum interval: the first day on which an interval reached the lower of
+      both maximum intervals (or its fuzz range)
+
+    The prefix of the results is then reused and only the remaining days are
+    simulated. Days before the checkpoint keep their initial cards in the
+    simulator's date array. Runs with deck limits are always simulated in full.
+    """
+
+    def __init__(self, interval: int = 30):
+        self.interval: int = max(interval, 1)
+        # Day the last run resumed from, 0 if it was simulated in full:
+        self.resumed_day: int = 0
+        self._options: Optional[Dict[str, Any]] = None
+        self._maxInterval: int = 0
+        self._fuzzRanges: Tuple[Sequence[int], Sequence[int]] = ((), ())
+        self._digests: List[int] = []
+        self._initialLengths: List[int] = []
+        # Longest interval that was scheduled on each day:
+        self._peakIntervals: List[int] = []
+        self._checkpoints: List[Checkpoint] = []
+        # States of the cards scheduled onto each day, taken when the day started.
+        # Lists of due cards only grow, so the first cards of a day are those a
+        # checkpoint counted, and their state only changes once the day starts:
+        self._scheduledCards: List[List[tuple]] = []
+
+    def _comparedOptions(self, simulator: "ReviewSimulator") -> Dict[str, Any]:
+        options = {
+            key: value
+            for key, value in simulator.parameters().items()
+            if key not in _LATE_OPTIONS
+        }
+        if simulator.restDays:
+            options["first_weekday"] = date.today().weekday()
+        return options
+
+    def first_changed_day(
+        self, simulator: "ReviewSimulator", digests: Optional[List[int]] = None
+    ) -> int:
+        """First day on which the run of the simulator could differ from the last
+        run"""
+        if self._options is None or simulator.deckLimits is not None:
+            return 0
+        if self._comparedOptions(simulator) != self._options:
+            return 0
+        if digests is None:
+            digests = _dayDigests(simulator.dateArray)
+        day = len(digests)
+        if digests != self._digests:
+            if simulator.loadBalancer:
+                # Balanced intervals depend on how busy later days are
+                return 0
+            day = next(
+                index
+                for index, (digest, previous) in enumerate(zip(digests, self._digests))
+                if digest != previous
+            )
+        if simulator.maxInterval != self._maxInterval:
+            limit = min(simulator.maxInterval, self._maxInterval)
+            if simulator.fuzz or simulator.loadBalancer:
+                # Fuzz ranges are cut off at the maximum interval:
+                lowers, uppers = simulator.scheduler.fuzz_ranges(simulator)
+                previousLowers, previousUppers = self._fuzzRanges
+                # Both tables end at the same interval unless the maximum
+                # interval cuts one of them short:
+                for interval in range(
+                    min(limit + 1, len(lowers), len(previousLowers))
+                ):
+                    if (
+                        lowers[interval] != previousLowers[interval]
+                        or uppers[interval] != previousUppers[interval]
+                    ):
+                        limit = interval
+                        break
+            if simulator.restDays:
+                # Intervals that end on rest days can move up to a week later:
+                limit -= 7
+            day = min(
+                day,
+                next(
+                    (
+                        index
+                        for index, peak in enumerate(self._peakIntervals)
+                        if peak >= limit
+                    ),
+                    day,
+                ),
+            )
+        return day
+
+    def repeats_last_run(self, simulator: "ReviewSimulator") -> bool:
+        """Whether the simulator would run exactly like the last run, with the same
+        options and cards"""
+        return (
+            self._options is not None
+            and simulator.deckLimits is None
+            and simulator.maxInterval == self._maxInterval
+            and self._comparedOptions(simulator) == self._options
+            and _dayDigests(simulator.dateArray) == self._digests
+        )
+
+    def resume_day(self, simulator: "ReviewSimulator") -> int:
+        """Day the run of the simulator would resume from, 0 if it would be
+        simulated in full"""
+        changedDay = self.first_changed_day(simulator)
+        return max(
+            (
+                checkpoint.day
+                for checkpoint in self._checkpoints
+                if checkpoint.day <= changedDay
+            ),
+            default=0,
+        )
+
+    def resume(self, simulator: "ReviewSimulator") -> Optional[Checkpoint]:
+        """Called before a run starts. Restores the latest usable checkpoint into
+        the simulator and returns it, or returns None to simulate from day 0."""
+        if simulator.deckLimits is not None:
+            self._reset()
+            return None
+        digests = _dayDigests(simulator.dateArray)
+        changedDay = self.first_changed_day(simulator, digests)
+        checkpoint = None
+        if changedDay > 0:
+            for candidate in self._checkpoints:
+                if candidate.day <= changedDay:
+                    checkpoint = candidate
+        if checkpoint is None:
+            self._reset()
+        else:
+            # Later checkpoints are taken again as this run passes them:
+            del self._checkpoints[self._checkpoints.index(checkpoint) + 1 :]
+        self._options = None  # until the run finishes
+        self._digests = digests
+        self._initialLengths = [len(cards) for cards in simulator.dateArray]
+        self._maxInterval = simulator.maxInterval
+        self._fuzzRanges = (simulator._fuzzLower, simulator._fuzzUpper)
+        if checkpoint is None:
+            self.resumed_day = 0
+            return None
+        self.resumed_day = checkpoint.day
+        for cards, states, scheduled in zip(
+            simulator.dateArray[checkpoint.day :],
+            self._scheduledCards[checkpoint.day :],
+            checkpoint.scheduled,
+        ):
+            cards.extend(_restoreCards(states[:scheduled]))
+        simulator.rng.setstate(checkpoint.rng_state)
+        return checkpoint
+
+    def record(self, simulator: "ReviewSimulator", day: int, processed: int, outputs):
+        """Called at the start of every day, before anything is drawn"""
+        if simulator.deckLimits is not None:
+            return
+        initialLengths = self._initialLengths
+        scheduledCards = self._scheduledCards
+        del scheduledCards[day:]
+        # Tuples are much cheaper to take than copies of the cards:
+        scheduledCards.append(
+            [
+                (
+                    card.id,
+                    card.ivl,
+                    card.ease,
+                    card.state,
+                    card.step,
+                    card.reviews,
+                    card.delay,
+                    card.stability,
+                    card.difficulty,
+                    card.deck,
+                    card.note,
+                )
+                for card in simulator.dateArray[day][initialLengths[day] :]
+            ]
+        )
+        if day % self.interval:
+            return
+        if self._checkpoints and self._checkpoints[-1].day >= day:
+            return
+        dueIndex = simulator._dueIndex
+        self._checkpoints.append(
+            Checkpoint(
+                day,
+                simulator.rng.getstate(),
+                [
+                    len(cards) - initialLengths[index]
+                    for index, cards in enumerate(simulator.dateArray[day:], day)
+                ],
+                [(dueDay, card.copy()) for dueDay, card in simulator._overflow],
+                dueIndex.copy() if dueIndex is not None else None,
+                processed,
+                tuple(list(output) for output in outputs),
+            )
+        )
+
+    def finish(self, simulator: "ReviewSimulator", peak_intervals: List[int]):
+        """Called when a run completes"""
+        self._peakIntervals = list(peak_intervals)
+        self._options = self._comparedOptions(simulator)
+
+    def _reset(self):
+        self._options = None
+        self._checkpoints = []
+        self._peakIntervals = []
+        self._scheduledCards = []
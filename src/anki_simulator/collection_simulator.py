@@ -17,10 +17,17 @@
 # along with this program.  If not, see https://www.gnu.org/licenses/.
 
 import datetime
-from typing import List
+import gc
+import json
+from itertools import islice, repeat
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
 
 from typing import Literal, Final
 
+if TYPE_CHECKING:
+    from .deck_limits import DeckLimits
+    from .synthetic import SyntheticCollection
+
 CARD_STATE_NEW: Final = 0
 CARD_STATE_LEARNING: Final = 1
 CARD_STATE_YOUNG: Final = 2
@@ -37,7 +44,19 @@ CARD_STATES_TYPE = Literal[
 
 class SimulatedCard:
 
-    __slots__ = ("id", "ivl", "ease", "state", "step", "reviews", "delay")
+    __slots__ = (
+        "id",
+        "ivl",
+        "ease",
+        "state",
+        "step",
+        "reviews",
+        "delay",
+        "stability",
+        "difficulty",
+        "deck",
+        "note",
+    )
 
     def __init__(
         self,
@@ -47,14 +66,84 @@ class SimulatedCard:
         ease: int = 250,
         state: CARD_STATES_TYPE = CARD_STATE_NEW,
         step: int = 0,
-        delay: int = 0
+        reviews: int = 0,
+        delay: int = 0,
+        stability: float = 0.0,
+        difficulty: float = 0.0,
+        deck: int = 0,
+        note: int = -1
     ):
         self.id: int = id
         self.ivl: int = ivl
         self.ease: int = ease
         self.state: CARD_STATES_TYPE = state
         self.step: int = step
+        # Number of answers drawn for the card so far. Keys the card's common random
+        # numbers, see ReviewSimulator.
+        self.reviews: int = reviews
         self.delay: int = delay
+        # FSRS memory state. A stability of 0 means that the card has none yet.
+        self.stability: float = stability
+        self.difficulty: float = difficulty
+        # Index of the card's deck in DeckLimits, for whole collection simulations:
+        self.deck: int = deck
+        # Index of the card's note among the notes with more than one card in the
+        # simulation, see index_notes. -1 if the card has no siblings.
+        self.note: int = note
+
+    @classmethod
+    def from_columns(
+        cls, count: int, **columns: Iterable[Any]
+    ) -> List["SimulatedCard"]:
+        """Creates many cards at once from a sequence of values per attribute.
+        Attributes without values get their default. Much faster than calling
+        the constructor for every card."""
+        newCard = cls.__new__
+
+        # Positional arguments in the order of the slots. Setting all slots in one
+        # call per card is about twice as fast as one pass over the cards per slot.
+        def build(
+            id,
+            ivl,
+            ease,
+            state,
+            step,
+            reviews,
+            delay,
+            stability,
+            difficulty,
+            deck,
+            note,
+        ):
+            card = newCard(cls)
+            card.id = id
+            card.ivl = ivl
+            card.ease = ease
+            card.state = state
+            card.step = step
+            card.reviews = reviews
+            card.delay = delay
+            card.stability = stability
+            card.difficulty = difficulty
+            card.deck = deck
+            card.note = note
+            return card
+
+        values = [
+            islice(columns[name], count)
+            if columns.get(name) is not None
+            else repeat(_CARD_DEFAULTS[name], count)
+            for name in cls.__slots__
+        ]
+        # The garbage collector would otherwise scan all cards created so far
+        # again and again, although none of them can be part of a cycle:
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return list(map(build, *values))
+        finally:
+            if collecting:
+                gc.enable()
 
     def copy(self) -> "SimulatedCard":
         return SimulatedCard(
@@ -63,12 +152,53 @@ class SimulatedCard:
             ease=self.ease,
             state=self.state,
             step=self.step,
+            reviews=self.reviews,
             delay=self.delay,
+            stability=self.stability,
+            difficulty=self.difficulty,
+            deck=self.deck,
+            note=self.note,
         )
 
 
 DATE_ARRAY_TYPE = List[List[SimulatedCard]]
 
+_CARD_DEFAULTS = {
+    "ivl": 0,
+    "ease": 250,
+    "state": CARD_STATE_NEW,
+    "step": 0,
+    "reviews": 0,
+    "delay": 0,
+    "stability": 0.0,
+    "difficulty": 0.0,
+    "deck": 0,
+    "note": -1,
+}
+
+
+def index_notes(note_cards: Iterable[Tuple[int, SimulatedCard]]) -> int:
+    """Numbers the notes of (note id, card) pairs that have more than one card,
+    from 0 up, and stores the number in SimulatedCard.note of their cards, so that
+    the simulator can keep track of notes in flat arrays. Returns the number of
+    such notes."""
+    cardsByNote: Dict[int, List[SimulatedCard]] = {}
+    for nid, card in note_cards:
+        cardsByNote.setdefault(nid, []).append(card)
+    numberOfNotes = 0
+    for cards in cardsByNote.values():
+        if len(cards) > 1:
+            for card in cards:
+                card.note = numberOfNotes
+            numberOfNotes += 1
+    return numberOfNotes
+
+
+def copy_date_array(date_array: DATE_ARRAY_TYPE) -> DATE_ARRAY_TYPE:
+    """Copy of the due lists and their cards, e.g. to simulate the same cards
+    more than once. Simulations modify both in place."""
+    return [[card.copy() for card in day] for day in date_array]
+
 
 class CollectionSimulator:
     def __init__(self, mw):
@@ -96,6 +226,8 @@ class CollectionSimulator:
         while len(dateArray) < days_to_simulate:
             dateArray.append([])
         newCards = []
+        # Note of every card, for burying siblings:
+        noteCards: List[Tuple[int, SimulatedCard]] = []
         numberOfMatureCards = 0
         cids = self._mw.col.decks.cids(did, True)
         totalNumberOfCards = len(cids)
@@ -106,12 +238,18 @@ class CollectionSimulator:
             # values to be a float, so let's preemptively cast them to an int:
             fixed_card_due = round(card.due)
             fixed_card_odue = round(card.odue)
+
+            # Cards reviewed with FSRS enabled carry a memory state (Anki 23.10+):
+            memory_state = getattr(card, "memory_state", None)
+            stability = memory_state.stability if memory_state else 0.0
+            difficulty = memory_state.difficulty if memory_state else 0.0
             
             if card.type == 0:
                 # New card
                 if card.queue != -1 or include_suspended_new_cards:
                     review = SimulatedCard(id=card.id, ease=starting_ease)
                     newCards.append(review)
+                    noteCards.append((card.nid, review))
             elif card.type == 1:
                 # Learning card
                 if card.queue == -1:
@@ -134,9 +272,12 @@ class CollectionSimulator:
                     ease=starting_ease,
                     state=CARD_STATE_LEARNING,
                     step=max(number_of_learning_steps - (card.left % 1000), -1),
+                    stability=stability,
+                    difficulty=difficulty,
                 )
                 if cardDue < days_to_simulate:
                     dateArray[cardDue].append(review)
+                    noteCards.append((card.nid, review))
             elif card.type == 2:
                 # Young/mature card
                 if card.ivl >= 21:
@@ -155,7 +296,12 @@ class CollectionSimulator:
                         # Card is overdue. We will not include it in the simulation.
                         continue
                 review = SimulatedCard(
-                    id=card.id, ease=card.factor / 10, ivl=card.ivl, delay=0
+                    id=card.id,
+                    ease=card.factor / 10,
+                    ivl=card.ivl,
+                    delay=0,
+                    stability=stability,
+                    difficulty=difficulty,
                 )
                 if card.ivl >= 21:
                     review.state = CARD_STATE_MATURE
@@ -163,6 +309,7 @@ class CollectionSimulator:
                     review.state = CARD_STATE_YOUNG
                 if cardDue < days_to_simulate:
                     dateArray[cardDue].append(review)
+                    noteCards.append((card.nid, review))
             elif card.type == 3:
                 # Relearn card
                 if card.queue == -1:
@@ -187,8 +334,12 @@ class CollectionSimulator:
                         state=CARD_STATE_RELEARN,
                         ivl=card.ivl,
                         step=max(number_of_lapse_steps - (card.left % 1000), -1),
+                        stability=stability,
+                        difficulty=difficulty,
                     )
                     dateArray[cardDue].append(review)
+                    noteCards.append((card.nid, review))
+        index_notes(noteCards)
 
         if number_of_new_cards_per_day > 0:
             if number_of_additional_new_cards_to_generate > 0:
@@ -213,6 +364,183 @@ class CollectionSimulator:
 
         return (dateArray, totalNumberOfCards, numberOfMatureCards)
 
+    def generate_for_collection(
+        self,
+        days_to_simulate: int,
+        starting_ease: int,
+        number_of_learning_steps: int,
+        number_of_lapse_steps: int,
+        include_overdue_cards: bool,
+        include_suspended_new_cards: bool,
+    ) -> Tuple[DATE_ARRAY_TYPE, "DeckLimits", int, int]:
+        """Cards of all decks, with the new cards held back in per-deck queues of
+        the returned DeckLimits, which introduce them during the simulation"""
+        from .deck_limits import DeckLimits
+
+        col = self._mw.col
+        crt = datetime.date.fromtimestamp(col.crt)
+        todayInteger = (datetime.date.today() - crt).days
+        schedulerToday = col.sched.today
+
+        # Filtered decks have no limits of their own. Their cards count towards
+        # their home decks.
+        names = []
+        deckIndices = {}
+        newLimits = []
+        reviewLimits = []
+        newDoneToday = []
+        reviewsDoneToday = []
+        for entry in col.decks.all_names_and_ids():
+            deck = col.decks.get(entry.id)
+            if deck.get("dyn"):
+                continue
+            conf = col.decks.config_dict_for_deck_id(entry.id)
+            deckIndices[entry.id] = len(names)
+            names.append(entry.name)
+            newLimit = deck.get("newLimit")
+            reviewLimit = deck.get("reviewLimit")
+            newLimits.append(conf["new"]["perDay"] if newLimit is None else newLimit)
+            reviewLimits.append(
+                conf["rev"]["perDay"] if reviewLimit is None else reviewLimit
+            )
+            newDoneToday.append(
+                deck["newToday"][1] if deck["newToday"][0] == schedulerToday else 0
+            )
+            reviewsDoneToday.append(
+                deck["revToday"][1] if deck["revToday"][0] == schedulerToday else 0
+            )
+        deckLimits = DeckLimits(
+            names,
+            newLimits,
+            reviewLimits,
+            col.sched_ver(),
+            newDoneToday,
+            reviewsDoneToday,
+        )
+
+        dateArray: DATE_ARRAY_TYPE = [[] for _ in range(days_to_simulate)]
+        newCards: List[Tuple[int, SimulatedCard]] = []
+        noteCards: List[Tuple[int, SimulatedCard]] = []
+        numberOfMatureCards = 0
+        totalNumberOfCards = 0
+        # A single query instead of loading every card object, which would take
+        # minutes for large collections:
+        for cid, nid, did, odid, ctype, queue, due, odue, ivl, factor, left, data in col.db.execute(
+            "select id, nid, did, odid, type, queue, due, odue, ivl, factor, left, data"
+            " from cards"
+        ):
+            deckIndex = deckIndices.get(odid or did)
+            if deckIndex is None:
+                continue
+            totalNumberOfCards += 1
+            if ctype == 0:
+                if queue != -1 or include_suspended_new_cards:
+                    card = SimulatedCard(id=cid, ease=starting_ease, deck=deckIndex)
+                    newCards.append((due, card))
+                    noteCards.append((nid, card))
+                continue
+            if ctype == 2 and ivl >= 21:
+                numberOfMatureCards += 1
+            if queue == -1:
+                continue  # Card is suspended, so we will skip this card.
+            # old bugs with the V2 scheduler or buggy add-ons could cause due and odue
+            # values to be a float, so let's preemptively cast them to an int:
+            cardDue = round(odue or due) - todayInteger
+            if queue == 1:
+                # This is a day (re)learn card, so the due date is today.
+                cardDue = 0
+            if cardDue < 0:
+                if include_overdue_cards:
+                    cardDue = 0
+                else:
+                    # Card is overdue. We will not include it in the simulation.
+                    continue
+            if cardDue >= days_to_simulate:
+                continue
+            # FSRS memory state, if the card was reviewed with FSRS enabled:
+            stability = difficulty = 0.0
+            if data and '"s"' in data:
+                memoryState = json.loads(data)
+                stability = memoryState.get("s", 0.0)
+                difficulty = memoryState.get("d", 0.0)
+            if ctype == 1:
+                card = SimulatedCard(
+                    id=cid,
+                    ease=starting_ease,
+                    state=CARD_STATE_LEARNING,
+                    step=max(number_of_learning_steps - (left % 1000), -1),
+                )
+            elif ctype == 2:
+                card = SimulatedCard(
+                    id=cid,
+                    ease=factor / 10,
+                    ivl=ivl,
+                    state=CARD_STATE_MATURE if ivl >= 21 else CARD_STATE_YOUNG,
+                )
+            else:
+                card = SimulatedCard(
+                    id=cid,
+                    ease=factor / 10,
+                    ivl=ivl,
+                    state=CARD_STATE_RELEARN,
+                    step=max(number_of_lapse_steps - (left % 1000), -1),
+                )
+            card.stability = stability
+            card.difficulty = difficulty
+            card.deck = deckIndex
+            dateArray[cardDue].append(card)
+            noteCards.append((nid, card))
+        index_notes(noteCards)
+
+        # New cards are introduced in the order of their position, so the queues
+        # are filled from the last position down:
+        newCards.sort(key=lambda entry: entry[0], reverse=True)
+        for _, card in newCards:
+            deckLimits.newCards[card.deck].append(card)
+
+        return dateArray, deckLimits, totalNumberOfCards, numberOfMatureCards
+
+    def synthetic_collection(self, did: Optional[int] = None) -> "SyntheticCollection":
+        """Distributions of the review cards of a deck (and its subdecks) or of the
+        whole collection, to sample larger or smaller collections like it from"""
+        from collections import Counter
+
+        from .synthetic import Histogram, SyntheticCollection
+
+        col = self._mw.col
+        cids = set(col.decks.cids(did, True)) if did is not None else None
+        intervals: Counter = Counter()
+        eases: Counter = Counter()
+        difficulties: Counter = Counter()
+        relearning = 0
+        for cid, ctype, ivl, factor, data in col.db.execute(
+            "select id, type, ivl, factor, data from cards"
+            " where type in (2, 3) and queue >= 0"
+        ):
+            if cids is not None and cid not in cids:
+                continue
+            intervals[max(ivl, 1)] += 1
+            eases[factor // 10] += 1
+            if ctype == 3:
+                relearning += 1
+            try:
+                difficulty = json.loads(data).get("d") if data else None
+            except ValueError:
+                difficulty = None
+            if difficulty:
+                difficulties[round(difficulty, 1)] += 1
+        total = sum(intervals.values())
+        if not total:
+            raise ValueError("There are no review cards to take distributions from")
+        return SyntheticCollection(
+            Histogram(list(intervals), list(intervals.values())),
+            Histogram(list(eases), list(eases.values())),
+            relearning / total,
+            Histogram(list(difficulties), list(difficulties.values()))
+            if difficulties
+            else None,
+        )
+
     @staticmethod
     def generate_for_new_count(
         days_to_simulate: int,
@@ -228,13 +556,17 @@ class CollectionSimulator:
                 dateArray.append([])
                 continue
 
-            cards_for_the_day = []
             left_today = min(number_of_new_cards_per_day, cards_left)
 
-            for cid in range(left_today):
-                cards_for_the_day.append(SimulatedCard(id=cid, ease=starting_ease))
-
-            dateArray.append(cards_for_the_day)
+            # Ids are unique across days, as they are for real cards:
+            firstId = new_cards_in_deck - cards_left
+            dateArray.append(
+                SimulatedCard.from_columns(
+                    left_today,
+                    id=range(firstId, firstId + left_today),
+                    ease=repeat(starting_ease, left_today),
+                )
+            )
 
             cards_left -= left_today
 
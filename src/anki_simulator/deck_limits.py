@@ -0,0 +1,136 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Daily new card and review limits of a deck tree
+"""
+
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from .collection_simulator import SimulatedCard
+
+
+class DeckLimits:
+    """Per-deck daily limits that also apply to all subdecks, as in Anki
+
+    Decks are referred to by their index in ``names``, which SimulatedCard.deck
+    holds. A card can only be shown while its deck and every ancestor deck have
+    some of their limit left, and showing it uses up the limit of all of them.
+    Remaining limits are kept in flat per-deck counters that are reset every day,
+    and each deck's chain of ancestors is computed once up front.
+
+    With the v3 scheduler, new cards also count against the review limits and are
+    only introduced after the reviews of the day, like Anki gathers them.
+    """
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        new_limits: Sequence[int],
+        review_limits: Sequence[int],
+        scheduler_version: int = 3,
+        new_done_today: Sequence[int] = (),
+        reviews_done_today: Sequence[int] = (),
+    ):
+        self.names: List[str] = list(names)
+        self.newLimits: List[int] = list(new_limits)
+        self.reviewLimits: List[int] = list(review_limits)
+        self.v3: bool = scheduler_version >= 3
+        self.newDoneToday: List[int] = list(new_done_today) or [0] * len(names)
+        self.reviewsDoneToday: List[int] = list(reviews_done_today) or [0] * len(names)
+        indices = {name: index for index, name in enumerate(self.names)}
+        self.paths: List[Tuple[int, ...]] = []
+        for name in self.names:
+            parts = name.split("::")
+            self.paths.append(
+                tuple(
+                    indices["::".join(parts[:length])]
+                    for length in range(len(parts), 0, -1)
+                    if "::".join(parts[:length]) in indices
+                )
+            )
+        # Decks in the order Anki's deck list shows them, which is the order that
+        # new cards are gathered in:
+        self.order: List[int] = sorted(
+            range(len(self.names)), key=lambda index: self.names[index].split("::")
+        )
+        # New cards of each deck, with the one to be introduced next at the end:
+        self.newCards: List[List[SimulatedCard]] = [[] for _ in self.names]
+        self.remainingNew: List[int] = []
+        self.remainingReviews: List[int] = []
+
+    def start_day(self, day_index: int):
+        self.remainingNew = list(self.newLimits)
+        self.remainingReviews = list(self.reviewLimits)
+        if day_index == 0:
+            # Cards studied today before the simulation count as well. Anki's
+            # counts of a deck already include those of its subdecks.
+            for deck, (new, reviews) in enumerate(
+                zip(self.newDoneToday, self.reviewsDoneToday)
+            ):
+                self.remainingNew[deck] -= new
+                self.remainingReviews[deck] -= reviews + new if self.v3 else reviews
+
+    def take_review(self, deck: int) -> bool:
+        """Use up a review of the deck and its ancestors, if they have any left"""
+        path = self.paths[deck]
+        remaining = self.remainingReviews
+        for ancestor in path:
+            if remaining[ancestor] <= 0:
+                return False
+        for ancestor in path:
+            remaining[ancestor] -= 1
+        return True
+
+    def introduce_new_cards(
+        self, buried: Optional[Callable[[SimulatedCard], bool]] = None
+    ) -> List[SimulatedCard]:
+        """New cards shown today, taken from the decks in deck list order. Cards
+        for which ``buried`` returns True are passed over and stay next in line."""
+        introduced: List[SimulatedCard] = []
+        remainingNew = self.remainingNew
+        remainingReviews = self.remainingReviews
+        for deck in self.order:
+            queue = self.newCards[deck]
+            if not queue:
+                continue
+            path = self.paths[deck]
+            available = min(remainingNew[ancestor] for ancestor in path)
+            if self.v3:
+                available = min(
+                    available, min(remainingReviews[ancestor] for ancestor in path)
+                )
+            if available <= 0:
+                continue
+            if buried is None:
+                taken = queue[-available:]
+                del queue[-available:]
+                taken.reverse()
+            else:
+                taken = []
+                skipped = []
+                while queue and len(taken) < available:
+                    card = queue.pop()
+                    (skipped if buried(card) else taken).append(card)
+                queue.extend(reversed(skipped))
+            introduced.extend(taken)
+            for ancestor in path:
+                remainingNew[ancestor] -= len(taken)
+                if self.v3:
+                    remainingReviews[ancestor] -= len(taken)
+        return introduced
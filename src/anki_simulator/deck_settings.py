@@ -0,0 +1,383 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Deck options and answer statistics of a deck, as the simulator reads them
+"""
+
+import math
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional
+
+from .collection_simulator import (
+    CARD_STATE_LEARNING,
+    CARD_STATE_MATURE,
+    CARD_STATE_NEW,
+    CARD_STATE_RELEARN,
+    CARD_STATE_YOUNG,
+    CARD_STATES_TYPE,
+)
+from .profiling import Profiler
+from .review_simulator import DEFAULT_TIME_COSTS
+from .schedulers import FSRSScheduler, Scheduler, SM2Scheduler
+
+if TYPE_CHECKING:
+    from anki.collection import Collection
+
+
+class RetentionEstimate(NamedTuple):
+    """Share of correct answers in percent, with the margin of error of its 95%
+    confidence interval if there were enough answers to estimate it"""
+
+    percentage: float
+    margin_of_error: Optional[float]
+    included: float
+    total: int
+
+
+class DeckStatistics(NamedTuple):
+    # Per learning and lapse step in minutes:
+    learning_steps: Dict[float, RetentionEstimate]
+    lapse_steps: Dict[float, RetentionEstimate]
+    young: RetentionEstimate
+    mature: RetentionEstimate
+    # Seconds per answer (again, hard, good, easy) and number of answers per card
+    # state:
+    time_costs: Dict[CARD_STATES_TYPE, List[float]]
+    answer_counts: Dict[CARD_STATES_TYPE, int]
+
+
+def deck_statistics(
+    col: "Collection",
+    did: int,
+    learning_steps: List[float],
+    lapse_steps: List[float],
+    retention_cutoff_days: int,
+    profiler: Optional[Profiler] = None,
+    until: Optional[int] = None,
+) -> DeckStatistics:
+    """Retention rates and answer times of the deck and its subdecks over the last
+    `retention_cutoff_days` days, from the review log. Steps without enough
+    reviews keep default retention rates. Answers from `until` (epoch seconds) on
+    are left out, which defaults to the end of the current day."""
+    deckChildren = [childDeck[1] for childDeck in col.decks.children(did)]
+    deckChildren.append(did)
+    childrenDIDs = "(" + ", ".join(str(deckId) for deckId in deckChildren) + ")"
+    if until is None:
+        until = col.sched.day_cutoff
+    idCutOff = (until - retention_cutoff_days * 86400) * 1000
+    idEnd = until * 1000
+
+    schedulerEaseCorrection = 1 if col.sched_ver() == 1 else 0
+    if profiler:
+        profiler.start("revlog_query")
+    stats = col.db.all(
+        f"""\
+        WITH logs 
+             AS (SELECT type, 
+                        ( CASE 
+                            WHEN type = 0 
+                                 AND ease = 2 THEN {2 + schedulerEaseCorrection} 
+                            WHEN type = 0 
+                                 AND ease = 3 THEN {3 + schedulerEaseCorrection} 
+                            WHEN type = 2 
+                                 AND ease = 2 THEN {2 + schedulerEaseCorrection} 
+                            WHEN type = 2 
+                                 AND ease = 3 THEN {3 + schedulerEaseCorrection} 
+                            ELSE ease 
+                          END ) AS adjustedEase, 
+                        ( CASE 
+                            WHEN type = 0 THEN 0 
+                            WHEN type = 2 THEN 1 
+                            WHEN type = 1 
+                                 AND lastivl < 21 THEN 2 
+                            WHEN type = 1 THEN 3 
+                            WHEN type = 3 THEN 4 
+                            ELSE 5 
+                          END ) AS adjustedType, 
+                        lastivl, 
+                        time 
+                 FROM   revlog 
+                 WHERE  cid IN (SELECT cards.id 
+                                FROM   cards 
+                                       INNER JOIN notes 
+                                               ON cards.nid = notes.id 
+                                WHERE  did IN {childrenDIDs} 
+                                       AND NOT notes.tags LIKE 
+                                '%exclude-retention-rate%' 
+                               ) 
+                        AND id > {idCutOff} 
+                        AND id < {idEnd}) 
+        SELECT adjustedtype, 
+               ( CASE 
+                   WHEN lastivl < 0 THEN CAST(lastivl as float) / -60
+                 END )               AS adjustedLastIvl, 
+               Sum(adjustedease = 1) AS incorrectCount, 
+               Sum(adjustedease = 2) AS hardCount, 
+               Sum(adjustedease = 3) AS correctCount, 
+               Sum(adjustedease = 4) AS easyCount, 
+               Count(*)              AS totalCount, 
+               Sum(CASE WHEN adjustedease = 1 THEN time END) AS incorrectTime, 
+               Sum(CASE WHEN adjustedease = 2 THEN time END) AS hardTime, 
+               Sum(CASE WHEN adjustedease = 3 THEN time END) AS correctTime, 
+               Sum(CASE WHEN adjustedease = 4 THEN time END) AS easyTime 
+        FROM   logs 
+        GROUP  BY adjustedtype, 
+                  adjustedlastivl 
+        ORDER  BY adjustedtype, 
+                  adjustedlastivl """
+    )  # type 0 = learn; type 1 = relearn; type 2 = young; type 3 = mature; type 4 = cram; type 5 = reschedule
+    if profiler:
+        profiler.stop("revlog_query")
+        profiler.count("revlog_groups", len(stats))
+
+    # Setting default values for percentages:
+    learningStepsPercentages = {
+        learningStep: ((70, None, 0, 0) if index == 0 else (92, None, 0, 0))
+        for index, learningStep in enumerate(learning_steps)
+    }
+    lapseStepsPercentages = {
+        lapseStep: (92, None, 0, 0) for lapseStep in lapse_steps
+    }
+    percentageCorrectYoungCards = (90, None, 0, 0)
+    percentageCorrectMatureCards = (90, None, 0, 0)
+    # Total answer time in ms and number of answers per simulated card state,
+    # for each answer button:
+    answerTimes = {
+        state: ([0, 0, 0, 0], [0, 0, 0, 0]) for state in DEFAULT_TIME_COSTS
+    }
+
+    for (
+        type,
+        lastIvl,
+        incorrectCount,
+        hardCount,
+        correctCount,
+        easyCount,
+        totalCount,
+        incorrectTime,
+        hardTime,
+        correctTime,
+        easyTime,
+    ) in stats:
+        if totalCount > 0:
+            if type <= 3:
+                # The first answer of a new card is logged as a learning review
+                # without a previous interval:
+                if type == 0:
+                    state = CARD_STATE_NEW if lastIvl is None else CARD_STATE_LEARNING
+                else:
+                    state = (CARD_STATE_RELEARN, CARD_STATE_YOUNG, CARD_STATE_MATURE)[
+                        type - 1
+                    ]
+                timeSums, answerCounts = answerTimes[state]
+                for answer, (answerTime, count) in enumerate(
+                    (
+                        (incorrectTime, incorrectCount),
+                        (hardTime, hardCount),
+                        (correctTime, correctCount),
+                        (easyTime, easyCount),
+                    )
+                ):
+                    timeSums[answer] += answerTime or 0
+                    answerCounts[answer] += count
+            included = hardCount / 2 + correctCount + easyCount
+            percentage = included / totalCount
+            marginOfError = 196 * math.sqrt(
+                ((percentage * (1 - percentage)) / totalCount)
+            )  # for 95% confidence interval
+            marginOfErrorCutOff = 5  # only include actual percentages if the 95% margin of error from the mean
+            # is less than 5%
+            if type == 0:
+                if 0 < marginOfError <= marginOfErrorCutOff and totalCount > 10:
+                    learningStepsPercentages[lastIvl] = (
+                        percentage * 100,
+                        marginOfError,
+                        included,
+                        totalCount,
+                    )
+                else:
+                    if lastIvl in learningStepsPercentages:
+                        learningStepsPercentages[lastIvl] = (
+                            learningStepsPercentages[lastIvl][0],
+                            learningStepsPercentages[lastIvl][1],
+                            included,
+                            totalCount,
+                        )
+            elif type == 1:
+                if 0 < marginOfError <= marginOfErrorCutOff and totalCount > 10:
+                    lapseStepsPercentages[lastIvl] = (
+                        percentage * 100,
+                        marginOfError,
+                        included,
+                        totalCount,
+                    )
+                else:
+                    if lastIvl in lapseStepsPercentages:
+                        lapseStepsPercentages[lastIvl] = (
+                            lapseStepsPercentages[lastIvl][0],
+                            lapseStepsPercentages[lastIvl][1],
+                            included,
+                            totalCount,
+                        )
+            elif type == 2:
+                if 0 < marginOfError <= marginOfErrorCutOff and totalCount > 10:
+                    percentageCorrectYoungCards = (
+                        percentage * 100,
+                        marginOfError,
+                        included,
+                        totalCount,
+                    )
+                else:
+                    percentageCorrectYoungCards = (
+                        percentageCorrectYoungCards[0],
+                        percentageCorrectYoungCards[1],
+                        included,
+                        totalCount,
+                    )
+            elif type == 3:
+                if 0 < marginOfError <= marginOfErrorCutOff and totalCount > 10:
+                    percentageCorrectMatureCards = (
+                        percentage * 100,
+                        marginOfError,
+                        included,
+                        totalCount,
+                    )
+                else:
+                    percentageCorrectMatureCards = (
+                        percentageCorrectMatureCards[0],
+                        percentageCorrectMatureCards[1],
+                        included,
+                        totalCount,
+                    )
+            else:
+                break
+
+    timeCosts: Dict[CARD_STATES_TYPE, List[float]] = {}
+    answerCounts: Dict[CARD_STATES_TYPE, int] = {}
+    for state, (timeSums, counts) in answerTimes.items():
+        stateCount = sum(counts)
+        costs = []
+        for answer, (timeSum, count) in enumerate(zip(timeSums, counts)):
+            if count > 0:
+                costs.append(timeSum / count / 1000)
+            elif stateCount > 0:
+                # No answers with this button, fall back to the state average:
+                costs.append(sum(timeSums) / stateCount / 1000)
+            else:
+                costs.append(DEFAULT_TIME_COSTS[state][answer])
+        timeCosts[state] = costs
+        answerCounts[state] = stateCount
+
+    return DeckStatistics(
+        {
+            step: RetentionEstimate(*value)
+            for step, value in learningStepsPercentages.items()
+        },
+        {step: RetentionEstimate(*value) for step, value in lapseStepsPercentages.items()},
+        RetentionEstimate(*percentageCorrectYoungCards),
+        RetentionEstimate(*percentageCorrectMatureCards),
+        timeCosts,
+        answerCounts,
+    )
+
+
+class DeckSettings(NamedTuple):
+    """Settings of a simulation of the deck, as the simulator dialog fills them in"""
+
+    starting_ease: int
+    # Keyword arguments of ReviewSimulator, except for the cards and the number of
+    # days:
+    options: Dict[str, Any]
+    # FSRS weights and desired retention of the deck's preset, also if FSRS is
+    # turned off:
+    fsrs_parameters: Optional[List[float]]
+    desired_retention: float
+    statistics: DeckStatistics
+
+
+def deck_settings(
+    col: "Collection",
+    did: int,
+    retention_cutoff_days: int = 365,
+    study_start_hour: int = 8,
+    until: Optional[int] = None,
+    profiler: Optional[Profiler] = None,
+) -> DeckSettings:
+    """Simulation settings from the deck's options and review history, up to
+    `until` (epoch seconds) if given"""
+    conf = col.decks.config_dict_for_deck_id(did)
+    learningSteps = [float(step) for step in conf["new"]["delays"]]
+    lapseSteps = [float(step) for step in conf["lapse"]["delays"]]
+    statistics = deck_statistics(
+        col,
+        did,
+        learningSteps,
+        lapseSteps,
+        retention_cutoff_days,
+        profiler,
+        until=until,
+    )
+    # FSRS is available from Anki 23.10 on. Newer releases store the weights of
+    # newer FSRS versions under a new key:
+    fsrsParameters = (
+        conf.get("fsrsParams6")
+        or conf.get("fsrsParams5")
+        or conf.get("fsrsWeights")
+        or None
+    )
+    desiredRetention = conf.get("desiredRetention", 0.9)
+    scheduler: Scheduler
+    if col.get_config("fsrs", False):
+        scheduler = FSRSScheduler(fsrsParameters, desiredRetention)
+    else:
+        scheduler = SM2Scheduler()
+    rollover = col.get_config("rollover", 4)
+    options = {
+        "new_cards_per_day": conf["new"]["perDay"],
+        "interval_modifier": conf["rev"]["ivlFct"],
+        "max_reviews_per_day": conf["rev"]["perDay"],
+        "learning_steps": learningSteps,
+        "lapse_steps": lapseSteps,
+        "graduating_interval": conf["new"]["ints"][0],
+        "new_lapse_interval": conf["lapse"]["mult"],
+        "max_interval": conf["rev"]["maxIvl"],
+        "percentages_correct_for_learning_steps": [
+            int(statistics.learning_steps[step].percentage) for step in learningSteps
+        ],
+        "percentages_correct_for_lapse_steps": [
+            int(statistics.lapse_steps[step].percentage) for step in lapseSteps
+        ],
+        "percentage_good_young": int(statistics.young.percentage),
+        "percentage_good_mature": int(statistics.mature.percentage),
+        "percentage_hard_review": 0,
+        "percentage_easy_review": 0,
+        "scheduler_version": col.sched_ver(),
+        "time_costs": statistics.time_costs,
+        "scheduler": scheduler,
+        "learn_ahead_limit": col.get_config("collapseTime", 1200) / 60,
+        "minutes_until_cutoff": ((rollover - study_start_hour) % 24 or 24) * 60,
+        "bury_new": conf["new"].get("bury", False),
+        "bury_reviews": conf["rev"].get("bury", False),
+    }
+    return DeckSettings(
+        int(conf["new"]["initialFactor"] / 10),
+        options,
+        fsrsParameters,
+        desiredRetention,
+        statistics,
+    )
@@ -0,0 +1,188 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+
+"""
+Interval, ease and state distributions of the simulated cards on chosen days
+"""
+
+from typing import Iterable, List, NamedTuple, Sequence, Tuple
+
+from .collection_simulator import (
+    CARD_STATE_MATURE,
+    CARD_STATE_RELEARN,
+    CARD_STATE_YOUNG,
+    SimulatedCard,
+)
+
+STATE_LABELS = ("New", "Learning", "Young", "Mature", "Relearning")
+# Lower bounds of the interval buckets, in days:
+INTERVAL_BOUNDS = (1, 2, 4, 8, 15, 21, 31, 61, 91, 181, 366)
+# Lower bounds of the ease buckets, in percent:
+EASE_BOUNDS = (130, 150, 170, 190, 210, 230, 250, 270, 290, 310)
+
+
+def _labels(bounds: Sequence[int], unit: str) -> Tuple[str, ...]:
+    labels = []
+    for lower, upper in zip(bounds, bounds[1:]):
+        if upper - lower == 1:
+            labels.append("{}{}".format(lower, unit))
+        else:
+            labels.append("{}-{}{}".format(lower, upper - 1, unit))
+    labels.append("{}{}+".format(bounds[-1], unit))
+    return tuple(labels)
+
+
+INTERVAL_LABELS = _labels(INTERVAL_BOUNDS, "d")
+EASE_LABELS = _labels(EASE_BOUNDS, "%")
+
+
+class Snapshot(NamedTuple):
+    # Number of simulated days before the snapshot was taken:
+    day: int
+    states: Tuple[int, ...]
+    # Intervals and eases are only counted for cards that have graduated, i.e.
+    # young, mature and relearning cards:
+    intervals: Tuple[int, ...]
+    eases: Tuple[int, ...]
+
+
+class DistributionSnapshots:
+    """Histograms of the states, intervals and eases of the simulated cards
+
+    The counts are taken from all cards once when the simulation starts and are
+    then moved between buckets as cards are reviewed, so a snapshot only copies
+    the counts. Cards due after the last simulated day are not included.
+    """
+
+    def __init__(self, days: Iterable[int]):
+        # Snapshots are taken after this many simulated days. The last day of the
+        # simulation is always included.
+        self.days: List[int] = sorted(set(days))
+        self.snapshots: List[Snapshot] = []
+        self.states: List[int] = [0] * len(STATE_LABELS)
+        self.intervals: List[int] = [0] * len(INTERVAL_LABELS)
+        self.eases: List[int] = [0] * len(EASE_LABELS)
+        # Bucket of every interval and ease below the last bound:
+        self._intervalBuckets: bytes = bytes(
+            sum(interval >= bound for bound in INTERVAL_BOUNDS[1:])
+            for interval in range(INTERVAL_BOUNDS[-1])
+        )
+        self._easeBuckets: bytes = bytes(
+            sum(ease >= bound for bound in EASE_BOUNDS[1:])
+            for ease in range(EASE_BOUNDS[-1])
+        )
+        self._graduated: Tuple[bool, ...] = tuple(
+            state in (CARD_STATE_YOUNG, CARD_STATE_MATURE, CARD_STATE_RELEARN)
+            for state in range(len(STATE_LABELS))
+        )
+        self._pending: List[int] = []
+
+    def start(self, cards: Iterable[SimulatedCard], days_to_simulate: int):
+        """Counts the cards of a simulation of that many days"""
+        self.snapshots = []
+        self.states = [0] * len(STATE_LABELS)
+        self.intervals = [0] * len(INTERVAL_LABELS)
+        self.eases = [0] * len(EASE_LABELS)
+        for card in cards:
+            self.add(card.state, card.ivl, card.ease, 1)
+        # In descending order, with the next snapshot day at the end:
+        self._pending = sorted(
+            {day for day in self.days if day < days_to_simulate} | {days_to_simulate},
+            reverse=True,
+        )
+
+    def add(self, state: int, ivl: float, ease: float, count: int):
+        self.states[state] += count
+        if self._graduated[state]:
+            self.intervals[self._intervalBucket(ivl)] += count
+            self.eases[self._easeBucket(ease)] += count
+
+    def move(self, state: int, ivl: float, ease: float, card: SimulatedCard):
+        """Moves a card that was reviewed from the buckets of its previous state,
+        interval and ease to those of its current ones. Cards of a collection get
+        their ease as a float, so both are truncated to whole numbers."""
+        # Called for every review, so the lookups are inlined:
+        states = self.states
+        states[state] -= 1
+        states[card.state] += 1
+        graduated = self._graduated
+        intervalBuckets = self._intervalBuckets
+        easeBuckets = self._easeBuckets
+        if graduated[state]:
+            ivl = int(ivl)
+            ease = int(ease)
+            self.intervals[
+                intervalBuckets[ivl] if ivl < len(intervalBuckets) else -1
+            ] -= 1
+            self.eases[easeBuckets[ease] if 0 <= ease < len(easeBuckets) else -1] -= 1
+        if graduated[card.state]:
+            ivl = int(card.ivl)
+            ease = int(card.ease)
+            self.intervals[
+                intervalBuckets[ivl] if ivl < len(intervalBuckets) else -1
+            ] += 1
+            self.eases[easeBuckets[ease] if 0 <= ease < len(easeBuckets) else -1] += 1
+
+    def _intervalBucket(self, ivl: float) -> int:
+        buckets = self._intervalBuckets
+        ivl = int(ivl)
+        return buckets[ivl] if ivl < len(buckets) else len(INTERVAL_BOUNDS) - 1
+
+    def _easeBucket(self, ease: float) -> int:
+        buckets = self._easeBuckets
+        ease = int(ease)
+        return buckets[ease] if 0 <= ease < len(buckets) else len(EASE_BOUNDS) - 1
+
+    def take(self, day: int):
+        """Called after every simulated day with the number of days so far"""
+        pending = self._pending
+        while pending and pending[-1] <= day:
+            self.snapshots.append(
+                Snapshot(
+                    pending.pop(),
+                    tuple(self.states),
+                    tuple(self.intervals),
+                    tuple(self.eases),
+                )
+            )
+
+    def summary(self) -> str:
+        """The snapshots as plain text tables, one column per snapshot"""
+        if not self.snapshots:
+            return "No snapshots were taken."
+        header = "".join("{:>10}".format("Day {}".format(s.day)) for s in self.snapshots)
+        sections = []
+        for title, labels, field in (
+            ("State", STATE_LABELS, "states"),
+            ("Interval", INTERVAL_LABELS, "intervals"),
+            ("Ease", EASE_LABELS, "eases"),
+        ):
+            lines = ["{:<12}{}".format(title, header)]
+            for index, label in enumerate(labels):
+                lines.append(
+                    "{:<12}{}".format(
+                        label,
+                        "".join(
+                            "{:>10}".format(getattr(snapshot, field)[index])
+                            for snapshot in self.snapshots
+                        ),
+                    )
+                )
+            sections.append("\n".join(lines))
+        return "\n\n".join(sections)
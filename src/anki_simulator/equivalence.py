@@ -0,0 +1,461 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+
+"""
+Checks that an alternative simulation engine models the same process as
+ReviewSimulator.simulate
+
+Both engines simulate every scenario of a matrix of synthetic decks and settings
+with many seeds, the reference with one set of seeds and the candidate with
+another. Their results are compared per week (reviews, minutes and mature cards
+at the end of the week) with Welch's t-test, and per run (total and peak
+reviews, total minutes, mature cards at the end) with Welch's t-test and the
+Kolmogorov-Smirnov test. The p-values of a scenario are Holm-corrected, and a
+difference only fails the scenario if it is both significant and larger than
+the tolerance. Runs from the directory that contains this package:
+
+    python -m anki_simulator.equivalence --engine jit --seeds 30
+
+Engines are functions that take a ReviewSimulator and return its per-day results
+like ReviewSimulator.simulate, given by name (see ENGINES) or as
+module:function. They may raise NotImplementedError for scenarios that they do
+not support.
+"""
+
+import argparse
+import importlib
+import sys
+import time
+from itertools import product
+from math import exp, lgamma, log, sqrt
+from statistics import fmean, median, variance
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .collection_simulator import copy_date_array
+from .review_simulator import ReviewSimulator
+from .simulation_requests import generate_cards, normalize_request, simulator_options
+
+RESULTS_TYPE = List[Dict[str, Any]]
+ENGINE_TYPE = Callable[[ReviewSimulator], Optional[RESULTS_TYPE]]
+
+
+def _referenceEngine(simulator: ReviewSimulator) -> Optional[RESULTS_TYPE]:
+    simulator.jit = False
+    return simulator.simulate()
+
+
+def _jitEngine(simulator: ReviewSimulator) -> Optional[RESULTS_TYPE]:
+    from . import kernel
+
+    if not kernel.supports(simulator):
+        raise NotImplementedError("not supported by the compiled loop")
+    simulator.jit = True
+    return simulator.simulate()
+
+
+ENGINES: Dict[str, ENGINE_TYPE] = {
+    "reference": _referenceEngine,
+    "jit": _jitEngine,
+}
+
+# Cards of the synthetic decks, in the format of the simulation service:
+DECKS: Dict[str, Dict[str, Any]] = {
+    "new deck": {
+        "new_cards": 1500,
+        "review_cards": 300,
+        "intervals": {"lognormal": {"median": 5, "sigma": 0.8}},
+        "eases": {"normal": {"mean": 250, "sd": 10, "low": 130, "high": 350}},
+    },
+    "mature deck": {
+        "new_cards": 300,
+        "review_cards": 4000,
+        "intervals": {"lognormal": {"median": 60, "sigma": 1.0}},
+        "eases": {"normal": {"mean": 235, "sd": 30, "low": 130, "high": 350}},
+        "relearning_share": 0.02,
+    },
+}
+
+# Options that differ from the defaults of the simulation service:
+SETTINGS: Dict[str, Dict[str, Any]] = {
+    "defaults": {"max_reviews_per_day": 9999},
+    "review limit": {"max_reviews_per_day": 120},
+    "fuzz": {"max_reviews_per_day": 9999, "fuzz": True},
+    "rest days and time limit": {
+        "max_reviews_per_day": 9999,
+        "rest_days": [6],
+        "max_minutes_per_day": 25,
+    },
+    "common random numbers": {
+        "max_reviews_per_day": 9999,
+        "fuzz": True,
+        "common_random_numbers": True,
+    },
+}
+
+
+def engine(name: str) -> ENGINE_TYPE:
+    """Engine of ENGINES or a module:function name"""
+    if name in ENGINES:
+        return ENGINES[name]
+    module, _, function = name.partition(":")
+    if not function:
+        raise ValueError("Unknown engine: {}".format(name))
+    return getattr(importlib.import_module(module), function)
+
+
+# Student's t and Kolmogorov distributions, as the standard library has neither
+
+
+def _betaFraction(a: float, b: float, x: float) -> float:
+    # Continued fraction of the incomplete beta function, with Lentz's method
+    tiny = 1e-300
+    c = 1.0
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 300):
+        for numerator in (
+            m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+            -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1)),
+        ):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= c * d
+        if abs(c * d - 1) < 1e-12:
+            break
+    return result
+
+
+def regularized_beta(a: float, b: float, x: float) -> float:
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = exp(
+        lgamma(a + b) - lgamma(a) - lgamma(b) + a * log(x) + b * log(1 - x)
+    )
+    if x < (a + 1) / (a + b + 2):
+        return front * _betaFraction(a, b, x) / a
+    return 1 - front * _betaFraction(b, a, 1 - x) / b
+
+
+def welch_test(a: Sequence[float], b: Sequence[float]) -> float:
+    """Two-sided p-value of Welch's t-test for equal means"""
+    meanA, meanB = fmean(a), fmean(b)
+    errorA, errorB = variance(a) / len(a), variance(b) / len(b)
+    if errorA + errorB == 0:
+        return 1.0 if meanA == meanB else 0.0
+    t = (meanA - meanB) / sqrt(errorA + errorB)
+    degrees = (errorA + errorB) ** 2 / (
+        errorA ** 2 / (len(a) - 1) + errorB ** 2 / (len(b) - 1)
+    )
+    return regularized_beta(degrees / 2, 0.5, degrees / (degrees + t * t))
+
+
+def ks_test(a: Sequence[float], b: Sequence[float]) -> float:
+    """Asymptotic p-value of the two-sample Kolmogorov-Smirnov test, which is
+    conservative for discrete values"""
+    a, b = sorted(a), sorted(b)
+    i = j = 0
+    statistic = 0.0
+    while i < len(a) and j < len(b):
+        value = min(a[i], b[j])
+        while i < len(a) and a[i] == value:
+            i += 1
+        while j < len(b) and b[j] == value:
+            j += 1
+        statistic = max(statistic, abs(i / len(a) - j / len(b)))
+    effective = len(a) * len(b) / (len(a) + len(b))
+    x = (sqrt(effective) + 0.12 + 0.11 / sqrt(effective)) * statistic
+    if x < 0.2:
+        return 1.0
+    p = 2 * sum(
+        (-1) ** (k - 1) * exp(-2 * k * k * x * x) for k in range(1, 101)
+    )
+    return min(max(p, 0.0), 1.0)
+
+
+def holm(p_values: Sequence[float]) -> List[float]:
+    """Holm-Bonferroni adjusted p-values"""
+    order = sorted(range(len(p_values)), key=p_values.__getitem__)
+    adjusted = [1.0] * len(p_values)
+    running = 0.0
+    for rank, index in enumerate(order):
+        running = max(running, min((len(p_values) - rank) * p_values[index], 1.0))
+        adjusted[index] = running
+    return adjusted
+
+
+def metrics(days: RESULTS_TYPE) -> Dict[str, float]:
+    """Numbers that are compared between the runs of both engines"""
+    values = {
+        "total reviews": sum(day["y"] for day in days),
+        "peak reviews": max((day["y"] for day in days), default=0),
+        "total minutes": sum(day["minutes"] for day in days),
+        "final mature cards": days[-1]["matureCount"] if days else 0,
+    }
+    for week, start in enumerate(range(0, len(days), 7), 1):
+        weekDays = days[start : start + 7]
+        values["week {} reviews".format(week)] = sum(day["y"] for day in weekDays)
+        values["week {} minutes".format(week)] = sum(
+            day["minutes"] for day in weekDays
+        )
+        values["week {} mature cards".format(week)] = weekDays[-1]["matureCount"]
+    return values
+
+
+# Compared with the Kolmogorov-Smirnov test as well:
+_DISTRIBUTION_METRICS = ("total reviews", "peak reviews", "total minutes", "final mature cards")
+
+
+class Check(NamedTuple):
+    metric: str
+    test: str
+    reference: float
+    candidate: float
+    p_value: float
+    # Holm-adjusted over all checks of the scenario:
+    adjusted_p_value: float
+    passed: bool
+
+    @property
+    def difference(self) -> float:
+        """Relative difference of the candidate's mean"""
+        return (self.candidate - self.reference) / max(abs(self.reference), 1.0)
+
+
+class ScenarioResult(NamedTuple):
+    name: str
+    # Why the candidate cannot simulate the scenario, if it cannot:
+    unsupported: str
+    # Whether both engines gave the same results for the same seed:
+    identical: bool
+    checks: List[Check]
+    reference_seconds: float
+    candidate_seconds: float
+
+    @property
+    def passed(self) -> bool:
+        return all(check.passed for check in self.checks)
+
+    @property
+    def speedup(self) -> float:
+        return self.reference_seconds / self.candidate_seconds if self.candidate_seconds else 0.0
+
+
+def scenarios(days: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """Normalized simulation service requests of every deck and setting"""
+    return [
+        (
+            "{}, {}".format(deckName, settingName),
+            normalize_request(
+                {"days": days, "cards": cards, "options": {**settings, "jit": False}}
+            ),
+        )
+        for (deckName, cards), (settingName, settings) in product(
+            DECKS.items(), SETTINGS.items()
+        )
+    ]
+
+
+def _run(
+    run: ENGINE_TYPE,
+    request: Dict[str, Any],
+    cards: Tuple,
+    seed: int,
+) -> Tuple[RESULTS_TYPE, float]:
+    dateArray, totalNumberOfCards, numberOfMatureCards = cards
+    simulator = ReviewSimulator(
+        copy_date_array(dateArray),
+        request["days"],
+        total_number_of_cards=totalNumberOfCards,
+        current_number_mature_cards=numberOfMatureCards,
+        seed=seed,
+        **simulator_options(request),
+    )
+    start = time.perf_counter()
+    results = run(simulator)
+    elapsed = time.perf_counter() - start
+    if results is None:
+        raise RuntimeError("The simulation was cancelled")
+    return results, elapsed
+
+
+def compare(
+    name: str,
+    request: Dict[str, Any],
+    reference: ENGINE_TYPE,
+    candidate: ENGINE_TYPE,
+    seeds: int = 30,
+    first_seed: int = 1,
+    alpha: float = 0.01,
+    tolerance: float = 0.02,
+) -> ScenarioResult:
+    """Simulates the request with `seeds` seeds per engine and compares the
+    results. The deck is the same for all runs; only the seeds of the simulation
+    differ."""
+    cards = generate_cards(request)
+    try:
+        # Also compiles or warms up the candidate before it is timed:
+        candidateResults, _ = _run(candidate, request, cards, first_seed)
+    except NotImplementedError as error:
+        return ScenarioResult(name, str(error) or "not supported", False, [], 0.0, 0.0)
+    referenceResults, _ = _run(reference, request, cards, first_seed)
+    identical = candidateResults == referenceResults
+
+    values: Dict[str, Tuple[List[float], List[float]]] = {}
+    seconds = [0.0, 0.0]
+    for offset in range(seeds):
+        # Different seeds for both engines, so that their runs are independent:
+        for index, (run, seed) in enumerate(
+            (
+                (reference, first_seed + 1 + offset),
+                (candidate, first_seed + 1 + seeds + offset),
+            )
+        ):
+            results, elapsed = _run(run, request, cards, seed)
+            seconds[index] += elapsed
+            for metric, value in metrics(results).items():
+                values.setdefault(metric, ([], []))[index].append(value)
+
+    tests = []
+    for metric, (referenceValues, candidateValues) in values.items():
+        tests.append((metric, "t-test", welch_test(referenceValues, candidateValues)))
+        if metric in _DISTRIBUTION_METRICS:
+            tests.append((metric, "KS test", ks_test(referenceValues, candidateValues)))
+    adjusted = holm([p for _, _, p in tests])
+    checks = []
+    for (metric, test, p), adjustedP in zip(tests, adjusted):
+        referenceMean = fmean(values[metric][0])
+        candidateMean = fmean(values[metric][1])
+        # Differences within the tolerance are accepted even if they are
+        # significant, as they will be with enough seeds:
+        withinTolerance = abs(candidateMean - referenceMean) <= tolerance * max(
+            abs(referenceMean), 1.0
+        )
+        checks.append(
+            Check(
+                metric,
+                test,
+                referenceMean,
+                candidateMean,
+                p,
+                adjustedP,
+                adjustedP >= alpha or withinTolerance,
+            )
+        )
+    return ScenarioResult(
+        name, "", identical, checks, seconds[0] / seeds, seconds[1] / seeds
+    )
+
+
+def report(result: ScenarioResult) -> str:
+    if result.unsupported:
+        return "SKIP  {}: {}".format(result.name, result.unsupported)
+    worst = min(result.checks, key=lambda check: check.adjusted_p_value)
+    lines = [
+        "{}  {}: {:.1f} ms vs {:.1f} ms per run, {:.1f}x{}".format(
+            "PASS" if result.passed else "FAIL",
+            result.name,
+            result.reference_seconds * 1000,
+            result.candidate_seconds * 1000,
+            result.speedup,
+            ", identical for the same seed" if result.identical else "",
+        ),
+        "      lowest adjusted p-value {:.3g}: {} {} ({:+.2%})".format(
+            worst.adjusted_p_value, worst.metric, worst.test, worst.difference
+        ),
+    ]
+    for check in result.checks:
+        if not check.passed:
+            lines.append(
+                "      {} {}: {:.1f} vs {:.1f} ({:+.2%}), adjusted p-value {:.3g}".format(
+                    check.metric,
+                    check.test,
+                    check.reference,
+                    check.candidate,
+                    check.difference,
+                    check.adjusted_p_value,
+                )
+            )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--engine", default="jit", help="candidate engine, a name or module:function"
+    )
+    parser.add_argument("--reference", default="reference")
+    parser.add_argument("--seeds", type=int, default=30, help="runs per engine")
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--first-seed", type=int, default=1)
+    parser.add_argument("--alpha", type=float, default=0.01)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.02,
+        help="relative difference of the means that is always accepted",
+    )
+    parser.add_argument(
+        "--scenario", action="append", help="only run scenarios containing this text"
+    )
+    arguments = parser.parse_args(argv)
+    if arguments.seeds < 2:
+        parser.error("--seeds must be at least 2")
+    reference = engine(arguments.reference)
+    candidate = engine(arguments.engine)
+
+    results = []
+    for name, request in scenarios(arguments.days):
+        if arguments.scenario and not any(text in name for text in arguments.scenario):
+            continue
+        result = compare(
+            name,
+            request,
+            reference,
+            candidate,
+            arguments.seeds,
+            arguments.first_seed,
+            arguments.alpha,
+            arguments.tolerance,
+        )
+        results.append(result)
+        print(report(result), flush=True)
+
+    compared = [result for result in results if not result.unsupported]
+    failed = [result for result in compared if not result.passed]
+    print(
+        "{}: {} of {} scenarios equivalent, {} not supported, median speedup {}".format(
+            "FAIL" if failed else "PASS",
+            len(compared) - len(failed),
+            len(compared),
+            len(results) - len(compared),
+            "{:.1f}x".format(median(result.speedup for result in compared))
+            if compared
+            else "-",
+        )
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Streaming export and import of simulation results
+
+Runs are appended to a file one at a time and read back one at a time, so that
+the results of large parameter sweeps never have to be held in memory at once.
+The format is picked by the file extension:
+
+- .csv: one row per day and run
+- .jsonl: one line per run, with the per-day results stored by column
+- .asim: columnar binary file with zlib-compressed typed columns per run
+"""
+
+import csv
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import IO, Any, Dict, Iterator, List, Optional, Type
+
+from .review_simulator import ReviewSimulator
+
+RESULTS_TYPE = List[Dict[str, Any]]
+
+COLUMNAR_MAGIC = b"ASIM\x01"
+
+
+class SimulationRun:
+    """Per-day results of a simulation together with its options and seed"""
+
+    def __init__(
+        self,
+        label: str,
+        parameters: Dict[str, Any],
+        days: RESULTS_TYPE,
+        seed: Optional[int] = None,
+    ):
+        self.label: str = label
+        self.parameters: Dict[str, Any] = parameters
+        self.days: RESULTS_TYPE = days
+        self.seed: Optional[int] = (
+            seed if seed is not None else parameters.get("seed")
+        )
+
+    @classmethod
+    def from_simulator(
+        cls, label: str, simulator: ReviewSimulator, days: RESULTS_TYPE
+    ) -> "SimulationRun":
+        return cls(label, simulator.parameters(), days, simulator.seed)
+
+    def columns(self) -> Dict[str, list]:
+        names: List[str] = []
+        for day in self.days[:1]:
+            names.extend(day)
+        return {name: [day.get(name) for day in self.days] for name in names}
+
+
+def _parseNumber(value: str) -> Any:
+    if value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+class ResultWriter:
+    """Appends runs to a results file. Use as a context manager or close() it."""
+
+    def __init__(self, path: str, append: bool = True):
+        self.path = path
+        self._new = not (append and os.path.exists(path) and os.path.getsize(path))
+        self._file: IO = self._open(append)
+
+    def _open(self, append: bool) -> IO:
+        raise NotImplementedError
+
+    def write(self, run: SimulationRun):
+        raise NotImplementedError
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> "ResultWriter":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CSVResultWriter(ResultWriter):
+    """One row per day. The options of a run are stored as JSON in the row of its
+    first day."""
+
+    PREFIX_COLUMNS = ["run", "seed", "parameters"]
+
+    def _open(self, append: bool) -> IO:
+        self._fieldnames: Optional[List[str]] = None
+        if not self._new:
+            with open(self.path, newline="", encoding="utf-8") as existing:
+                self._fieldnames = next(csv.reader(existing))
+        return open(
+            self.path, "a" if append else "w", newline="", encoding="utf-8"
+        )
+
+    def write(self, run: SimulationRun):
+        if self._fieldnames is None:
+            self._fieldnames = self.PREFIX_COLUMNS + list(run.columns())
+        writer = csv.DictWriter(
+            self._file, self._fieldnames, restval="", extrasaction="ignore"
+        )
+        if self._new:
+            writer.writeheader()
+            self._new = False
+        parameters = json.dumps(run.parameters)
+        for day in run.days:
+            writer.writerow(
+                dict(day, run=run.label, seed=run.seed, parameters=parameters)
+            )
+            parameters = ""
+        self._file.flush()
+
+
+class JSONLinesResultWriter(ResultWriter):
+    def _open(self, append: bool) -> IO:
+        return open(self.path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, run: SimulationRun):
+        self._file.write(
+            json.dumps(
+                {
+                    "run": run.label,
+                    "seed": run.seed,
+                    "parameters": run.parameters,
+                    "columns": run.columns(),
+                }
+            )
+            + "\n"
+        )
+        self._file.flush()
+
+
+class ColumnarResultWriter(ResultWriter):
+    """Binary file of runs. Each run is a little-endian uint32 length followed by
+    a JSON header with the label, seed, options and column layout, then the
+    zlib-compressed columns. Integer columns are stored as int64, other numbers
+    as float64 and anything else as JSON."""
+
+    def _open(self, append: bool) -> IO:
+        file = open(self.path, "ab" if append else "wb")
+        if self._new:
+            file.write(COLUMNAR_MAGIC)
+        return file
+
+    def write(self, run: SimulationRun):
+        layout = []
+        blobs = []
+        for name, values in run.columns().items():
+            if all(type(value) is int for value in values):
+                typecode = "q"
+            elif all(type(value) in (int, float) for value in values):
+                typecode = "d"
+            else:
+                typecode = "json"
+            if typecode == "json":
+                raw = json.dumps(values).encode("utf-8")
+            else:
+                column = array(typecode, values)
+                if sys.byteorder == "big":
+                    column.byteswap()
+                raw = column.tobytes()
+            blob = zlib.compress(raw)
+            layout.append([name, typecode, len(blob)])
+            blobs.append(blob)
+        header = json.dumps(
+            {
+                "run": run.label,
+                "seed": run.seed,
+                "parameters": run.parameters,
+                "rows": len(run.days),
+                "columns": layout,
+            }
+        ).encode("utf-8")
+        self._file.write(struct.pack("<I", len(header)))
+        self._file.write(header)
+        for blob in blobs:
+            self._file.write(blob)
+        self._file.flush()
+
+
+WRITERS: Dict[str, Type[ResultWriter]] = {
+    ".csv": CSVResultWriter,
+    ".jsonl": JSONLinesResultWriter,
+    ".asim": ColumnarResultWriter,
+}
+
+
+def _extension(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError(
+            "Unsupported results file '{}'. Use one of: {}".format(
+                path, ", ".join(WRITERS)
+            )
+        )
+    return extension
+
+
+def open_writer(path: str, append: bool = True) -> ResultWriter:
+    return WRITERS[_extension(path)](path, append)
+
+
+def _runFromColumns(record: Dict[str, Any], columns: Dict[str, list]) -> SimulationRun:
+    names = list(columns)
+    days = [dict(zip(names, row)) for row in zip(*columns.values())]
+    return SimulationRun(record["run"], record["parameters"], days, record["seed"])
+
+
+def _readCSV(path: str) -> Iterator[SimulationRun]:
+    with open(path, newline="", encoding="utf-8") as file:
+        run: Optional[SimulationRun] = None
+        for row in csv.DictReader(file):
+            parameters = row.pop("parameters")
+            label = row.pop("run")
+            seed = _parseNumber(row.pop("seed"))
+            day = {
+                name: value if name == "x" else _parseNumber(value)
+                for name, value in row.items()
+            }
+            if parameters:
+                if run is not None:
+                    yield run
+                run = SimulationRun(label, json.loads(parameters), [], seed)
+            if run is not None:
+                run.days.append(day)
+        if run is not None:
+            yield run
+
+
+def _readJSONLines(path: str) -> Iterator[SimulationRun]:
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                yield _runFromColumns(record, record["columns"])
+
+
+def _readColumnar(path: str) -> Iterator[SimulationRun]:
+    with open(path, "rb") as file:
+        if file.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError("'{}' is not a simulation results file".format(path))
+        while True:
+            length = file.read(4)
+            if not length:
+                return
+            record = json.loads(file.read(struct.unpack("<I", length)[0]))
+            columns = {}
+            for name, typecode, size in record["columns"]:
+                raw = zlib.decompress(file.read(size))
+                if typecode == "json":
+                    columns[name] = json.loads(raw)
+                else:
+                    column = array(typecode)
+                    column.frombytes(raw)
+                    if sys.byteorder == "big":
+                        column.byteswap()
+                    columns[name] = column.tolist()
+            yield _runFromColumns(record, columns)
+
+
+def read_runs(path: str) -> Iterator[SimulationRun]:
+    """Runs stored in a results file, loaded one at a time"""
+    extension = _extension(path)
+    if extension == ".csv":
+        return _readCSV(path)
+    elif extension == ".jsonl":
+        return _readJSONLines(path)
+    return _readColumnar(path)
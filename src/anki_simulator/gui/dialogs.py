@@ -17,10 +17,11 @@
 # along with this program.  If not, see https://www.gnu.org/licenses/.
 
 import gc
+import os
+import sqlite3
 import time
-import math
 
-from typing import TYPE_CHECKING, Dict, List, Optional, Type, Union
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Type, Union
 
 from aqt.qt import (
     QEventLoop,
@@ -35,23 +36,57 @@ from aqt.qt import (
     QDialogButtonBox,
     QVBoxLayout,
     QLabel,
+    QPlainTextEdit,
+    QFont,
+    QListWidget,
+    QListWidgetItem,
 )
 import aqt
-from aqt.utils import restoreGeom, saveGeom, showInfo, tooltip, openLink
+from aqt.utils import getSaveFile, restoreGeom, saveGeom, showInfo, tooltip, openLink
 
 if TYPE_CHECKING:
     from aqt.main import AnkiQt
 
 from .._version import __version__
-from ..collection_simulator import CollectionSimulator
+from ..checkpoints import SimulationCheckpoints
+from ..collection_simulator import (
+    CARD_STATE_LEARNING,
+    CARD_STATE_MATURE,
+    CARD_STATE_NEW,
+    CARD_STATE_RELEARN,
+    CARD_STATE_YOUNG,
+    CollectionSimulator,
+)
+from ..deck_settings import deck_settings
+from ..distributions import DistributionSnapshots
+from ..exporter import SimulationRun, open_writer
+from ..history import HistoryStore, cards_fingerprint, run_fingerprint
 from ..review_simulator import ReviewSimulator
+from ..profiling import Profiler
+from ..schedulers import FSRSScheduler, SM2Scheduler
 from .forms import (
     about_dialog,
     anki_simulator_dialog,
     manual_dialog,
     support_dialog,
 )
-from .graph import GraphWebView
+from .graph import GraphWebView, previewSnapshot
+
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Indices of the scheduler combo box
+SCHEDULER_SM2 = 0
+SCHEDULER_FSRS = 1
+
+STATE_NAMES = {
+    CARD_STATE_NEW: "New",
+    CARD_STATE_LEARNING: "Learning",
+    CARD_STATE_YOUNG: "Young",
+    CARD_STATE_MATURE: "Mature",
+    CARD_STATE_RELEARN: "Relearning",
+}
 
 
 def listToUser(l):
@@ -81,6 +116,16 @@ def stepsAreValid(steps: List[str]):
         return True
 
 
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+def restDaysAreValid(days: List[str]):
+    for day in days:
+        if day[:3].lower() not in WEEKDAYS:
+            return False
+    return True
+
+
 def downsampleList(list: list, threshold: int):
     if len(list) <= threshold or not threshold:
         return list
@@ -121,14 +166,30 @@ class SimulatorDialog(QDialog):
         self.dialog.aboutButton.clicked.connect(self.showAboutDialog)
         self.dialog.manualButton.clicked.connect(self.showManual)
         self.dialog.supportButton.clicked.connect(self.showSupportDialog)
+        self.dialog.diagnosticsButton.clicked.connect(self.showDiagnosticsDialog)
+        self.dialog.historyButton.clicked.connect(self.showHistoryDialog)
+        self.dialog.distributionsButton.clicked.connect(self.showDistributionsDialog)
         self.dialog.useActualCardsCheckbox.toggled.connect(
             self.toggledUseActualCardsCheckbox
         )
         self.dialog.simulateAdditionalNewCardsCheckbox.toggled.connect(
             self.toggledGenerateAdditionalCardsCheckbox
         )
+        self.dialog.schedulerComboBox.currentIndexChanged.connect(
+            self.changedScheduler
+        )
         self.schedVersion = self.mw.col.sched_ver()
         self.config = self.mw.addonManager.getConfig(__name__)
+        self.profiler: Optional[Profiler] = None
+        if self.config["diagnostics"]:
+            self.profiler = Profiler(
+                cprofile=self.config["diagnostics_cprofile"],
+                trace_memory=self.config["diagnostics_tracemalloc"],
+            )
+        self.dialog.diagnosticsButton.setVisible(self.profiler is not None)
+        self.dialog.distributionsButton.setVisible(
+            bool(self.config["distribution_snapshot_days"])
+        )
         self.dialog.daysToSimulateSpinbox.setProperty(
             "value", self.config["default_days_to_simulate"]
         )
@@ -142,6 +203,17 @@ class SimulatorDialog(QDialog):
 
         self._thread = None
         self._progress = None
+        self._previewSnapshot: Optional[Dict] = None
+        self._simulator: Optional[ReviewSimulator] = None
+        self._simulatedDeckId: Optional[int] = None
+        self._cardsFingerprint = ""
+        self._history: Optional[HistoryStore] = None
+        self._distributions: Optional[DistributionSnapshots] = None
+        # Seed and checkpoints of the last run for each deck (None for mocked
+        # decks). Reruns with other settings keep the seed if they can resume from
+        # a checkpoint before the first day that changes; plain reruns and runs
+        # that start from day 0 draw a new one:
+        self._checkpoints: Dict[Optional[int], Tuple[int, SimulationCheckpoints]] = {}
 
     def _setupHooks(self):
         from aqt.gui_hooks import profile_will_close
@@ -165,9 +237,37 @@ class SimulatorDialog(QDialog):
         supportDialog = SupportDialog(parent=self)
         supportDialog.exec()
 
+    def showDiagnosticsDialog(self):
+        diagnosticsDialog = DiagnosticsDialog(self.profiler, parent=self)
+        diagnosticsDialog.exec()
+
+    def showDistributionsDialog(self):
+        distributionsDialog = DistributionsDialog(self._distributions, parent=self)
+        distributionsDialog.exec()
+
+    def history(self) -> HistoryStore:
+        # Kept in user_files, which Anki preserves when the add-on is updated:
+        if self._history is None:
+            self._history = HistoryStore(
+                os.path.join(ADDON_DIR, "user_files", "history.sqlite3")
+            )
+        return self._history
+
+    def showHistoryDialog(self):
+        deckId = (
+            self.deckChooser.selectedId()
+            if self.dialog.useActualCardsCheckbox.isChecked()
+            else None
+        )
+        historyDialog = HistoryDialog(self.history(), deckId, parent=self)
+        historyDialog.exec()
+
     def _onClose(self):
         saveGeom(self, "simulatorDialog")
         self._tearDownHooks()
+        if self._history is not None:
+            self._history.close()
+            self._history = None
 
     def reject(self):
         self._onClose()
@@ -187,183 +287,55 @@ class SimulatorDialog(QDialog):
 
     def loadDeckConfigurations(self):
         deckID = self.deckChooser.selectedId()
-        conf = self.mw.col.decks.config_dict_for_deck_id(deckID)
-        numberOfNewCardsPerDay = conf["new"]["perDay"]
-        startingEase = conf["new"]["initialFactor"] / 10.0
-        intervalModifier = conf["rev"]["ivlFct"] * 100
-        maxRevPerDay = conf["rev"]["perDay"]
-        learningSteps = conf["new"]["delays"]
-        numberOfLearningSteps = len(learningSteps)
-        lapseSteps = conf["lapse"]["delays"]
-        numberOfLapseSteps = len(lapseSteps)
-        graduatingInterval = conf["new"]["ints"][0]
-        newLapseInterval = conf["lapse"]["mult"] * 100
-        maxInterval = conf["rev"]["maxIvl"]
-
-        self.dialog.newCardsPerDaySpinbox.setProperty("value", numberOfNewCardsPerDay)
-        self.dialog.startingEaseSpinBox.setProperty("value", startingEase)
-        self.dialog.intervalModifierSpinbox.setProperty("value", intervalModifier)
-        self.dialog.maximumReviewsPerDaySpinbox.setProperty("value", maxRevPerDay)
+        self.deckSettings = settings = deck_settings(
+            self.mw.col,
+            deckID,
+            self.config["retention_cutoff_days"],
+            self.config["study_start_hour"],
+            profiler=self.profiler,
+        )
+        options = settings.options
+        learningSteps = options["learning_steps"]
+        lapseSteps = options["lapse_steps"]
+
+        self.dialog.newCardsPerDaySpinbox.setProperty(
+            "value", options["new_cards_per_day"]
+        )
+        self.dialog.startingEaseSpinBox.setProperty("value", settings.starting_ease)
+        self.dialog.intervalModifierSpinbox.setProperty(
+            "value", options["interval_modifier"] * 100
+        )
+        self.dialog.maximumReviewsPerDaySpinbox.setProperty(
+            "value", options["max_reviews_per_day"]
+        )
         self.dialog.learningStepsTextfield.setText(listToUser(learningSteps))
         self.dialog.lapseStepsTextfield.setText(listToUser(lapseSteps))
-        self.dialog.graduatingIntervalSpinbox.setProperty("value", graduatingInterval)
-        self.dialog.newLapseIntervalSpinbox.setProperty("value", newLapseInterval)
-        self.dialog.maximumIntervalSpinbox.setProperty("value", maxInterval)
+        self.dialog.graduatingIntervalSpinbox.setProperty(
+            "value", options["graduating_interval"]
+        )
+        self.dialog.newLapseIntervalSpinbox.setProperty(
+            "value", options["new_lapse_interval"] * 100
+        )
+        self.dialog.maximumIntervalSpinbox.setProperty("value", options["max_interval"])
+        self.dialog.buryNewCheckbox.setChecked(options["bury_new"])
+        self.dialog.buryReviewsCheckbox.setChecked(options["bury_reviews"])
+
+        self.fsrsParameters = settings.fsrs_parameters
+        self.dialog.schedulerComboBox.setCurrentIndex(
+            SCHEDULER_FSRS
+            if isinstance(options["scheduler"], FSRSScheduler)
+            else SCHEDULER_SM2
+        )
+        self.dialog.desiredRetentionSpinbox.setProperty(
+            "value", round(settings.desired_retention * 100)
+        )
 
         # Collecting deck stats
-        deckChildren = [
-            childDeck[1] for childDeck in self.mw.col.decks.children(deckID)
-        ]
-        deckChildren.append(deckID)
-        childrenDIDs = "(" + ", ".join(str(did) for did in deckChildren) + ")"
-        idCutOff = (
-            self.mw.col.sched.day_cutoff - self.config["retention_cutoff_days"] * 86400
-        ) * 1000
-
-        schedulerEaseCorrection = 1 if self.schedVersion == 1 else 0
-        stats = self.mw.col.db.all(
-            f"""\
-            WITH logs 
-                 AS (SELECT type, 
-                            ( CASE 
-                                WHEN type = 0 
-                                     AND ease = 2 THEN {2 + schedulerEaseCorrection} 
-                                WHEN type = 0 
-                                     AND ease = 3 THEN {3 + schedulerEaseCorrection} 
-                                WHEN type = 2 
-                                     AND ease = 2 THEN {2 + schedulerEaseCorrection} 
-                                WHEN type = 2 
-                                     AND ease = 3 THEN {3 + schedulerEaseCorrection} 
-                                ELSE ease 
-                              END ) AS adjustedEase, 
-                            ( CASE 
-                                WHEN type = 0 THEN 0 
-                                WHEN type = 2 THEN 1 
-                                WHEN type = 1 
-                                     AND lastivl < 21 THEN 2 
-                                WHEN type = 1 THEN 3 
-                                WHEN type = 3 THEN 4 
-                                ELSE 5 
-                              END ) AS adjustedType, 
-                            lastivl 
-                     FROM   revlog 
-                     WHERE  cid IN (SELECT cards.id 
-                                    FROM   cards 
-                                           INNER JOIN notes 
-                                                   ON cards.nid = notes.id 
-                                    WHERE  did IN {childrenDIDs} 
-                                           AND NOT notes.tags LIKE 
-                                    '%exclude-retention-rate%' 
-                                   ) 
-                            AND id > {idCutOff}) 
-            SELECT adjustedtype, 
-                   ( CASE 
-                       WHEN lastivl < 0 THEN CAST(lastivl as float) / -60
-                     END )               AS adjustedLastIvl, 
-                   Sum(adjustedease = 1) AS incorrectCount, 
-                   Sum(adjustedease = 2) AS hardCount, 
-                   Sum(adjustedease = 3) AS correctCount, 
-                   Sum(adjustedease = 4) AS easyCount, 
-                   Count(*)              AS totalCount 
-            FROM   logs 
-            GROUP  BY adjustedtype, 
-                      adjustedlastivl 
-            ORDER  BY adjustedtype, 
-                      adjustedlastivl """
-        )  # type 0 = learn; type 1 = relearn; type 2 = young; type 3 = mature; type 4 = cram; type 5 = reschedule
-
-        # Setting default values for percentages:
-        learningStepsPercentages = {
-            learningStep: ((70, None, 0, 0) if index == 0 else (92, None, 0, 0))
-            for index, learningStep in enumerate(learningSteps)
-        }
-        lapseStepsPercentages = {
-            lapseStep: (92, None, 0, 0) for lapseStep in lapseSteps
-        }
-        percentageCorrectYoungCards = (90, None, 0, 0)
-        percentageCorrectMatureCards = (90, None, 0, 0)
-
-        for (
-            type,
-            lastIvl,
-            incorrectCount,
-            hardCount,
-            correctCount,
-            easyCount,
-            totalCount,
-        ) in stats:
-            if totalCount > 0:
-                included = hardCount / 2 + correctCount + easyCount
-                percentage = included / totalCount
-                marginOfError = 196 * math.sqrt(
-                    ((percentage * (1 - percentage)) / totalCount)
-                )  # for 95% confidence interval
-                marginOfErrorCutOff = 5  # only include actual percentages if the 95% margin of error from the mean
-                # is less than 5%
-                if type == 0:
-                    if 0 < marginOfError <= marginOfErrorCutOff and totalCount > 10:
-                        learningStepsPercentages[lastIvl] = (
-                            percentage * 100,
-                            marginOfError,
-                            included,
-                            totalCount,
-                        )
-                    else:
-                        if lastIvl in learningStepsPercentages:
-                            learningStepsPercentages[lastIvl] = (
-                                learningStepsPercentages[lastIvl][0],
-                                learningStepsPercentages[lastIvl][1],
-                                included,
-                                totalCount,
-                            )
-                elif type == 1:
-                    if 0 < marginOfError <= marginOfErrorCutOff and totalCount > 10:
-                        lapseStepsPercentages[lastIvl] = (
-                            percentage * 100,
-                            marginOfError,
-                            included,
-                            totalCount,
-                        )
-                    else:
-                        if lastIvl in lapseStepsPercentages:
-                            lapseStepsPercentages[lastIvl] = (
-                                lapseStepsPercentages[lastIvl][0],
-                                lapseStepsPercentages[lastIvl][1],
-                                included,
-                                totalCount,
-                            )
-                elif type == 2:
-                    if 0 < marginOfError <= marginOfErrorCutOff and totalCount > 10:
-                        percentageCorrectYoungCards = (
-                            percentage * 100,
-                            marginOfError,
-                            included,
-                            totalCount,
-                        )
-                    else:
-                        percentageCorrectYoungCards = (
-                            percentageCorrectYoungCards[0],
-                            percentageCorrectYoungCards[1],
-                            included,
-                            totalCount,
-                        )
-                elif type == 3:
-                    if 0 < marginOfError <= marginOfErrorCutOff and totalCount > 10:
-                        percentageCorrectMatureCards = (
-                            percentage * 100,
-                            marginOfError,
-                            included,
-                            totalCount,
-                        )
-                    else:
-                        percentageCorrectMatureCards = (
-                            percentageCorrectMatureCards[0],
-                            percentageCorrectMatureCards[1],
-                            included,
-                            totalCount,
-                        )
-                else:
-                    break
+        statistics = settings.statistics
+        learningStepsPercentages = statistics.learning_steps
+        lapseStepsPercentages = statistics.lapse_steps
+        percentageCorrectYoungCards = statistics.young
+        percentageCorrectMatureCards = statistics.mature
         self.dialog.percentCorrectLearningTextfield.setText(
             listToUser(
                 [
@@ -414,6 +386,16 @@ class SimulatorDialog(QDialog):
                 )
         self.dialog.percentCorrectLapseTextfield.setToolTip(lapseStepsToolTip)
 
+        self.timeCosts = statistics.time_costs
+        timeCostsToolTip = "Average seconds per answer (again/hard/good/easy):"
+        for state, costs in self.timeCosts.items():
+            timeCostsToolTip += "\n- {} cards: {} ({} answers)".format(
+                STATE_NAMES[state],
+                "/".join(str(round(cost)) for cost in costs),
+                statistics.answer_counts[state],
+            )
+        self.dialog.maximumMinutesPerDaySpinbox.setToolTip(timeCostsToolTip)
+
         youngCardsMean = percentageCorrectYoungCards[0]
         youngCardsMarginOfError = percentageCorrectYoungCards[1]
         youngCardsIncluded = percentageCorrectYoungCards[2]
@@ -521,6 +503,30 @@ class SimulatorDialog(QDialog):
             return
         percentageGoodYoung = self.dialog.percentCorrectYoungSpinbox.value()
         percentageGoodMature = self.dialog.percentCorrectMatureSpinbox.value()
+        maxMinutesPerDay = int(self.dialog.maximumMinutesPerDaySpinbox.value())
+        if not restDaysAreValid(self.dialog.restDaysTextfield.text().split()):
+            showInfo("Please correctly enter 'Rest days' (e.g. 'Sat Sun')")
+            self.dialog.restDaysTextfield.setFocus()
+            return
+        restDays = [
+            WEEKDAYS.index(day[:3].lower())
+            for day in self.dialog.restDaysTextfield.text().split()
+        ]
+        loadBalancer = self.dialog.loadBalancerCheckbox.isChecked()
+        fuzz = self.dialog.fuzzCheckbox.isChecked()
+        buryNew = self.dialog.buryNewCheckbox.isChecked()
+        buryReviews = self.dialog.buryReviewsCheckbox.isChecked()
+        # Learning steps shorter than a day are simulated from the time the user
+        # starts studying until the next day starts:
+        minutesUntilCutoff = self.deckSettings.options["minutes_until_cutoff"]
+        learnAheadLimit = self.deckSettings.options["learn_ahead_limit"]
+        if self.dialog.schedulerComboBox.currentIndex() == SCHEDULER_FSRS:
+            scheduler = FSRSScheduler(
+                self.fsrsParameters,
+                self.dialog.desiredRetentionSpinbox.value() / 100,
+            )
+        else:
+            scheduler = SM2Scheduler()
 
         shouldUseActualCards = self.dialog.useActualCardsCheckbox.isChecked()
         shouldGenerateAdditionalCards = (
@@ -534,7 +540,24 @@ class SimulatorDialog(QDialog):
 
         collection_simulator = self._collection_simulator(self.mw)
 
-        if shouldUseActualCards:
+        if self.profiler:
+            self.profiler.start("load_cards")
+        deckLimits = None
+        if shouldUseActualCards and self.dialog.wholeCollectionCheckbox.isChecked():
+            # All decks at once, each with its own daily limits:
+            includeOverdueCards = self.dialog.includeOverdueCardsCheckbox.isChecked()
+            includeSuspendedNewCards = (
+                self.dialog.includeSuspendedNewCardsCheckbox.isChecked()
+            )
+            dateArray, deckLimits, totalNumberOfCards, numberOfMatureCards = collection_simulator.generate_for_collection(
+                daysToSimulate,
+                startingEase,
+                len(learningSteps),
+                len(lapseSteps),
+                includeOverdueCards,
+                includeSuspendedNewCards,
+            )
+        elif shouldUseActualCards:
             # Use actual card data for simulation
             includeOverdueCards = self.dialog.includeOverdueCardsCheckbox.isChecked()
             includeSuspendedNewCards = (
@@ -562,6 +585,17 @@ class SimulatorDialog(QDialog):
             numberOfMatureCards = 0
         else:
             raise NotImplementedError
+        if self.profiler:
+            self.profiler.stop("load_cards")
+            self.profiler.count("cards", totalNumberOfCards)
+
+        # Runs with deck limits are always simulated in full:
+        deckKey = self.deckChooser.selectedId() if shouldUseActualCards else None
+        seed, checkpoints = (
+            self._checkpoints.get(deckKey, (None, None))
+            if deckLimits is None
+            else (None, None)
+        )
 
         sim = self._review_simulator(
             dateArray,
@@ -582,11 +616,53 @@ class SimulatorDialog(QDialog):
             0,  # Percentage easy is set to 0
             self.schedVersion,
             totalNumberOfCards,
-            numberOfMatureCards
+            numberOfMatureCards,
+            time_costs=self.timeCosts,
+            max_minutes_per_day=maxMinutesPerDay,
+            scheduler=scheduler,
+            load_balancer=loadBalancer,
+            rest_days=restDays,
+            fuzz=fuzz,
+            profiler=self.profiler,
+            learn_ahead_limit=learnAheadLimit,
+            minutes_until_cutoff=minutesUntilCutoff,
+            deck_limits=deckLimits,
+            jit=self.config["jit_kernel"],
+            distributions=DistributionSnapshots(
+                self.config["distribution_snapshot_days"]
+            )
+            if self.config["distribution_snapshot_days"]
+            else None,
+            bury_new=buryNew,
+            bury_reviews=buryReviews,
+            seed=seed,
+        )
+        if checkpoints is not None and (
+            checkpoints.repeats_last_run(sim) or checkpoints.resume_day(sim) == 0
+        ):
+            # Nothing to resume, so show another sample instead of the same curve:
+            sim.reseed()
+        if deckLimits is None:
+            if checkpoints is None:
+                checkpoints = SimulationCheckpoints()
+            self._checkpoints[deckKey] = (sim.seed, checkpoints)
+
+        # Taken before the simulation modifies the cards:
+        self._previewSnapshot = previewSnapshot(sim)
+        self._cardsFingerprint = cards_fingerprint(
+            dateArray + deckLimits.newCards if deckLimits else dateArray
         )
+        self._simulatedDeckId = (
+            self.deckChooser.selectedId()
+            if shouldUseActualCards and not deckLimits
+            else None
+        )
+        self._simulator = sim
 
-        thread = SimulatorThread(sim, parent=self)
-        progress = SimulatorProgressDialog(maximum=len(dateArray), parent=self)
+        thread = SimulatorThread(
+            sim, self.config["progress_check_interval"], checkpoints, parent=self
+        )
+        progress = SimulatorProgressDialog(parent=self)
 
         thread.done.connect(self._on_simulation_done)
         thread.canceled.connect(self._on_simulation_canceled)
@@ -603,11 +679,14 @@ class SimulatorDialog(QDialog):
     def _on_simulation_done(self, data: List[Dict[str, Union[str, int]]]):
         self.__gc_qobjects()
 
-        self.numberOfSimulations += 1
         deck = self.mw.col.decks.get(self.deckChooser.selectedId())
 
         # total_cards = sum(day["y"] for day in data)
-        if self.dialog.useActualCardsCheckbox.isChecked():
+        if self._simulator and self._simulator.deckLimits:
+            simulationTitle = "{} (whole collection)".format(
+                self.dialog.simulationTitleTextfield.text()
+            )
+        elif self.dialog.useActualCardsCheckbox.isChecked():
             simulationTitle = "{} ({})".format(
                 self.dialog.simulationTitleTextfield.text(), deck["name"]
             )
@@ -616,16 +695,58 @@ class SimulatorDialog(QDialog):
                 self.dialog.simulationTitleTextfield.text()
             )
 
-        self.dialog.simulationGraph.addDataSet(
-            simulationTitle,
-            downsampleList(data, self.config["max_number_of_data_points"]),
-        )
+        exportPath = self.config["export_results_to"]
+        if exportPath and self._simulator:
+            exportPath = os.path.expanduser(exportPath)
+            try:
+                with open_writer(exportPath) as writer:
+                    writer.write(
+                        SimulationRun.from_simulator(
+                            simulationTitle, self._simulator, data
+                        )
+                    )
+            except (OSError, ValueError) as error:
+                showInfo("Could not export the results: {}".format(error))
+        if self._simulator:
+            run = SimulationRun.from_simulator(simulationTitle, self._simulator, data)
+            try:
+                self.history().add(
+                    run,
+                    run_fingerprint(
+                        run.parameters,
+                        self._cardsFingerprint,
+                        self._simulatedDeckId,
+                        data[0]["x"] if data else None,
+                    ),
+                    self._simulatedDeckId,
+                )
+            except sqlite3.Error as error:
+                tooltip("Could not save the simulation: {}".format(error), parent=self)
+
+        if self._simulator and self._simulator.distributions is not None:
+            self._distributions = self._simulator.distributions
+            self.dialog.distributionsButton.setEnabled(True)
+
+        if self.profiler:
+            self.profiler.start("graph_transfer")
+        graphPoints = self.addToGraph(simulationTitle, data)
+        if self._previewSnapshot is not None:
+            self.dialog.simulationGraph.loadPreview(self._previewSnapshot)
+        if self.profiler:
+            self.profiler.stop("graph_transfer")
+            self.profiler.count("graph_points", graphPoints)
+
+    def addToGraph(self, title: str, data: List[Dict[str, Union[str, int]]]) -> int:
+        self.numberOfSimulations += 1
+        graphData = downsampleList(data, self.config["max_number_of_data_points"])
+        self.dialog.simulationGraph.addDataSet(title, graphData)
         self.dialog.simulationTitleTextfield.setText(
             "Simulation {}".format(self.numberOfSimulations + 1)
         )
 
         self.dialog.clearLastSimulationButton.setEnabled(True)
         self.dialog.clearAllSimulationButton.setEnabled(True)
+        return len(graphData)
 
     def _on_simulation_canceled(self):
         self.__gc_qobjects()
@@ -674,6 +795,9 @@ class SimulatorDialog(QDialog):
         if not self.dialog.useActualCardsCheckbox.isChecked():
             self.dialog.simulateAdditionalNewCardsCheckbox.setChecked(True)
 
+    def changedScheduler(self, index: int):
+        self.dialog.desiredRetentionSpinbox.setEnabled(index == SCHEDULER_FSRS)
+
     def toggledGenerateAdditionalCardsCheckbox(self):
         if not self.dialog.simulateAdditionalNewCardsCheckbox.isChecked():
             self.dialog.useActualCardsCheckbox.setChecked(True)
@@ -682,18 +806,28 @@ class SimulatorDialog(QDialog):
 class SimulatorThread(QThread):
     done = pyqtSignal(object)
     canceled = pyqtSignal()
-    tick = pyqtSignal(int)
+    tick = pyqtSignal(int, int)
 
-    def __init__(self, simulator: "ReviewSimulator", *args, **kwargs):
+    def __init__(
+        self,
+        simulator: "ReviewSimulator",
+        check_interval: int,
+        checkpoints: Optional[SimulationCheckpoints] = None,
+        *args,
+        **kwargs
+    ):
         super().__init__(*args, **kwargs)
         self._simulator = simulator
+        self._checkpoints = checkpoints
+        # Number of cards the simulator processes between progress reports:
+        self.check_interval = max(check_interval, 1)
         self.do_cancel = False
-        self._last_tick = time.time()
+        self._last_tick = time.monotonic()
 
     def run(self):
         # import timeit
         # start = timeit.default_timer()
-        data = self._simulator.simulate(self)
+        data = self._simulator.simulate(self, self._checkpoints)
         # print(timeit.default_timer() - start)
         if data is None:
             self.canceled.emit()
@@ -703,22 +837,38 @@ class SimulatorThread(QThread):
     def cancel(self):
         self.do_cancel = True
 
-    def day_processed(self, day: int):
-        now = time.time()
+    def progress(self, processed: int, remaining: int) -> bool:
+        now = time.monotonic()
         if (now - self._last_tick) >= 0.1:
-            self.tick.emit(day)  # type: ignore
+            self.tick.emit(processed, remaining)  # type: ignore
             self._last_tick = now
+        return not self.do_cancel
 
 
 class SimulatorProgressDialog(QProgressDialog):
-    def __init__(self, minimum=0, maximum=100, *args, **kwargs):
-        super().__init__(minimum=minimum, maximum=maximum, *args, **kwargs)
+    def __init__(self, *args, **kwargs):
+        # Progress is shown in tenths of a percent of the processed cards
+        super().__init__(minimum=0, maximum=1000, *args, **kwargs)
         self.setLabelText("Simulating reviews...")
         self.setCancelButtonText("Cancel simulation")
-
-    @pyqtSlot(int)
-    def update(self, value):
-        self.setValue(value)
+        self._start = time.monotonic()
+
+    @pyqtSlot(int, int)
+    def update(self, processed, remaining):
+        # Cards that are scheduled later on in the simulation are not known yet,
+        # so the progress and time left are estimates that improve over time.
+        fraction = processed / (processed + remaining) if remaining else 1
+        self.setValue(int(fraction * self.maximum()))
+        elapsed = time.monotonic() - self._start
+        secondsLeft = elapsed / fraction - elapsed
+        self.setLabelText(
+            "Simulating reviews... ({:,} cards processed, about {} left)".format(
+                processed,
+                "{} s".format(round(secondsLeft))
+                if secondsLeft < 120
+                else "{} min".format(round(secondsLeft / 60)),
+            )
+        )
 
     @pyqtSlot()
     def finish(self):
@@ -771,6 +921,122 @@ class SupportDialog(QDialog):
     def onGlutanimate(self):
         openLink(self._glutanimate_link)
 
+class DiagnosticsDialog(QDialog):
+    def __init__(self, profiler: Profiler, parent):
+        QDialog.__init__(self, parent)
+        self._profiler = profiler
+
+        self.setWindowTitle("Anki Simulator Diagnostics")
+
+        self.textView = QPlainTextEdit(profiler.summary())
+        self.textView.setReadOnly(True)
+        self.textView.setMinimumSize(QSize(600, 400))
+
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        exportButton = self.buttonBox.addButton(
+            "Export JSON", QDialogButtonBox.ButtonRole.ActionRole
+        )
+        exportButton.clicked.connect(self.exportJson)
+        self.buttonBox.rejected.connect(self.reject)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.textView)
+        layout.addWidget(self.buttonBox)
+        self.setLayout(layout)
+
+    def exportJson(self):
+        path = getSaveFile(
+            self,
+            "Export diagnostics",
+            "anki_simulator_diagnostics",
+            "JSON",
+            ".json",
+            "anki_simulator_diagnostics.json",
+        )
+        if not path:
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self._profiler.to_json())
+        tooltip("Diagnostics exported", parent=self)
+
+
+class DistributionsDialog(QDialog):
+    def __init__(self, distributions: DistributionSnapshots, parent):
+        QDialog.__init__(self, parent)
+
+        self.setWindowTitle("Card distributions of the last simulation")
+
+        self.textView = QPlainTextEdit(distributions.summary())
+        self.textView.setReadOnly(True)
+        self.textView.setMinimumSize(QSize(600, 500))
+        font = self.textView.font()
+        font.setFamily("monospace")
+        font.setStyleHint(QFont.StyleHint.Monospace)
+        self.textView.setFont(font)
+
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        self.buttonBox.rejected.connect(self.reject)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.textView)
+        layout.addWidget(self.buttonBox)
+        self.setLayout(layout)
+
+
+class HistoryDialog(QDialog):
+    def __init__(self, history: HistoryStore, deck_id: Optional[int], parent):
+        QDialog.__init__(self, parent)
+        self._history = history
+        self._simulatorDialog = parent
+
+        self.setWindowTitle("Simulation history")
+
+        self.runList = QListWidget()
+        self.runList.setSelectionMode(QListWidget.SelectionMode.ExtendedSelection)
+        self.runList.setMinimumSize(QSize(500, 300))
+        self.runList.itemDoubleClicked.connect(self.addToGraph)
+        for entry in history.entries(deck_id):
+            item = QListWidgetItem(
+                "{}  —  {}, {} days".format(
+                    entry.label,
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.created)),
+                    entry.days,
+                )
+            )
+            item.setData(Qt.ItemDataRole.UserRole, entry.id)
+            self.runList.addItem(item)
+
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        addButton = self.buttonBox.addButton(
+            "Add to graph", QDialogButtonBox.ButtonRole.ActionRole
+        )
+        addButton.clicked.connect(self.addToGraph)
+        deleteButton = self.buttonBox.addButton(
+            "Delete", QDialogButtonBox.ButtonRole.ActionRole
+        )
+        deleteButton.clicked.connect(self.delete)
+        self.buttonBox.rejected.connect(self.reject)
+
+        layout = QVBoxLayout()
+        if not self.runList.count():
+            layout.addWidget(QLabel("No simulations have been saved yet."))
+        layout.addWidget(self.runList)
+        layout.addWidget(self.buttonBox)
+        self.setLayout(layout)
+
+    def addToGraph(self):
+        for item in self.runList.selectedItems():
+            run = self._history.load(item.data(Qt.ItemDataRole.UserRole))
+            if run is not None:
+                self._simulatorDialog.addToGraph(run.label, run.days)
+        tooltip("Added to graph", parent=self)
+
+    def delete(self):
+        for item in self.runList.selectedItems():
+            self._history.delete(item.data(Qt.ItemDataRole.UserRole))
+            self.runList.takeItem(self.runList.row(item))
+
+
 class ConfirmClearAllDialog(QDialog):
     def __init__(self, parent):
         QDialog.__init__(self, parent)
@@ -16,9 +16,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see https://www.gnu.org/licenses/.
 
+import base64
 import json
 import os
-from typing import Dict, List, Union
+from array import array
+from datetime import date
+from typing import Any, Dict, List, Optional, Union
 
 from aqt.qt import QUrl, QWebEngineView
 
@@ -30,9 +33,84 @@ try:
 except (ImportError, ModuleNotFoundError):
     theme_manager = None
 
+from ..collection_simulator import (
+    CARD_STATE_MATURE,
+    CARD_STATE_NEW,
+    CARD_STATE_RELEARN,
+    CARD_STATE_YOUNG,
+)
+from ..review_simulator import ReviewSimulator
+from ..schedulers import SM2Scheduler
+
 parent_dir = os.path.abspath(os.path.dirname(__file__))
 package = __name__.split(".")[0]
 
+PREVIEW_CARD_COLUMNS = ("day", "ivl", "ease", "state", "step", "delay")
+
+
+def previewSnapshot(simulator: ReviewSimulator) -> Optional[Dict[str, Any]]:
+    """Cards and options of a simulation that has not run yet, for the preview
+    engine of the graph (web/js/preview_worker.js)
+
+    The preview engine is a port of the SM-2 path of ReviewSimulator without fuzz,
+    load balancing, rest days, intraday timing, sibling burying or per-deck
+    limits. Returns None for simulations with other schedulers or of whole
+    collections.
+    """
+    if type(simulator.scheduler) is not SM2Scheduler or simulator.deckLimits:
+        return None
+    # Scheduled cards as columns that the web view turns into typed arrays. New
+    # cards are only counted, as the preview distributes them over the days itself.
+    columns = {name: array("i") for name in PREVIEW_CARD_COLUMNS}
+    newCards = 0
+    newEase = 250
+    for day, cards in enumerate(simulator.dateArray):
+        for card in cards:
+            if card.state == CARD_STATE_NEW:
+                newCards += 1
+                newEase = int(card.ease)
+                continue
+            columns["day"].append(day)
+            columns["ivl"].append(int(card.ivl))
+            columns["ease"].append(int(card.ease))
+            columns["state"].append(card.state)
+            columns["step"].append(card.step)
+            columns["delay"].append(card.delay)
+    return {
+        "cards": {
+            name: base64.b64encode(column.tobytes()).decode("ascii")
+            for name, column in columns.items()
+        },
+        "newCards": newCards,
+        "newEase": newEase,
+        "options": {
+            "startDate": date.today().isoformat(),
+            "daysToSimulate": simulator.daysToSimulate,
+            "newCardsPerDay": simulator.newCardsPerDay,
+            "intervalModifier": simulator.intervalModifier,
+            "maxReviewsPerDay": simulator.maxReviewsPerDay,
+            "maxMinutesPerDay": simulator.maxMinutesPerDay,
+            # Days after which the card is shown again:
+            "learningSteps": [int(step / 1440) for step in simulator.learningSteps],
+            "lapseSteps": [int(step / 1440) for step in simulator.lapseSteps],
+            "graduatingInterval": simulator.graduatingInterval,
+            "newLapseInterval": simulator.newLapseInterval,
+            "maxInterval": simulator.maxInterval,
+            "percentagesLearning": simulator._percentage_good[CARD_STATE_NEW],
+            "percentagesLapse": simulator._percentage_good[CARD_STATE_RELEARN],
+            "percentageHard": simulator._percentage_hard[CARD_STATE_YOUNG],
+            "percentageGoodYoung": simulator._percentage_good[CARD_STATE_YOUNG],
+            "percentageGoodMature": simulator._percentage_good[CARD_STATE_MATURE],
+            "percentageEasy": simulator._percentage_easy[CARD_STATE_YOUNG],
+            "schedulerVersion": simulator.schedulerVersion,
+            "hardFactor": simulator.scheduler.hard_factor,
+            "easyBonus": simulator.scheduler.easy_bonus,
+            "timeCosts": simulator._time_costs,
+            "totalNumberOfCards": simulator.totalNumberOfCards,
+            "currentNumberMatureCards": simulator.currentNumberMatureCards,
+        },
+    }
+
 
 class GraphWebView(AnkiWebView):
     def __init__(self, mw, *args, **kwargs):
@@ -69,6 +147,9 @@ class GraphWebView(AnkiWebView):
             "newDataSet({})".format(json.dumps(json.dumps([label, data_set])))
         )
 
+    def loadPreview(self, snapshot: Dict[str, Any]):
+        self._runJavascript("loadPreview({})".format(json.dumps(json.dumps(snapshot))))
+
     def clearLastDataset(self):
         self._runJavascript("clearLastDataset()")
 
@@ -21,6 +21,11 @@ along with this program.  If not, see https://www.gnu.org/licenses/.
 let chart;
 let ctx;
 
+// Above this many points in total, charts are updated without animations:
+const LARGE_CHART_POINTS = 2000;
+// Points drawn per dataset for each horizontal pixel of the chart:
+const POINTS_PER_PIXEL = 1;
+
 function initializeChart(isNightMode = False) {
 
   if (isNightMode) {
@@ -39,6 +44,19 @@ function initializeChart(isNightMode = False) {
     options: {
       responsive: true,
       maintainAspectRatio: false,
+      responsiveAnimationDuration: 0,
+      onResize: decimateAll,
+      elements: {
+        line: {
+          // Bezier control points are recalculated for every point on each update:
+          tension: 0
+        }
+      },
+      legend: {
+        onClick: function(event, legendItem) {
+          setDatasetVisible(legendItem.datasetIndex, !chart.isDatasetVisible(legendItem.datasetIndex));
+        }
+      },
       tooltips: {
         mode: "nearest",
         intersect: false,
@@ -50,13 +68,17 @@ function initializeChart(isNightMode = False) {
                return 'Day: ' + dayData.dayNumber
                + '\nTotal repetitions until this day: ' + dayData.accumulate
                + '\nAverage number of repetitions until this day: ' + Math.round(dayData.average)
-               + '\nAmount of cards mature (interval higher than 21 days): ' + dayData.matureCount + '/' + dayData.totalNumberOfCards + ' (' + Math.round(100 * dayData.matureCount / dayData.totalNumberOfCards) + '%)';
+               + '\nAmount of cards mature (interval higher than 21 days): ' + dayData.matureCount + '/' + dayData.totalNumberOfCards + ' (' + Math.round(100 * dayData.matureCount / dayData.totalNumberOfCards) + '%)'
+               + '\nLearning steps repeated this day: ' + dayData.learningReviews + ' (' + Math.round(dayData.learningMinutes) + ' minutes)'
+               + '\nStudy time this day: ' + Math.round(dayData.minutes) + ' minutes'
+               + '\nAverage study time until this day: ' + Math.round(dayData.accumulateMinutes / dayData.dayNumber) + ' minutes';
             }
          }
       },
       hover: {
         mode: "nearest",
-        intersect: false
+        intersect: false,
+        animationDuration: 0
       },
       scales: {
         xAxes: [
@@ -107,20 +129,267 @@ function newDataSet(dataAsJSON) {
   let parsedData = JSON.parse(dataAsJSON)
   let label = parsedData[0]
   let data = parsedData[1]
+  normalizeDates(data);
   let newDataset = {
     label: label,
     backgroundColor: color,
     borderColor: color,
-    data: data,
+    fullData: data,
+    data: decimate(data, decimationThreshold()),
     fill: false,
     pointRadius: ((parsedData.length > 1) ? 0 : 4),
     pointHoverRadius: 4
   };
   chart.data.datasets.push(newDataset);
-  chart.update();
+  updateChart();
+}
+
+function normalizeDates(data) {
+  // Numeric timestamps are used as they are by the time scale, while date
+  // strings would be parsed again for every point on every update
+  for (let point of data) {
+    if (typeof point.x === "string") {
+      let [year, month, day] = point.x.split("-").map(Number);
+      point.x = new Date(year, month - 1, day).getTime();
+    }
+  }
+}
+
+function decimationThreshold() {
+  return Math.max(Math.round(chart.width * POINTS_PER_PIXEL), 100);
+}
+
+function decimate(data, threshold) {
+  // Largest-Triangle-Three-Buckets: keeps the points that shape the line most,
+  // including peaks that plain striding would skip
+  if (data.length <= threshold) {
+    return data;
+  }
+  let sampled = [data[0]];
+  let bucketSize = (data.length - 2) / (threshold - 2);
+  let previous = 0;
+  for (let bucket = 0; bucket < threshold - 2; bucket++) {
+    let nextStart = Math.floor((bucket + 1) * bucketSize) + 1;
+    let nextEnd = Math.min(Math.floor((bucket + 2) * bucketSize) + 1, data.length);
+    let averageX = 0;
+    let averageY = 0;
+    for (let index = nextStart; index < nextEnd; index++) {
+      averageX += data[index].x;
+      averageY += data[index].y;
+    }
+    averageX /= (nextEnd - nextStart);
+    averageY /= (nextEnd - nextStart);
+
+    let start = Math.floor(bucket * bucketSize) + 1;
+    let end = Math.floor((bucket + 1) * bucketSize) + 1;
+    let previousX = data[previous].x;
+    let previousY = data[previous].y;
+    let largestArea = -1;
+    let selected = start;
+    for (let index = start; index < end; index++) {
+      let area = Math.abs(
+        (previousX - averageX) * (data[index].y - previousY)
+        - (previousX - data[index].x) * (averageY - previousY)
+      );
+      if (area > largestArea) {
+        largestArea = area;
+        selected = index;
+      }
+    }
+    sampled.push(data[selected]);
+    previous = selected;
+  }
+  sampled.push(data[data.length - 1]);
+  return sampled;
+}
+
+function decimateAll() {
+  let threshold = decimationThreshold();
+  for (let dataset of chart.data.datasets) {
+    if (dataset.fullData) {
+      dataset.data = decimate(dataset.fullData, threshold);
+    }
+  }
+}
+
+function updateChart() {
+  // Chart.js 2 animates every dataset on each update, which dominates the cost
+  // once many simulations are shown:
+  let points = 0;
+  for (let dataset of chart.data.datasets) {
+    points += dataset.data.length;
+  }
+  if (points > LARGE_CHART_POINTS) {
+    chart.update(0);
+  } else {
+    chart.update();
+  }
+}
+
+function setDatasetVisible(index, visible) {
+  // Hidden datasets keep their elements, so that showing them again does not
+  // rebuild anything
+  chart.getDatasetMeta(index).hidden = visible ? null : true;
+  chart.update(0);
 }
 
 function clearLastDataset() {
-  chart.data.datasets.splice(-1, 1);
-  chart.update();
+  // The preview dataset is not a simulation and stays in place:
+  for (let index = chart.data.datasets.length - 1; index >= 0; index--) {
+    if (!chart.data.datasets[index].isPreview) {
+      chart.data.datasets.splice(index, 1);
+      break;
+    }
+  }
+  updateChart();
+}
+
+// Preview of the last simulation with different settings, simulated by
+// preview_worker.js while the sliders are moved
+
+let previewWorker = null;
+let previewOptions = null;
+let previewBusy = false;
+let previewPending = false;
+let previewRequestId = 0;
+
+function decodeColumn(base64) {
+  let bytes = Uint8Array.from(atob(base64), (character) => character.charCodeAt(0));
+  return new Int32Array(bytes.buffer);
+}
+
+function loadPreview(snapshotAsJSON) {
+  let snapshot = JSON.parse(snapshotAsJSON);
+  let cards = {};
+  let buffers = [];
+  for (let name in snapshot.cards) {
+    cards[name] = decodeColumn(snapshot.cards[name]);
+    buffers.push(cards[name].buffer);
+  }
+  snapshot.cards = cards;
+  previewOptions = snapshot.options;
+
+  if (!previewWorker) {
+    previewWorker = new Worker("js/preview_worker.js");
+    previewWorker.onmessage = onPreviewSimulated;
+    setupPreviewControls();
+  }
+  // Transferred instead of copied, the worker owns the cards from now on:
+  previewWorker.postMessage({ type: "snapshot", snapshot: snapshot }, buffers);
+
+  let newCards = document.getElementById("preview-new-cards");
+  newCards.max = Math.max(100, 4 * previewOptions.newCardsPerDay);
+  newCards.value = previewOptions.newCardsPerDay;
+  let intervalModifier = document.getElementById("preview-interval-modifier");
+  intervalModifier.value = Math.round(previewOptions.intervalModifier * 100);
+  let maxReviews = document.getElementById("preview-max-reviews");
+  maxReviews.max = Math.max(1000, previewOptions.maxReviewsPerDay);
+  maxReviews.value = previewOptions.maxReviewsPerDay;
+  document.getElementById("preview").hidden = false;
+  requestPreview();
+}
+
+function setupPreviewControls() {
+  for (let id of ["preview-new-cards", "preview-interval-modifier", "preview-max-reviews"]) {
+    document.getElementById(id).addEventListener("input", requestPreview);
+  }
+  document.getElementById("preview-close").addEventListener("click", function () {
+    document.getElementById("preview").hidden = true;
+    removePreviewDataset();
+  });
+}
+
+function previewParameters() {
+  let newCardsPerDay = parseInt(document.getElementById("preview-new-cards").value);
+  let intervalModifier = parseInt(document.getElementById("preview-interval-modifier").value);
+  let maxReviewsPerDay = parseInt(document.getElementById("preview-max-reviews").value);
+  document.getElementById("preview-new-cards-value").textContent = newCardsPerDay;
+  document.getElementById("preview-interval-modifier-value").textContent = intervalModifier + "%";
+  document.getElementById("preview-max-reviews-value").textContent = maxReviewsPerDay;
+  return {
+    newCardsPerDay: newCardsPerDay,
+    intervalModifier: intervalModifier / 100,
+    maxReviewsPerDay: maxReviewsPerDay,
+    seed: 1
+  };
+}
+
+function requestPreview() {
+  // At most one run at a time. Slider moves during a run are coalesced into a
+  // single run with the latest values once it is done.
+  if (previewBusy) {
+    previewPending = true;
+    return;
+  }
+  previewBusy = true;
+  previewPending = false;
+  previewRequestId++;
+  previewWorker.postMessage({ type: "simulate", id: previewRequestId, params: previewParameters() });
+}
+
+function onPreviewSimulated(event) {
+  let results = event.data;
+  previewBusy = false;
+  if (previewPending) {
+    requestPreview();
+  }
+  window.requestAnimationFrame(function () {
+    drawPreview(results);
+  });
+}
+
+function drawPreview(results) {
+  if (document.getElementById("preview").hidden) {
+    return;
+  }
+  let startDate = new Date(previewOptions.startDate + "T00:00:00");
+  let data = [];
+  let accumulated = 0;
+  let matureCount = previewOptions.currentNumberMatureCards;
+  let accumulatedSeconds = 0;
+  for (let index = 0; index < results.reviews.length; index++) {
+    let day = new Date(startDate);
+    day.setDate(startDate.getDate() + index);
+    accumulated += results.reviews[index];
+    matureCount += results.matureDeltas[index];
+    accumulatedSeconds += results.seconds[index];
+    data.push({
+      x: day.getTime(),
+      y: results.reviews[index],
+      dayNumber: index + 1,
+      accumulate: accumulated,
+      average: accumulated / (index + 1),
+      totalNumberOfCards: previewOptions.totalNumberOfCards,
+      matureCount: matureCount,
+      minutes: results.seconds[index] / 60,
+      accumulateMinutes: accumulatedSeconds / 60,
+      learningReviews: results.learningReviews[index],
+      learningMinutes: results.learningSeconds[index] / 60
+    });
+  }
+  let dataset = chart.data.datasets.find((dataset) => dataset.isPreview);
+  if (!dataset) {
+    dataset = {
+      label: "Preview",
+      isPreview: true,
+      backgroundColor: "rgb(128, 128, 128)",
+      borderColor: "rgb(128, 128, 128)",
+      borderDash: [6, 4],
+      fill: false,
+      pointRadius: 0,
+      pointHoverRadius: 4
+    };
+    chart.data.datasets.push(dataset);
+  }
+  dataset.fullData = data;
+  dataset.data = decimate(data, decimationThreshold());
+  chart.update(0);
+}
+
+function removePreviewDataset() {
+  let index = chart.data.datasets.findIndex((dataset) => dataset.isPreview);
+  if (index >= 0) {
+    chart.data.datasets.splice(index, 1);
+    chart.update(0);
+  }
 }
@@ -0,0 +1,273 @@
+/*
+Anki Simulator Add-on for Anki
+
+Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as
+published by the Free Software Foundation, either version 3 of the
+License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see https://www.gnu.org/licenses/.
+*/
+
+/*
+Preview engine for the graph. A port of the SM-2 path of ReviewSimulator.simulate
+(review_simulator.py), which stays the reference. Fuzz, load balancing, rest days
+and intraday timing are not simulated.
+
+Messages:
+  {type: "snapshot", snapshot}  cards and options, see previewSnapshot() in graph.py
+  {type: "simulate", id, params}  answered with the per-day results of the run
+*/
+
+"use strict";
+
+const CARD_STATE_NEW = 0;
+const CARD_STATE_LEARNING = 1;
+const CARD_STATE_YOUNG = 2;
+const CARD_STATE_MATURE = 3;
+const CARD_STATE_RELEARN = 4;
+
+let snapshot = null;
+
+// Small seedable generator, so that moving a slider back gives the same curve
+function mulberry32(seed) {
+  return function () {
+    seed = (seed + 0x6d2b79f5) | 0;
+    let t = Math.imul(seed ^ (seed >>> 15), 1 | seed);
+    t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t;
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+  };
+}
+
+function simulate(params) {
+  const options = snapshot.options;
+  const cards = snapshot.cards;
+  const days = options.daysToSimulate;
+  const newCardsPerDay = params.newCardsPerDay;
+  const intervalModifier = params.intervalModifier;
+  const maxReviewsPerDay = params.maxReviewsPerDay;
+  const maxSecondsPerDay = options.maxMinutesPerDay * 60;
+  const learningSteps = options.learningSteps;
+  const lapseSteps = options.lapseSteps;
+  const newLapseInterval = options.newLapseInterval;
+  const maxInterval = options.maxInterval;
+  const hardFactor = options.hardFactor;
+  const easyBonus = options.easyBonus;
+  const v1 = options.schedulerVersion === 1;
+  const timeCosts = options.timeCosts;
+  const random = mulberry32(params.seed);
+
+  // Cumulative answer thresholds for a draw from 1 to 100:
+  const youngWrong = 100 - options.percentageHard - options.percentageGoodYoung - options.percentageEasy;
+  const matureWrong = 100 - options.percentageHard - options.percentageGoodMature - options.percentageEasy;
+  const thresholds = [
+    [youngWrong, youngWrong + options.percentageHard, youngWrong + options.percentageHard + options.percentageGoodYoung],
+    [matureWrong, matureWrong + options.percentageHard, matureWrong + options.percentageHard + options.percentageGoodMature],
+  ];
+
+  // Cards in typed arrays. Scheduled cards come first, then the new cards.
+  const scheduledCards = cards.day.length;
+  const newCards = Math.min(snapshot.newCards, newCardsPerDay * days);
+  const total = scheduledCards + newCards;
+  const ivl = new Int32Array(total);
+  const ease = new Int32Array(total);
+  const state = new Uint8Array(total);
+  const step = new Int32Array(total);
+  const delay = new Int32Array(total);
+  const lastDay = new Int32Array(total).fill(-1);
+  ivl.set(cards.ivl);
+  ease.set(cards.ease);
+  ease.fill(snapshot.newEase, scheduledCards);
+  state.set(cards.state);
+  step.set(cards.step);
+  delay.set(cards.delay);
+
+  // Due lists as singly linked lists, as every card is due on exactly one day:
+  const head = new Int32Array(days).fill(-1);
+  const next = new Int32Array(total);
+  function schedule(card, day) {
+    next[card] = head[day];
+    head[day] = card;
+  }
+  for (let card = 0; card < scheduledCards; card++) {
+    schedule(card, cards.day[card]);
+  }
+  for (let index = 0; index < newCards; index++) {
+    schedule(scheduledCards + index, Math.floor(index / newCardsPerDay));
+  }
+
+  // Postponed reviews and their due days, in a ring buffer from the oldest due day
+  // to the newest. They are shown before the cards due on a day.
+  const overflowCards = new Int32Array(total);
+  const overflowDays = new Int32Array(total);
+  let overflowStart = 0;
+  let overflowSize = 0;
+
+  const reviews = new Int32Array(days);
+  const matureDeltas = new Int32Array(days);
+  const seconds = new Float64Array(days);
+  const learningReviews = new Int32Array(days);
+  const learningSeconds = new Float64Array(days);
+
+  for (let day = 0; day < days; day++) {
+    let reviewsToday = 0;
+    let secondsToday = 0;
+    let overflowPending = overflowSize;
+    while (true) {
+      let card;
+      let dueDay = day;
+      if (overflowPending > 0) {
+        overflowPending--;
+        card = overflowCards[overflowStart];
+        dueDay = overflowDays[overflowStart];
+        overflowStart = (overflowStart + 1) % total;
+        overflowSize--;
+      } else if (head[day] !== -1) {
+        card = head[day];
+        head[day] = next[card];
+      } else {
+        break;
+      }
+      const originalState = state[card];
+      const isReview = originalState === CARD_STATE_YOUNG || originalState === CARD_STATE_MATURE;
+
+      // Postpone reviews above the limits, keeping the order of their due days:
+      if (isReview) {
+        if (reviewsToday + 1 > maxReviewsPerDay || (maxSecondsPerDay && secondsToday >= maxSecondsPerDay)) {
+          let position;
+          if (dueDay === day) {
+            position = (overflowStart + overflowSize) % total;
+          } else {
+            overflowStart = (overflowStart + total - 1) % total;
+            position = overflowStart;
+            overflowPending = 0;
+          }
+          overflowCards[position] = card;
+          overflowDays[position] = dueDay;
+          overflowSize++;
+          continue;
+        }
+        reviewsToday++;
+        delay[card] += day - dueDay;
+      }
+
+      const randNumber = Math.floor(random() * 100) + 1;
+      let answer;
+      let daysToAdd;
+      if (isReview) {
+        const [wrongUntil, hardUntil, goodUntil] = thresholds[originalState === CARD_STATE_MATURE ? 1 : 0];
+        if (randNumber <= wrongUntil) {
+          answer = 0;
+          ease[card] = Math.max(ease[card] - 20, 130);
+          ivl[card] = Math.max(Math.floor(ivl[card] * newLapseInterval), 1);
+          delay[card] = 0;
+          state[card] = CARD_STATE_RELEARN;
+          step[card] = 0;
+          daysToAdd = lapseSteps[0];
+        } else {
+          const currentInterval = ivl[card];
+          const cardDelay = delay[card];
+          let hardInterval = (v1 ? currentInterval + Math.floor(cardDelay / 4) : currentInterval) * hardFactor;
+          hardInterval = Math.max(hardInterval * intervalModifier, currentInterval + 1);
+          let interval;
+          if (randNumber <= hardUntil) {
+            answer = 1;
+            ease[card] = Math.max(ease[card] - 15, 130);
+            interval = hardInterval;
+          } else {
+            const goodInterval = Math.max(
+              (currentInterval + Math.floor(cardDelay / 2)) * (ease[card] / 100) * intervalModifier,
+              hardInterval + 1
+            );
+            if (randNumber <= goodUntil) {
+              answer = 2;
+              interval = goodInterval;
+            } else {
+              answer = 3;
+              interval = Math.max(
+                (currentInterval + cardDelay) * (ease[card] / 100) * easyBonus * intervalModifier,
+                goodInterval + 1
+              );
+              ease[card] += 15;
+            }
+          }
+          ivl[card] = Math.floor(Math.min(interval, maxInterval));
+          delay[card] = 0;
+          if (ivl[card] >= 21) {
+            state[card] = CARD_STATE_MATURE;
+          }
+          daysToAdd = ivl[card];
+        }
+      } else {
+        const relearning = originalState === CARD_STATE_RELEARN;
+        const steps = relearning ? lapseSteps : learningSteps;
+        const percentages = relearning ? options.percentagesLapse : options.percentagesLearning;
+        answer = randNumber <= 100 - percentages[step[card]] ? 0 : 2;
+        if (answer === 0) {
+          if (relearning) {
+            ivl[card] = Math.max(Math.floor(ivl[card] * newLapseInterval), 1);
+          }
+          state[card] = relearning ? CARD_STATE_RELEARN : CARD_STATE_LEARNING;
+          step[card] = 0;
+          daysToAdd = steps[0];
+        } else if (step[card] < steps.length - 1) {
+          state[card] = relearning ? CARD_STATE_RELEARN : CARD_STATE_LEARNING;
+          step[card]++;
+          daysToAdd = steps[step[card]];
+        } else {
+          if (!relearning) {
+            ivl[card] = options.graduatingInterval;
+          }
+          state[card] = ivl[card] >= 21 ? CARD_STATE_MATURE : CARD_STATE_YOUNG;
+          daysToAdd = ivl[card];
+        }
+        if (lastDay[card] === day) {
+          learningReviews[day]++;
+          learningSeconds[day] += timeCosts[originalState * 4 + answer];
+        }
+      }
+      lastDay[card] = day;
+      reviews[day]++;
+      secondsToday += timeCosts[originalState * 4 + answer];
+
+      if (originalState !== CARD_STATE_MATURE && state[card] === CARD_STATE_MATURE) {
+        matureDeltas[day]++;
+      } else if (originalState === CARD_STATE_MATURE && state[card] !== CARD_STATE_MATURE) {
+        matureDeltas[day]--;
+      }
+      if (day + daysToAdd < days) {
+        schedule(card, day + daysToAdd);
+      }
+    }
+    seconds[day] = secondsToday;
+  }
+  return { reviews, matureDeltas, seconds, learningReviews, learningSeconds };
+}
+
+self.onmessage = function (event) {
+  const message = event.data;
+  if (message.type === "snapshot") {
+    snapshot = message.snapshot;
+  } else if (message.type === "simulate" && snapshot) {
+    const start = performance.now();
+    const results = simulate(message.params);
+    results.id = message.id;
+    results.elapsed = performance.now() - start;
+    postMessage(results, [
+      results.reviews.buffer,
+      results.matureDeltas.buffer,
+      results.seconds.buffer,
+      results.learningReviews.buffer,
+      results.learningSeconds.buffer,
+    ]);
+  }
+};
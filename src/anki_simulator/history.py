@@ -0,0 +1,191 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Persistent history of simulation runs
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from array import array
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .collection_simulator import DATE_ARRAY_TYPE
+from .exporter import SimulationRun
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    deck_id INTEGER,
+    label TEXT NOT NULL,
+    fingerprint TEXT NOT NULL UNIQUE,
+    seed TEXT,
+    parameters TEXT NOT NULL,
+    days INTEGER NOT NULL,
+    results BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_deck_created ON runs (deck_id, created);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created);
+"""
+
+
+class HistoryEntry(NamedTuple):
+    id: int
+    created: float
+    deck_id: Optional[int]
+    label: str
+    days: int
+
+
+def cards_fingerprint(date_array: DATE_ARRAY_TYPE) -> str:
+    """Digest of the cards a simulation starts from"""
+    digest = hashlib.blake2b(digest_size=16)
+    for day, cards in enumerate(date_array):
+        values = array("q", [day, len(cards)])
+        memoryStates = array("d")
+        for card in cards:
+            values.extend(
+                (card.id, int(card.ivl), int(card.ease), card.state, card.step, card.delay)
+            )
+            memoryStates.extend((card.stability, card.difficulty))
+        digest.update(values.tobytes())
+        digest.update(memoryStates.tobytes())
+    return digest.hexdigest()
+
+
+def run_fingerprint(
+    parameters: Dict[str, Any],
+    cards_digest: str,
+    deck_id: Optional[int],
+    start_date: Optional[str] = None,
+) -> str:
+    """Identifies runs of the same cards with the same options from the same
+    start date. The seed is left out, so that repeating a simulation on the same
+    day does not add another entry."""
+    options = {key: value for key, value in parameters.items() if key != "seed"}
+    payload = json.dumps([deck_id, cards_digest, options, start_date], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class HistoryStore:
+    """SQLite database of simulation runs with their options and compressed
+    per-day results
+
+    Listing runs only reads the indexed metadata columns. Results are
+    decompressed when a run is loaded.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript(SCHEMA)
+        self._db.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+
+    def add(
+        self, run: SimulationRun, fingerprint: str, deck_id: Optional[int] = None
+    ) -> Tuple[int, bool]:
+        """Store a run, returning its id and whether it was new. An identical run
+        that is already stored is replaced by it and moved to the top of the
+        history."""
+        now = time.time()
+        results = zlib.compress(json.dumps(run.columns()).encode("utf-8"))
+        with self._db:
+            row = self._db.execute(
+                "SELECT id FROM runs WHERE fingerprint = ?", (fingerprint,)
+            ).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE runs SET created = ?, label = ?, seed = ?, parameters = ?,"
+                    " days = ?, results = ? WHERE id = ?",
+                    (
+                        now,
+                        run.label,
+                        None if run.seed is None else str(run.seed),
+                        json.dumps(run.parameters),
+                        len(run.days),
+                        results,
+                        row[0],
+                    ),
+                )
+                return row[0], False
+            cursor = self._db.execute(
+                "INSERT INTO runs"
+                " (created, deck_id, label, fingerprint, seed, parameters, days, results)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    now,
+                    deck_id,
+                    run.label,
+                    fingerprint,
+                    None if run.seed is None else str(run.seed),
+                    json.dumps(run.parameters),
+                    len(run.days),
+                    results,
+                ),
+            )
+            return cursor.lastrowid, True
+
+    def entries(
+        self, deck_id: Optional[int] = None, limit: int = 100
+    ) -> List[HistoryEntry]:
+        """Most recent runs first, optionally only those of a deck"""
+        if deck_id is None:
+            rows = self._db.execute(
+                "SELECT id, created, deck_id, label, days FROM runs"
+                " ORDER BY created DESC LIMIT ?",
+                (limit,),
+            )
+        else:
+            rows = self._db.execute(
+                "SELECT id, created, deck_id, label, days FROM runs"
+                " WHERE deck_id = ? ORDER BY created DESC LIMIT ?",
+                (deck_id, limit),
+            )
+        return [HistoryEntry(*row) for row in rows]
+
+    def load(self, run_id: int) -> Optional[SimulationRun]:
+        row = self._db.execute(
+            "SELECT label, seed, parameters, results FROM runs WHERE id = ?",
+            (run_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        label, seed, parameters, results = row
+        columns = json.loads(zlib.decompress(results))
+        names = list(columns)
+        days = [dict(zip(names, values)) for values in zip(*columns.values())]
+        return SimulationRun(
+            label, json.loads(parameters), days, int(seed) if seed else None
+        )
+
+    def delete(self, run_id: int):
+        with self._db:
+            self._db.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+
+    def close(self):
+        self._db.close()
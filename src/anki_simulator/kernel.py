@@ -0,0 +1,633 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+JIT compiled simulation loop over flat arrays, used when Numba is installed
+
+A port of ReviewSimulator.simulate for the SM-2 scheduler, which stays the
+reference. Cards live in typed arrays and the due lists of the days are linked
+lists, so a run does not create any Python objects. Random numbers come from the
+same sources as in the pure Python loop: a port of Python's Mersenne Twister that
+continues from the state of the simulator's generator, or the common random
+number hash. Seeded runs therefore give the same results with either engine.
+
+Not supported, and simulated by the pure Python loop instead: other schedulers,
+the load balancer, deck limits, distribution snapshots, burying siblings, decks
+without learning or lapse steps, and invalid answer percentages or time costs,
+see supports(). Runs with checkpoints are supported, but always simulate all days
+and do not record checkpoints.
+
+The loop itself does about 7 to 10 million reviews per second on one core of a
+server CPU. Copying the cards into arrays and back, see simulate(), adds about
+60% to that when the cards get about ten reviews each.
+"""
+
+from itertools import chain
+from operator import attrgetter
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from .collection_simulator import (
+    CARD_STATE_LEARNING,
+    CARD_STATE_MATURE,
+    CARD_STATE_NEW,
+    CARD_STATE_RELEARN,
+    CARD_STATE_YOUNG,
+)
+from .schedulers import SM2Scheduler
+
+if TYPE_CHECKING:
+    from .review_simulator import ReviewSimulator
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:  # optional dependency
+    np = None
+    njit = None
+
+_MASK32 = 0xFFFFFFFF
+
+
+def _jit(function):
+    return njit(cache=True, nogil=True)(function) if njit is not None else function
+
+
+def available() -> bool:
+    return njit is not None
+
+
+def supports(simulator: "ReviewSimulator") -> bool:
+    """Whether the kernel can run the simulation exactly like the Python loop"""
+    if not available() or type(simulator.scheduler) is not SM2Scheduler:
+        return False
+    if simulator.loadBalancer or simulator.deckLimits is not None:
+        return False
+    if simulator.distributions is not None:
+        return False
+    if simulator.buryNew or simulator.buryReviews:
+        return False
+    if not simulator.learningSteps or not simulator.lapseSteps:
+        return False
+    for state in (CARD_STATE_YOUNG, CARD_STATE_MATURE):
+        if (
+            simulator._percentage_hard[state]
+            + simulator._percentage_good[state]
+            + simulator._percentage_easy[state]
+            > 100
+        ):
+            return False
+    for state in (CARD_STATE_LEARNING, CARD_STATE_RELEARN):
+        percentages = simulator._percentage_good[state]
+        steps = (
+            simulator.learningSteps
+            if state == CARD_STATE_LEARNING
+            else simulator.lapseSteps
+        )
+        if len(percentages) < len(steps) or any(
+            not 0 <= percentage <= 100 for percentage in percentages
+        ):
+            return False
+    return all(0 <= cost for cost in simulator._time_costs)
+
+
+# Mersenne Twister, as in CPython's _randommodule.c. The state is kept in an int64
+# array to stay clear of unsigned integer promotion rules.
+
+
+@_jit
+def _genrandUint32(mt, position):
+    index = position[0]
+    if index >= 624:
+        for kk in range(624):
+            y = (mt[kk] & 0x80000000) | (mt[(kk + 1) % 624] & 0x7FFFFFFF)
+            value = mt[(kk + 397) % 624] ^ (y >> 1)
+            if y & 1:
+                value ^= 0x9908B0DF
+            mt[kk] = value
+        index = 0
+    y = mt[index]
+    position[0] = index + 1
+    y ^= y >> 11
+    y ^= (y << 7) & 0x9D2C5680
+    y ^= (y << 15) & 0xEFC60000
+    y ^= y >> 18
+    return y & 0xFFFFFFFF
+
+
+@_jit
+def _random(mt, position):
+    a = _genrandUint32(mt, position) >> 5
+    b = _genrandUint32(mt, position) >> 6
+    return (a * 67108864.0 + b) * (1.0 / 9007199254740992.0)
+
+
+@_jit
+def _fillShorts(mt, position, shorts, count):
+    # Same values as _randomShorts(rng.getrandbits, count) in review_simulator.py
+    for word in range((count + 1) // 2):
+        r = _genrandUint32(mt, position)
+        if 2 * word + 1 < count:
+            shorts[2 * word] = r & 0xFFFF
+            shorts[2 * word + 1] = r >> 16
+        else:
+            shorts[2 * word] = r >> 16 if count % 2 else r & 0xFFFF
+            if count % 2 == 0:
+                shorts[2 * word + 1] = r >> 16
+    return count
+
+
+@_jit
+def _commonRandomBits(seed, card_id, review):
+    # Same as _commonRandomBits in review_simulator.py, in wrapping uint64 math
+    x = (
+        seed * np.uint64(0x9E3779B97F4A7C15)
+        + card_id * np.uint64(0xBF58476D1CE4E5B9)
+        + np.uint64(review)
+    )
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+# Binary heap of (due minute, tie breaker, card) for the intraday learning queue
+
+
+@_jit
+def _heapLess(dues, ties, a, b):
+    return dues[a] < dues[b] or (dues[a] == dues[b] and ties[a] < ties[b])
+
+
+@_jit
+def _heapPush(dues, ties, cards, size, due, tie, card):
+    position = size
+    dues[position] = due
+    ties[position] = tie
+    cards[position] = card
+    while position > 0:
+        parent = (position - 1) // 2
+        if not _heapLess(dues, ties, position, parent):
+            break
+        dues[position], dues[parent] = dues[parent], dues[position]
+        ties[position], ties[parent] = ties[parent], ties[position]
+        cards[position], cards[parent] = cards[parent], cards[position]
+        position = parent
+    return size + 1
+
+
+@_jit
+def _heapPop(dues, ties, cards, size):
+    size -= 1
+    dues[0] = dues[size]
+    ties[0] = ties[size]
+    cards[0] = cards[size]
+    position = 0
+    while True:
+        left = 2 * position + 1
+        if left >= size:
+            break
+        child = left
+        if left + 1 < size and _heapLess(dues, ties, left + 1, left):
+            child = left + 1
+        if not _heapLess(dues, ties, child, position):
+            break
+        dues[position], dues[child] = dues[child], dues[position]
+        ties[position], ties[child] = ties[child], ties[position]
+        cards[position], cards[child] = cards[child], cards[position]
+        position = child
+    return size
+
+
+@_jit
+def _append(head, tail, nextCard, day, card):
+    nextCard[card] = -1
+    if head[day] == -1:
+        head[day] = card
+    else:
+        nextCard[tail[day]] = card
+    tail[day] = card
+
+
+@_jit
+def _run(
+    cardIds, ivl, ease, state, step, reviews, delay,
+    head, tail, nextCard,
+    daysToSimulate, maxReviewsPerDay, maxSecondsPerDay,
+    learningSteps, lapseSteps, learningPercentages, lapsePercentages,
+    graduatingInterval, newLapseInterval, maxInterval,
+    thresholds, v1, hardFactor, easyBonus, intervalModifier,
+    timeCosts, fuzz, fuzzLower, fuzzUpper, isRestDay,
+    commonRandomNumbers, seed, mt, position,
+    learnAheadLimit, minutesUntilCutoff,
+    reviewsPerDay, matureDeltas, secondsPerDay,
+    learningReviewsPerDay, learningSecondsPerDay,
+):  # fmt: skip
+    days = head.shape[0]
+    count = cardIds.shape[0]
+    heapDues = np.empty(count, np.float64)
+    heapTies = np.empty(count, np.int64)
+    heapCards = np.empty(count, np.int64)
+    tieBreaker = 0
+    # Postponed reviews and their due days, in a ring buffer from the oldest due
+    # day to the newest like ReviewSimulator._overflow:
+    overflowCards = np.empty(count, np.int64)
+    overflowDays = np.empty(count, np.int64)
+    overflowStart = 0
+    overflowSize = 0
+    # Fuzz draws of the day, popped from the end like the array in Python:
+    shorts = np.empty(max(count, 64), np.int64)
+    shortCount = 0
+    useRestDays = False
+    for day in range(days):
+        if isRestDay[day]:
+            useRestDays = True
+
+    for day in range(days):
+        dayLength = 0
+        card = head[day]
+        while card != -1:
+            dayLength += 1
+            card = nextCard[card]
+        if fuzz and not commonRandomNumbers:
+            shortCount = _fillShorts(mt, position, shorts, dayLength)
+
+        if isRestDay[day]:
+            # Nothing is studied on rest days, so reviews are postponed and the
+            # other cards move to the next day:
+            card = head[day]
+            while card != -1:
+                following = nextCard[card]
+                if state[card] == CARD_STATE_YOUNG or state[card] == CARD_STATE_MATURE:
+                    end = (overflowStart + overflowSize) % count
+                    overflowCards[end] = card
+                    overflowDays[end] = day
+                    overflowSize += 1
+                elif day + 1 < daysToSimulate:
+                    _append(head, tail, nextCard, day + 1, card)
+                card = following
+            head[day] = -1
+            continue
+
+        reviewsDone = 0
+        listReviews = 0
+        secondsToday = 0.0
+        learningReviewsToday = 0
+        learningSecondsToday = 0.0
+        clock = 0.0
+        heapSize = 0
+        current = head[day]
+        overflowPending = overflowSize
+        daysToAdd = -1
+        while True:
+            if heapSize > 0 and (
+                heapDues[0] <= clock or (overflowPending == 0 and current == -1)
+            ):
+                due = heapDues[0]
+                card = heapCards[0]
+                heapSize = _heapPop(heapDues, heapTies, heapCards, heapSize)
+                if due > clock + learnAheadLimit:
+                    clock = due
+                fromLearnQueue = True
+                dueDay = day
+            elif overflowPending > 0:
+                overflowPending -= 1
+                card = overflowCards[overflowStart]
+                dueDay = overflowDays[overflowStart]
+                overflowStart = (overflowStart + 1) % count
+                overflowSize -= 1
+                fromLearnQueue = False
+            elif current != -1:
+                card = current
+                current = nextCard[card]
+                fromLearnQueue = False
+                dueDay = day
+            else:
+                break
+            originalState = state[card]
+            isReview = originalState == CARD_STATE_YOUNG or originalState == CARD_STATE_MATURE
+
+            # Postpone reviews > max reviews per day:
+            if isReview:
+                if reviewsDone + 1 > maxReviewsPerDay or (
+                    maxSecondsPerDay and secondsToday >= maxSecondsPerDay
+                ):
+                    if dueDay == day:
+                        end = (overflowStart + overflowSize) % count
+                    else:
+                        # The other postponed reviews keep their place:
+                        overflowStart = (overflowStart + count - 1) % count
+                        end = overflowStart
+                        overflowPending = 0
+                    overflowCards[end] = card
+                    overflowDays[end] = dueDay
+                    overflowSize += 1
+                    continue
+                reviewsDone += 1
+                delay[card] += day - dueDay
+
+            fuzzDraw = -1
+            if commonRandomNumbers:
+                bits = _commonRandomBits(seed, np.uint64(cardIds[card]), reviews[card])
+                reviews[card] += 1
+                uniform = float(bits >> np.uint64(16)) / 281474976710656.0
+                fuzzDraw = np.int64(bits & np.uint64(0xFFFF))
+            else:
+                uniform = _random(mt, position)
+            randNumber = int(uniform * 100) + 1
+
+            # Answer and new interval, see SM2Scheduler and the learning branches
+            # of ReviewSimulator.simulate:
+            idealInterval = -1
+            answer = 0
+            if isReview:
+                row = 1 if originalState == CARD_STATE_MATURE else 0
+                if randNumber <= thresholds[row, 0]:
+                    ease[card] = max(ease[card] - 20, 130.0)
+                    ivl[card] = max(int(ivl[card] * newLapseInterval), 1)
+                    delay[card] = 0
+                    state[card] = CARD_STATE_RELEARN
+                    step[card] = 0
+                    daysToAdd = int(lapseSteps[0] / 1440)
+                else:
+                    currentInterval = ivl[card]
+                    cardDelay = delay[card]
+                    if v1:
+                        hardInterval = (currentInterval + cardDelay // 4) * hardFactor
+                    else:
+                        hardInterval = currentInterval * hardFactor
+                    hardInterval = max(hardInterval * intervalModifier, currentInterval + 1)
+                    if randNumber <= thresholds[row, 1]:
+                        ease[card] = max(ease[card] - 15, 130.0)
+                        answer = 1
+                        interval = hardInterval
+                    else:
+                        goodInterval = max(
+                            (currentInterval + cardDelay // 2)
+                            * (ease[card] / 100)
+                            * intervalModifier,
+                            hardInterval + 1,
+                        )
+                        if randNumber <= thresholds[row, 2]:
+                            answer = 2
+                            interval = goodInterval
+                        else:
+                            interval = max(
+                                (currentInterval + cardDelay)
+                                * (ease[card] / 100)
+                                * easyBonus
+                                * intervalModifier,
+                                goodInterval + 1,
+                            )
+                            ease[card] = ease[card] + 15
+                            answer = 3
+                    ivl[card] = int(min(interval, maxInterval))
+                    delay[card] = 0
+                    idealInterval = ivl[card]
+            else:
+                relearning = originalState == CARD_STATE_RELEARN
+                if relearning:
+                    percentage = lapsePercentages[step[card]]
+                    stepCount = lapseSteps.shape[0]
+                else:
+                    percentage = learningPercentages[step[card]]
+                    stepCount = learningSteps.shape[0]
+                answer = 0 if randNumber <= 100 - percentage else 2
+                if answer == 0:
+                    step[card] = 0
+                    if relearning:
+                        ivl[card] = max(int(ivl[card] * newLapseInterval), 1)
+                        daysToAdd = int(lapseSteps[0] / 1440)
+                    else:
+                        state[card] = CARD_STATE_LEARNING
+                        daysToAdd = int(learningSteps[0] / 1440)
+                elif step[card] < stepCount - 1:
+                    step[card] += 1
+                    if relearning:
+                        daysToAdd = int(lapseSteps[step[card]] / 1440)
+                    else:
+                        state[card] = CARD_STATE_LEARNING
+                        daysToAdd = int(learningSteps[step[card]] / 1440)
+                else:
+                    idealInterval = ivl[card] if relearning else graduatingInterval
+                    state[card] = CARD_STATE_YOUNG
+
+            if idealInterval >= 0:
+                # Fuzz and rest days, see ReviewSimulator.adjustedIvl:
+                adjusted = idealInterval
+                if fuzz or useRestDays:
+                    idealDay = day + idealInterval
+                    targetDay = -1
+                    if fuzz:
+                        fuzzInterval = min(idealInterval, fuzzLower.shape[0] - 1)
+                        firstDay = day + fuzzLower[fuzzInterval]
+                        if firstDay < daysToSimulate:
+                            lastDay = day + fuzzUpper[fuzzInterval]
+                            if fuzzDraw < 0:
+                                if shortCount == 0:
+                                    shortCount = _fillShorts(mt, position, shorts, 64)
+                                shortCount -= 1
+                                fuzzDraw = shorts[shortCount]
+                            targetDay = firstDay + (
+                                (lastDay - firstDay + 1) * fuzzDraw >> 16
+                            )
+                            adjusted = targetDay - day
+                            if targetDay >= daysToSimulate:
+                                targetDay = -1
+                    elif idealDay < daysToSimulate:
+                        targetDay = idealDay
+                    if targetDay >= 0:
+                        if isRestDay[targetDay]:
+                            earlier = targetDay
+                            while earlier > day + 1 and isRestDay[earlier]:
+                                earlier -= 1
+                            if not isRestDay[earlier]:
+                                targetDay = earlier
+                            else:
+                                while targetDay < daysToSimulate - 1 and isRestDay[targetDay]:
+                                    targetDay += 1
+                        adjusted = targetDay - day
+                if isReview:
+                    ivl[card] = min(adjusted, maxInterval)
+                    if ivl[card] >= 21:
+                        state[card] = CARD_STATE_MATURE
+                else:
+                    ivl[card] = adjusted
+                    state[card] = CARD_STATE_MATURE if adjusted >= 21 else CARD_STATE_YOUNG
+                daysToAdd = ivl[card]
+
+            seconds = timeCosts[originalState * 4 + answer]
+            secondsToday += seconds
+            clock += seconds / 60
+            if fromLearnQueue:
+                learningReviewsToday += 1
+                learningSecondsToday += seconds
+            else:
+                listReviews += 1
+
+            if originalState != CARD_STATE_MATURE and state[card] == CARD_STATE_MATURE:
+                matureDeltas[day] += 1
+            elif originalState == CARD_STATE_MATURE and state[card] != CARD_STATE_MATURE:
+                matureDeltas[day] -= 1
+
+            if daysToAdd == 0 and (
+                state[card] == CARD_STATE_LEARNING or state[card] == CARD_STATE_RELEARN
+            ):
+                # The card entered a learning step shorter than a day:
+                if state[card] == CARD_STATE_LEARNING:
+                    due = clock + learningSteps[step[card]]
+                else:
+                    due = clock + lapseSteps[step[card]]
+                if due < minutesUntilCutoff:
+                    heapSize = _heapPush(
+                        heapDues, heapTies, heapCards, heapSize, due, tieBreaker, card
+                    )
+                    tieBreaker += 1
+                elif day + 1 < daysToSimulate:
+                    _append(head, tail, nextCard, day + 1, card)
+            elif day + daysToAdd < daysToSimulate:
+                _append(head, tail, nextCard, day + daysToAdd, card)
+
+        reviewsPerDay[day] = listReviews + learningReviewsToday
+        secondsPerDay[day] = secondsToday
+        learningReviewsPerDay[day] = learningReviewsToday
+        learningSecondsPerDay[day] = learningSecondsToday
+
+
+def _cardColumns(cards: list) -> tuple:
+    """Attributes of the cards that the loop changes, one array per attribute"""
+    count = len(cards)
+    return (
+        np.fromiter(map(attrgetter("ivl"), cards), np.int64, count),
+        np.fromiter(map(attrgetter("ease"), cards), np.float64, count),
+        np.fromiter(map(attrgetter("state"), cards), np.int64, count),
+        np.fromiter(map(attrgetter("step"), cards), np.int64, count),
+        np.fromiter(map(attrgetter("reviews"), cards), np.int64, count),
+        np.fromiter(map(attrgetter("delay"), cards), np.int64, count),
+    )
+
+
+def _dueLists(lengths: list) -> tuple:
+    """Linked due lists (head, tail, next card) of the days, for cards numbered
+    in the order of the days"""
+    lengths = np.array(lengths, np.int64)
+    ends = np.cumsum(lengths)
+    nonEmpty = lengths > 0
+    head = np.where(nonEmpty, ends - lengths, -1)
+    tail = np.where(nonEmpty, ends - 1, -1)
+    nextCard = np.arange(1, int(ends[-1]) + 1 if len(ends) else 1, dtype=np.int64)
+    nextCard[ends[nonEmpty] - 1] = -1
+    return head, tail, nextCard
+
+
+def simulate(
+    simulator: "ReviewSimulator",
+) -> Tuple[List[int], List[int], List[float], List[int], List[float]]:
+    """Runs the simulation and returns per-day reviews, changes in the number of
+    mature cards, seconds, learning reviews and learning seconds
+
+    The final state of the cards and of the simulator's random generator are
+    written back, but the due lists of the date array are left as they were.
+    """
+    cards = list(chain.from_iterable(simulator.dateArray))
+    days = len(simulator.dateArray)
+    head, tail, nextCard = _dueLists(list(map(len, simulator.dateArray)))
+    ivl, ease, state, step, reviews, delay = _cardColumns(cards)
+    # Ids are hashed as unsigned 64 bit integers, like `card.id % (1 << 64)`:
+    cardIds = np.fromiter(map(attrgetter("id"), cards), np.int64, len(cards)).view(
+        np.uint64
+    )
+
+    thresholds = np.zeros((2, 3), np.int64)
+    for row, cardState in enumerate((CARD_STATE_YOUNG, CARD_STATE_MATURE)):
+        hard = simulator._percentage_hard[cardState]
+        good = simulator._percentage_good[cardState]
+        easy = simulator._percentage_easy[cardState]
+        wrong = 100 - hard - good - easy
+        thresholds[row] = (wrong, wrong + hard, wrong + hard + good)
+    version, mtState, _ = simulator.rng.getstate()
+    mt = np.array(mtState[:624], np.int64)
+    position = np.array([mtState[624]], np.int64)
+    reviewsPerDay = np.zeros(days, np.int64)
+    matureDeltas = np.zeros(days, np.int64)
+    secondsPerDay = np.zeros(days, np.float64)
+    learningReviewsPerDay = np.zeros(days, np.int64)
+    learningSecondsPerDay = np.zeros(days, np.float64)
+    fuzz = simulator.fuzz
+    fuzzLower = simulator._fuzzLower if fuzz else [0]
+    fuzzUpper = simulator._fuzzUpper if fuzz else [0]
+    scheduler = simulator.scheduler
+    _run(
+        cardIds,
+        ivl, ease, state, step, reviews, delay,
+        head, tail, nextCard,
+        simulator.daysToSimulate,
+        simulator.maxReviewsPerDay,
+        float(simulator.maxMinutesPerDay * 60),
+        np.array(simulator.learningSteps, np.float64),
+        np.array(simulator.lapseSteps, np.float64),
+        np.array(simulator._percentage_good[CARD_STATE_LEARNING], np.int64),
+        np.array(simulator._percentage_good[CARD_STATE_RELEARN], np.int64),
+        simulator.graduatingInterval,
+        float(simulator.newLapseInterval),
+        simulator.maxInterval,
+        thresholds,
+        simulator.schedulerVersion == 1,
+        float(scheduler.hard_factor),
+        float(scheduler.easy_bonus),
+        float(simulator.intervalModifier),
+        np.array(simulator._time_costs, np.float64),
+        fuzz,
+        np.array(fuzzLower, np.int64),
+        np.array(fuzzUpper, np.int64),
+        np.array(simulator._isRestDay, np.bool_),
+        simulator.commonRandomNumbers,
+        np.uint64(simulator.seed % (1 << 64)),
+        mt,
+        position,
+        float(simulator.learnAheadLimit),
+        float(simulator.minutesUntilCutoff),
+        reviewsPerDay,
+        matureDeltas,
+        secondsPerDay,
+        learningReviewsPerDay,
+        learningSecondsPerDay,
+    )  # fmt: skip
+
+    simulator.rng.setstate((version, tuple(mt.tolist()) + (int(position[0]),), None))
+    # Eases keep their type, e.g. whole numbers for new cards:
+    for card, cardIvl, cardEase, cardState, cardStep, cardReviews, cardDelay in zip(
+        cards,
+        ivl.tolist(),
+        ease.tolist(),
+        state.tolist(),
+        step.tolist(),
+        reviews.tolist(),
+        delay.tolist(),
+    ):
+        card.ivl = cardIvl
+        card.ease = cardEase if card.ease.__class__ is float else int(cardEase)
+        card.state = cardState
+        card.step = cardStep
+        card.reviews = cardReviews
+        card.delay = cardDelay
+    return (
+        reviewsPerDay.tolist(),
+        matureDeltas.tolist(),
+        secondsPerDay.tolist(),
+        learningReviewsPerDay.tolist(),
+        learningSecondsPerDay.tolist(),
+    )
@@ -0,0 +1,79 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Per-day due counts for load balancing
+"""
+
+from typing import Callable, List, Sequence
+
+
+class DueIndex:
+    """Running number of cards due on each simulated day
+
+    A plain list of counts, updated whenever a card is scheduled or moved to
+    another day, so that the load balancer can read a day's due count without
+    walking its due list. It is not a search structure: balanced_day still
+    visits every day of the fuzz range.
+    """
+
+    def __init__(self, counts: Sequence[int], rest_days: Sequence[bool] = ()):
+        self._counts: List[int] = list(counts)
+        self._restDays: List[bool] = list(rest_days) + [False] * (
+            len(counts) - len(rest_days)
+        )
+
+    def copy(self) -> "DueIndex":
+        other = DueIndex.__new__(DueIndex)
+        other._counts = list(self._counts)
+        other._restDays = self._restDays
+        return other
+
+    def add(self, day: int, amount: int = 1):
+        self._counts[day] += amount
+
+    def balanced_day(
+        self, today: int, first: int, last: int, random: Callable[[], float]
+    ) -> int:
+        """Random day in [first, last], weighted like Anki's load balancer
+
+        A day's weight is inversely proportional to the square of its due count
+        and to the interval it gives. Later days always look less busy, as the
+        cards that will be due on them are not scheduled yet, so picking the
+        least busy day would lengthen intervals. Rest days are only picked if every
+        candidate day is a rest day.
+
+        This is a linear scan over the candidate days, like Anki's own load
+        balancer. The range is the fuzz range of the interval, about 5% of it and
+        cut off at the last simulated day, so it spans a few days for young cards
+        and rarely more than a few weeks.
+        """
+        days = range(first, last + 1)
+        restDays = self._restDays
+        if any(restDays[first : last + 1]) and not all(restDays[first : last + 1]):
+            days = [day for day in days if not restDays[day]]
+        counts = self._counts
+        weights = [
+            1 / ((counts[day] + 1) ** 2 * max(day - today, 1)) for day in days
+        ]
+        threshold = random() * sum(weights)
+        for day, weight in zip(days, weights):
+            threshold -= weight
+            if threshold < 0:
+                return day
+        return days[-1]
@@ -0,0 +1,156 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Timing instrumentation for the diagnostics panel
+"""
+
+import io
+import json
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from time import perf_counter, thread_time
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional, Tuple
+
+if TYPE_CHECKING:
+    import cProfile
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+
+class Profiler:
+    """Wall and CPU time of the phases of the last simulation, plus counters
+
+    Phases may be started and stopped on different threads than the one that
+    created the profiler. CPU time is measured for the thread running the phase.
+    """
+
+    def __init__(self, cprofile: bool = False, trace_memory: bool = False):
+        self._cprofile = cprofile
+        self._traceMemory = trace_memory
+        self._running: Dict[
+            str, Tuple[float, float, Optional["cProfile.Profile"]]
+        ] = {}
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, float] = {}
+        self.profiles: Dict[str, str] = {}
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start(self, phase: str, profile: bool = False):
+        profiler = None
+        if profile and self._cprofile:
+            # Imported here, as cProfile and pstats take a while to import:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+        self._running[phase] = (perf_counter(), thread_time(), profiler)
+
+    def stop(self, phase: str):
+        wallEnd = perf_counter()
+        cpuEnd = thread_time()
+        wallStart, cpuStart, profiler = self._running.pop(phase)
+        if profiler is not None:
+            profiler.disable()
+            import pstats
+
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(
+                30
+            )
+            self.profiles[phase] = output.getvalue()
+        self.phases[phase] = {
+            "wall": wallEnd - wallStart,
+            "cpu": cpuEnd - cpuStart,
+            "calls": self.phases.get(phase, {}).get("calls", 0) + 1,
+        }
+
+    @contextmanager
+    def phase(self, phase: str, profile: bool = False) -> Iterator[None]:
+        self.start(phase, profile)
+        try:
+            yield
+        finally:
+            self.stop(phase)
+
+    def count(self, counter: str, value: float):
+        self.counters[counter] = value
+
+    def reset_peak_memory(self):
+        if self._traceMemory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    def peak_memory(self) -> Optional[int]:
+        """Peak memory in bytes, traced by tracemalloc if enabled, otherwise the
+        peak resident set size of the whole Anki process"""
+        if self._traceMemory and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[1]
+        if resource is None:
+            return None
+        maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes:
+        return maxRss if sys.platform == "darwin" else maxRss * 1024
+
+    def report(self) -> Dict[str, Any]:
+        rates = {}
+        simulatePhase = self.phases.get("simulate")
+        if simulatePhase and simulatePhase["wall"] > 0 and "reviews" in self.counters:
+            rates["reviews_per_second"] = self.counters["reviews"] / simulatePhase["wall"]
+        return {
+            "phases": self.phases,
+            "counters": self.counters,
+            "rates": rates,
+            "peak_memory": self.peak_memory(),
+            "memory_source": "tracemalloc"
+            if self._traceMemory and tracemalloc.is_tracing()
+            else "max_rss",
+            "profiles": self.profiles,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.report(), indent=2)
+
+    def summary(self) -> str:
+        report = self.report()
+        lines = ["Phase timings (wall / CPU):"]
+        for phase, timing in report["phases"].items():
+            lines.append(
+                "- {}: {:.1f} ms / {:.1f} ms".format(
+                    phase, timing["wall"] * 1000, timing["cpu"] * 1000
+                )
+            )
+        if report["counters"]:
+            lines.append("\nCounters:")
+            for counter, value in report["counters"].items():
+                lines.append("- {}: {}".format(counter, value))
+        for rate, value in report["rates"].items():
+            lines.append("\n{}: {:,.0f}".format(rate.replace("_", " ").capitalize(), value))
+        if report["peak_memory"] is not None:
+            lines.append(
+                "\nPeak memory ({}): {:.1f} MB".format(
+                    report["memory_source"], report["peak_memory"] / 1024 ** 2
+                )
+            )
+        for phase, profile in report["profiles"].items():
+            lines.append("\ncProfile of {}:\n{}".format(phase, profile))
+        return "\n".join(lines)
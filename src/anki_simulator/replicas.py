@@ -0,0 +1,266 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Monte Carlo replicas of a simulation that stop once the results are precise enough
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from math import sqrt
+from statistics import NormalDist
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from .collection_simulator import DATE_ARRAY_TYPE, copy_date_array
+from .review_simulator import ReviewSimulator
+
+RESULTS_TYPE = List[Dict[str, Any]]
+# Summarizes the per-day results of one run into a single number:
+METRIC_TYPE = Callable[[RESULTS_TYPE], float]
+
+
+class ReplicaController:
+    """Maps the progress of a single run onto the progress of all runs"""
+
+    def __init__(self, controller, runs: int):
+        self.check_interval: int = controller.check_interval
+        self._controller = controller
+        self._runs = runs
+        self._finishedRuns = 0
+        self._finishedCards = 0
+        # Cards processed by the current run, as last reported by it:
+        self._processed = 0
+
+    def finish_run(self):
+        self._finishedRuns += 1
+        self._finishedCards += self._processed
+        self._processed = 0
+
+    def progress(self, processed: int, remaining: int) -> bool:
+        self._processed = processed
+        runsLeft = self._runs - self._finishedRuns - 1
+        perRun = (
+            self._finishedCards / self._finishedRuns
+            if self._finishedRuns
+            else processed + remaining
+        )
+        return self._controller.progress(
+            self._finishedCards + processed, remaining + int(runsLeft * perRun)
+        )
+
+
+def peak(key: str = "y") -> METRIC_TYPE:
+    """Highest daily value, e.g. the peak number of reviews per day"""
+    return lambda days: max((day[key] for day in days), default=0)
+
+
+def mean(key: str = "y", first_days: Optional[int] = None) -> METRIC_TYPE:
+    """Mean daily value, optionally only of the first days of the simulation"""
+
+    def metric(days: RESULTS_TYPE) -> float:
+        selected = days[:first_days] if first_days else days
+        return sum(day[key] for day in selected) / len(selected) if selected else 0
+
+    return metric
+
+
+def total(key: str = "y") -> METRIC_TYPE:
+    return lambda days: sum(day[key] for day in days)
+
+
+def _criticalValue(confidence: float, degrees_of_freedom: int) -> float:
+    # Two-sided quantile of Student's t distribution, from the normal quantile
+    # with the Cornish-Fisher expansion. Close enough for ten or more replicas.
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    n = degrees_of_freedom
+    return (
+        z
+        + (z ** 3 + z) / (4 * n)
+        + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * n ** 2)
+    )
+
+
+class MetricEstimate(NamedTuple):
+    mean: float
+    standard_deviation: float
+    # Half the width of the confidence interval around the mean:
+    half_width: float
+    tolerance: float
+
+    @property
+    def converged(self) -> bool:
+        return self.half_width <= self.tolerance
+
+
+class AdaptiveResult(NamedTuple):
+    replicas: int
+    converged: bool
+    estimates: Dict[str, MetricEstimate]
+    # Per-day mean of the "y" key of all replicas with its standard error, in the
+    # format of ReviewSimulator.simulate:
+    days: RESULTS_TYPE
+
+
+# State of a worker process, sent once instead of with every replica:
+_workerSpec: Optional[tuple] = None
+
+
+def _initWorker(date_array: DATE_ARRAY_TYPE, options: Dict[str, Any]):
+    global _workerSpec
+    _workerSpec = (date_array, options)
+
+
+def _runReplica(seed: int, controller=None) -> Optional[RESULTS_TYPE]:
+    assert _workerSpec is not None
+    dateArray, options = _workerSpec
+    simulator = ReviewSimulator(copy_date_array(dateArray), seed=seed, **options)
+    return simulator.simulate(controller)
+
+
+class AdaptiveReplicas:
+    """Runs replicas of a simulation in batches until the confidence interval of
+    every metric is narrower than its tolerance
+
+    Replica i uses seed + i, so the results only depend on the seed and the number
+    of replicas that were needed, not on the number of workers. With more than one
+    worker, each batch runs in a process pool that receives the cards and options
+    once. Those then have to be picklable, so leave out the profiler.
+    """
+
+    def __init__(
+        self,
+        date_array: DATE_ARRAY_TYPE,
+        options: Dict[str, Any],
+        metrics: Dict[str, METRIC_TYPE],
+        tolerances: Dict[str, float],
+        relative: bool = False,
+        confidence: float = 0.95,
+        min_replicas: int = 10,
+        max_replicas: int = 1000,
+        workers: Optional[int] = None,
+        seed: int = 0,
+    ):
+        if set(tolerances) != set(metrics):
+            raise ValueError("Every metric needs a tolerance")
+        if min_replicas < 2 or max_replicas < min_replicas:
+            raise ValueError("Need at least 2 replicas and max_replicas >= min_replicas")
+        self.dateArray = date_array
+        # ReviewSimulator keyword arguments, except for the seed:
+        self.options = options
+        self.metrics = metrics
+        self.tolerances = tolerances
+        # Whether tolerances are fractions of the mean instead of absolute values:
+        self.relative = relative
+        self.confidence = confidence
+        self.minReplicas = min_replicas
+        self.maxReplicas = max_replicas
+        self.workers: int = workers or os.cpu_count() or 1
+        self.seed = seed
+
+    def _estimates(self, values: Dict[str, List[float]]) -> Dict[str, MetricEstimate]:
+        estimates = {}
+        for name, samples in values.items():
+            n = len(samples)
+            sampleMean = sum(samples) / n
+            variance = sum((sample - sampleMean) ** 2 for sample in samples) / (n - 1)
+            standardDeviation = sqrt(variance)
+            tolerance = self.tolerances[name]
+            if self.relative:
+                tolerance *= abs(sampleMean)
+            estimates[name] = MetricEstimate(
+                sampleMean,
+                standardDeviation,
+                _criticalValue(self.confidence, n - 1) * standardDeviation / sqrt(n),
+                tolerance,
+            )
+        return estimates
+
+    def simulate(self, controller=None) -> Optional[AdaptiveResult]:
+        """Takes the same controller as ReviewSimulator.simulate and returns None if
+        cancelled. Progress is estimated against max_replicas."""
+        values: Dict[str, List[float]] = {name: [] for name in self.metrics}
+        days: RESULTS_TYPE = []
+        sums: List[List[float]] = []
+        estimates: Dict[str, MetricEstimate] = {}
+        replicaController = (
+            ReplicaController(controller, self.maxReplicas) if controller else None
+        )
+        pool = None
+        if self.workers > 1:
+            pool = ProcessPoolExecutor(
+                self.workers,
+                initializer=_initWorker,
+                initargs=(self.dateArray, self.options),
+            )
+        else:
+            _initWorker(self.dateArray, self.options)
+        try:
+            replicas = 0
+            while replicas < self.maxReplicas:
+                batch = min(
+                    max(self.workers, self.minReplicas - replicas),
+                    self.maxReplicas - replicas,
+                )
+                seeds = range(self.seed + replicas, self.seed + replicas + batch)
+                if pool:
+                    runs = list(pool.map(_runReplica, seeds))
+                else:
+                    runs = []
+                    for seed in seeds:
+                        runs.append(_runReplica(seed, replicaController))
+                        if runs[-1] is None:
+                            return None
+                        if replicaController:
+                            replicaController.finish_run()
+                for data in runs:
+                    assert data is not None
+                    for name, metric in self.metrics.items():
+                        values[name].append(metric(data))
+                    if not days:
+                        days = [
+                            {"x": day["x"], "dayNumber": day["dayNumber"]}
+                            for day in data
+                        ]
+                        sums = [[0.0, 0.0] for _ in days]
+                    for daySums, day in zip(sums, data):
+                        daySums[0] += day["y"]
+                        daySums[1] += day["y"] ** 2
+                replicas += batch
+                if pool and controller:
+                    # Each batch is reported as a whole, in replicas:
+                    if not controller.progress(replicas, self.maxReplicas - replicas):
+                        return None
+                if replicas < self.minReplicas:
+                    continue
+                estimates = self._estimates(values)
+                if all(estimate.converged for estimate in estimates.values()):
+                    break
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+
+        for day, (sumY, sumY2) in zip(days, sums):
+            dayMean = sumY / replicas
+            variance = max(sumY2 - replicas * dayMean * dayMean, 0.0) / (replicas - 1)
+            day.update({"y": dayMean, "standardError": sqrt(variance / replicas)})
+        return AdaptiveResult(
+            replicas,
+            all(estimate.converged for estimate in estimates.values()),
+            estimates,
+            days,
+        )
@@ -17,10 +17,15 @@
 # along with this program.  If not, see https://www.gnu.org/licenses/.
 
 from datetime import date, timedelta
-from random import randint
-from typing import Optional, List, Dict, Union
-from itertools import accumulate
+from array import array
+from collections import deque
+from heapq import heappop, heappush
+import random as _random
+from random import Random
+from typing import Any, Callable, Deque, Optional, List, Dict, Sequence, Tuple, Union
+from itertools import chain, count, islice
 
+from .checkpoints import SimulationCheckpoints
 from .collection_simulator import (
     CARD_STATE_NEW,
     CARD_STATE_LEARNING,
@@ -29,7 +34,13 @@ from .collection_simulator import (
     CARD_STATE_RELEARN,
     DATE_ARRAY_TYPE,
     CARD_STATES_TYPE,
+    SimulatedCard,
 )
+from .deck_limits import DeckLimits
+from .distributions import DistributionSnapshots
+from .load_balancer import DueIndex
+from .profiling import Profiler
+from .schedulers import Scheduler, SM2Scheduler
 
 from typing import Literal, Final
 
@@ -42,6 +53,75 @@ REVIEW_ANSWER = Literal[
     0, 1, 2, 3,
 ]
 
+# Seconds spent per answer (wrong, hard, good, easy) for each card state. Used when
+# the review log does not contain enough answer times to estimate them.
+DEFAULT_TIME_COSTS: Final = {
+    CARD_STATE_NEW: (20.0, 20.0, 20.0, 20.0),
+    CARD_STATE_LEARNING: (10.0, 10.0, 10.0, 10.0),
+    CARD_STATE_YOUNG: (12.0, 10.0, 8.0, 6.0),
+    CARD_STATE_MATURE: (12.0, 10.0, 8.0, 6.0),
+    CARD_STATE_RELEARN: (10.0, 10.0, 10.0, 10.0),
+}
+
+TIME_COSTS_TYPE = Dict[CARD_STATES_TYPE, Sequence[float]]
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def _randomShorts(getrandbits: Callable[[int], int], count: int) -> "array[int]":
+    # Uniformly distributed integers in [0, 65536), generated in bulk
+    return array("H", getrandbits(16 * count).to_bytes(2 * count, "little"))
+
+
+def _commonRandomBits(seed: int, card_id: int, review: int) -> int:
+    # 64 random bits that only depend on the seed, the card and how many times it
+    # was answered before (SplitMix64 finalizer)
+    x = (
+        seed * 0x9E3779B97F4A7C15 + card_id * 0xBF58476D1CE4E5B9 + review
+    ) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+class DayResults:
+    """Builds the per-day results of ReviewSimulator.simulate one day at a time"""
+
+    def __init__(self, total_number_of_cards: int, current_number_mature_cards: int):
+        self.today = date.today()
+        self.totalNumberOfCards = total_number_of_cards
+        self.days = 0
+        self.accumulate = 0
+        self.accumulateSeconds = 0.0
+        self.matureCount = current_number_mature_cards
+
+    def add(
+        self,
+        reviews: int,
+        mature_delta: int,
+        seconds: float,
+        learning_reviews: int,
+        learning_seconds: float,
+    ) -> Dict[str, Union[str, int]]:
+        self.days += 1
+        self.accumulate += reviews
+        self.accumulateSeconds += seconds
+        self.matureCount += mature_delta
+        return {
+            "x": (self.today + timedelta(days=self.days - 1)).isoformat(),
+            "y": reviews,
+            "dayNumber": self.days,
+            "accumulate": self.accumulate,
+            "average": self.accumulate / self.days,
+            "totalNumberOfCards": self.totalNumberOfCards,
+            "matureCount": self.matureCount,
+            "minutes": round(seconds / 60, 1),
+            "accumulateMinutes": round(self.accumulateSeconds / 60, 1),
+            "learningReviews": learning_reviews,
+            "learningMinutes": round(learning_seconds / 60, 1),
+        }
+
 
 class ReviewSimulator:
     def __init__(
@@ -65,6 +145,22 @@ class ReviewSimulator:
         scheduler_version: int,
         total_number_of_cards: int,
         current_number_mature_cards: int,
+        time_costs: Optional[TIME_COSTS_TYPE] = None,
+        max_minutes_per_day: int = 0,
+        scheduler: Optional[Scheduler] = None,
+        load_balancer: bool = False,
+        rest_days: Sequence[int] = (),
+        fuzz: bool = False,
+        profiler: Optional[Profiler] = None,
+        seed: Optional[int] = None,
+        common_random_numbers: bool = False,
+        learn_ahead_limit: float = 20,
+        minutes_until_cutoff: float = 1440,
+        deck_limits: Optional[DeckLimits] = None,
+        jit: bool = False,
+        distributions: Optional[DistributionSnapshots] = None,
+        bury_new: bool = False,
+        bury_reviews: bool = False,
     ):
         self.dateArray: DATE_ARRAY_TYPE = date_array
         self.daysToSimulate: int = days_to_simulate
@@ -79,6 +175,64 @@ class ReviewSimulator:
         self.schedulerVersion: int = scheduler_version
         self.totalNumberOfCards: int = total_number_of_cards
         self.currentNumberMatureCards: int = current_number_mature_cards
+        self.maxMinutesPerDay: int = max_minutes_per_day
+        self.scheduler: Scheduler = scheduler or SM2Scheduler()
+        self.loadBalancer: bool = load_balancer
+        # Weekdays (0 is Monday) on which no cards are studied:
+        self.restDays: Sequence[int] = rest_days
+        self.fuzz: bool = fuzz
+        self.profiler: Optional[Profiler] = profiler
+        # Runs without a seed draw one, so that every run can be reproduced from
+        # its parameters:
+        self.seed: int = seed if seed is not None else _random.getrandbits(64)
+        self.rng: Random = Random(self.seed)
+        # With common random numbers, the answer to a review is drawn from a hash of
+        # the seed, the card id and the card's review count rather than from a
+        # single stream. Runs with the same seed but different options then give a
+        # card the same answers for as long as it is reviewed the same way, which
+        # removes part of the noise when comparing their results, see
+        # PairedComparison.
+        self.commonRandomNumbers: bool = common_random_numbers
+        # Learning steps shorter than a day are simulated on a timeline that starts
+        # when the user begins to study and ends at the day cutoff. Learning cards
+        # that would be due after the cutoff move to the next day. Once nothing
+        # else is left, cards due within the learn ahead limit are shown early.
+        self.learnAheadLimit: float = learn_ahead_limit
+        self.minutesUntilCutoff: float = minutes_until_cutoff
+        # For simulations of a whole deck tree. Replaces the maximum reviews per day
+        # with the limits of each deck and introduces the new cards of the decks.
+        self.deckLimits: Optional[DeckLimits] = deck_limits
+        # Runs supported simulations with the compiled loop in kernel.py when
+        # Numba is installed:
+        self.jit: bool = jit
+        # Tracks the interval, ease and state distributions of the cards:
+        self.distributions: Optional[DistributionSnapshots] = distributions
+        # Like the deck options of the same names, new and review cards are
+        # buried until the next day once a sibling (a card of the same note, see
+        # SimulatedCard.note) was shown that day:
+        self.buryNew: bool = bury_new
+        self.buryReviews: bool = bury_reviews
+        # Day (counted from 1) on which a card of each note was last shown, so that
+        # nothing has to be reset when a new day starts:
+        self._noteShownOn: "array[int]" = array("i")
+        self._dayStamp: int = 0
+        self._dueIndex: Optional[DueIndex] = None
+        # Reviews that were postponed by the daily limits or rest days, as (due day,
+        # card) from the oldest due day to the newest. They are shown before the
+        # cards due on a day and their delay is added when they are reviewed.
+        self._overflow: Deque[Tuple[int, SimulatedCard]] = deque()
+        self._isRestDay: List[bool] = []
+        self._fuzzLower: Sequence[int] = ()
+        self._fuzzUpper: Sequence[int] = ()
+        self._fuzzDraws: "array[int]" = array("H")
+        # Longest interval scheduled on the current day, see SimulationCheckpoints:
+        self._peakInterval: int = 0
+        # Flat lookup table of seconds per review, indexed by state * 4 + answer:
+        self._time_costs: List[float] = [0.0] * 20
+        for state, default_costs in DEFAULT_TIME_COSTS.items():
+            costs = (time_costs or {}).get(state, default_costs)
+            for answer in (ANSWER_WRONG, ANSWER_HARD, ANSWER_GOOD, ANSWER_EASY):
+                self._time_costs[state * 4 + answer] = float(costs[answer])
         self._percentage_hard: Dict[CARD_STATES_TYPE, Union[int, List[int]]] = {
             CARD_STATE_NEW: 0,
             CARD_STATE_LEARNING: 0,
@@ -103,9 +257,67 @@ class ReviewSimulator:
             CARD_STATE_MATURE: percentage_easy_review,
         }
 
-    def reviewAnswer(self, state: CARD_STATES_TYPE, step: int) -> REVIEW_ANSWER:
+    def parameters(self) -> Dict[str, Any]:
+        """JSON serializable options of the simulation, to store alongside its
+        results"""
+        return {
+            "days_to_simulate": self.daysToSimulate,
+            "new_cards_per_day": self.newCardsPerDay,
+            "interval_modifier": self.intervalModifier,
+            "max_reviews_per_day": self.maxReviewsPerDay,
+            "learning_steps": self.learningSteps,
+            "lapse_steps": self.lapseSteps,
+            "graduating_interval": self.graduatingInterval,
+            "new_lapse_interval": self.newLapseInterval,
+            "max_interval": self.maxInterval,
+            "percentages_correct_for_learning_steps": self._percentage_good[
+                CARD_STATE_LEARNING
+            ],
+            "percentages_correct_for_lapse_steps": self._percentage_good[
+                CARD_STATE_RELEARN
+            ],
+            "percentage_good_young": self._percentage_good[CARD_STATE_YOUNG],
+            "percentage_good_mature": self._percentage_good[CARD_STATE_MATURE],
+            "percentage_hard_review": self._percentage_hard[CARD_STATE_YOUNG],
+            "percentage_easy_review": self._percentage_easy[CARD_STATE_YOUNG],
+            "scheduler_version": self.schedulerVersion,
+            "total_number_of_cards": self.totalNumberOfCards,
+            "current_number_mature_cards": self.currentNumberMatureCards,
+            "time_costs": {
+                state: self._time_costs[state * 4 : state * 4 + 4]
+                for state in DEFAULT_TIME_COSTS
+            },
+            "max_minutes_per_day": self.maxMinutesPerDay,
+            "scheduler": self.scheduler.options(),
+            "load_balancer": self.loadBalancer,
+            "rest_days": list(self.restDays),
+            "fuzz": self.fuzz,
+            "seed": self.seed,
+            "common_random_numbers": self.commonRandomNumbers,
+            "learn_ahead_limit": self.learnAheadLimit,
+            "minutes_until_cutoff": self.minutesUntilCutoff,
+            "jit": self.jit,
+            "bury_new": self.buryNew,
+            "bury_reviews": self.buryReviews,
+            "deck_limits": {
+                "names": self.deckLimits.names,
+                "new_limits": self.deckLimits.newLimits,
+                "review_limits": self.deckLimits.reviewLimits,
+            }
+            if self.deckLimits
+            else None,
+        }
+
+    def reseed(self, seed: Optional[int] = None):
+        """Switch to another seed before the run starts, a random one if None"""
+        self.seed = seed if seed is not None else _random.getrandbits(64)
+        self.rng.seed(self.seed)
 
-        randNumber = randint(1, 100)
+    def reviewAnswer(
+        self, state: CARD_STATES_TYPE, step: int, rand_number: Optional[int] = None
+    ) -> REVIEW_ANSWER:
+
+        randNumber = rand_number if rand_number is not None else self.rng.randint(1, 100)
         percentage_hard = self._percentage_hard[state]
         if isinstance(percentage_hard, (list, tuple)):
             percentage_right = percentage_hard[step]
@@ -133,86 +345,421 @@ class ReviewSimulator:
                 return index
         return -1
 
-    def nextRevInterval(
-        self,
-        current_interval: int,
-        delay: int,
-        ease_factor: int,
-        review_answer: REVIEW_ANSWER,
-    ) -> int:
-        if self.schedulerVersion == 1:
-            baseHardInterval = (current_interval + delay // 4) * 1.2
-            # Hard factor is 1.2 by default in all simulations and can't be changed.
-            # The user may have different actual settings.
-        else:
-            baseHardInterval = current_interval * 1.2
-        constrainedHardInterval = max(
-            baseHardInterval * self.intervalModifier, current_interval + 1
-        )
-        baseGoodInterval = (current_interval + delay // 2) * (ease_factor / 100)
-        constrainedGoodInterval = max(
-            baseGoodInterval * self.intervalModifier, constrainedHardInterval + 1
-        )
-        baseEasyInterval = (current_interval + delay) * ease_factor * 1.5
-        # Hard factor is 1.5 by default in all simulations and can't be changed.
-        # The user may have different actual settings.
-        constrainedEasyInterval = max(
-            baseEasyInterval * self.intervalModifier, constrainedGoodInterval + 1
-        )
-        if review_answer == ANSWER_HARD:
-            return int(min(constrainedHardInterval, self.maxInterval))
-        elif review_answer == ANSWER_GOOD:
-            return int(min(constrainedGoodInterval, self.maxInterval))
-        elif review_answer == ANSWER_EASY:
-            return int(min(constrainedEasyInterval, self.maxInterval))
-
     def adjustedIvl(
         self, state: CARD_STATES_TYPE, current_day: int, ideal_interval: int
     ):
-        # This function is blank for now, but can be used to apply additional review schedules (load balancer, free weekend, etc)
-        return ideal_interval
+        # Applies additional review schedules (fuzz, load balancer, rest days) to the
+        # intervals of young/mature cards. Learning steps are left as they are.
+        if ideal_interval > self._peakInterval:
+            self._peakInterval = ideal_interval
+        if not (self.fuzz or self.loadBalancer or self.restDays) or (
+            state != CARD_STATE_YOUNG and state != CARD_STATE_MATURE
+        ):
+            return ideal_interval
+        idealDay = current_day + ideal_interval
+        if self.fuzz or self.loadBalancer:
+            # Intervals past the end of the table are not fuzzed, see fuzz_table:
+            interval = min(ideal_interval, len(self._fuzzLower) - 1)
+            firstDay = current_day + self._fuzzLower[interval]
+            if firstDay >= self.daysToSimulate:
+                return ideal_interval
+            lastDay = current_day + self._fuzzUpper[interval]
+            if self._dueIndex is not None:
+                # Prefer the less busy days within the fuzz range, avoiding rest
+                # days:
+                lastDay = min(lastDay, self.daysToSimulate - 1)
+                day = self._dueIndex.balanced_day(
+                    current_day, firstDay, lastDay, self.rng.random
+                )
+            else:
+                fuzzDraws = self._fuzzDraws
+                if not fuzzDraws:
+                    fuzzDraws.extend(_randomShorts(self.rng.getrandbits, 64))
+                day = firstDay + ((lastDay - firstDay + 1) * fuzzDraws.pop() >> 16)
+                if day >= self.daysToSimulate:
+                    return day - current_day
+        elif idealDay >= self.daysToSimulate:
+            return ideal_interval
+        else:
+            day = idealDay
+        isRestDay = self._isRestDay
+        if isRestDay[day]:
+            # Move the card to the last study day before the rest days, or the first
+            # one after them if there is none before:
+            earlier = day
+            while earlier > current_day + 1 and isRestDay[earlier]:
+                earlier -= 1
+            if not isRestDay[earlier]:
+                day = earlier
+            else:
+                while day < self.daysToSimulate - 1 and isRestDay[day]:
+                    day += 1
+        return day - current_day
+
+    def _postponeDue(self, day: int, amount: int = 1):
+        """Moves postponed cards from the day to the next one in the due counts of
+        the load balancer"""
+        dueIndex = self._dueIndex
+        if dueIndex is not None:
+            dueIndex.add(day, -amount)
+            if day + 1 < self.daysToSimulate:
+                dueIndex.add(day + 1, amount)
+
+    def _siblingShown(self, card: SimulatedCard) -> bool:
+        """Whether a sibling of the card was shown today. Otherwise the card is
+        counted as shown, for new cards that are introduced for the day."""
+        if card.note < 0:
+            return False
+        if self._noteShownOn[card.note] == self._dayStamp:
+            return True
+        self._noteShownOn[card.note] = self._dayStamp
+        return False
 
-    def simulate(self, controller=None) -> Optional[List[Dict[str, Union[str, int]]]]:
+    def simulate(
+        self, controller=None, checkpoints: Optional[SimulationCheckpoints] = None
+    ) -> Optional[List[Dict[str, Union[str, int]]]]:
+        """Per-day results of the simulation, or None if the controller cancelled
+        it. With checkpoints, only the days that can differ from the previous run
+        of the same checkpoints are simulated. Runs of the compiled loop are always
+        simulated in full, as it is faster than resuming."""
+        profiler = self.profiler
+        if not profiler:
+            outputs = self._simulate(controller, checkpoints)
+            return self._results(*outputs) if outputs is not None else None
+        profiler.reset_peak_memory()
+        # The phase also ends when the run is cancelled or fails:
+        with profiler.phase("simulate", profile=True):
+            outputs = self._simulate(controller, checkpoints)
+        if outputs is None:
+            return None
+        profiler.count("reviews", sum(outputs[0]))
+        with profiler.phase("build_results"):
+            return self._results(*outputs)
+
+    def _simulate(
+        self, controller, checkpoints: Optional[SimulationCheckpoints]
+    ) -> Optional[Tuple[List[int], List[int], List[float], List[int], List[float]]]:
+        """Reviews, mature card changes, seconds, learning reviews and learning
+        seconds per day, in the order of DayResults.add"""
         dayIndex = 0
 
         matureDeltas: List[int] = []
+        secondsPerDay: List[float] = []
+        learningReviewsPerDay: List[int] = []
+        learningSecondsPerDay: List[float] = []
+        reviewsPerDay: List[int] = []
+        peakIntervals: List[int] = []
+        learnAheadLimit = self.learnAheadLimit
+        minutesUntilCutoff = self.minutesUntilCutoff
+        # Intraday learning queue of (due minute, tie breaker, card):
+        learnQueue: List = []
+        tieBreaker = count()
+        timeCosts = self._time_costs
+        maxSecondsPerDay = self.maxMinutesPerDay * 60
+        review, learn = self.scheduler.compile(self)
 
-        while dayIndex < len(self.dateArray):
+        firstWeekday = date.today().weekday()
+        restDays = set(self.restDays)
+        self._isRestDay = isRestDay = [
+            (firstWeekday + day) % 7 in restDays for day in range(self.daysToSimulate)
+        ]
+        if self.loadBalancer:
+            self._dueIndex = dueIndex = DueIndex(
+                [len(day) for day in self.dateArray], isRestDay
+            )
+        else:
+            self._dueIndex = dueIndex = None
+        if self.fuzz or self.loadBalancer:
+            self._fuzzLower, self._fuzzUpper = self.scheduler.fuzz_ranges(self)
+        # Controllers with a day_finished method are also handed the outputs of
+        # every finished day, in the order of DayResults.add:
+        dayFinished = getattr(controller, "day_finished", None)
+        distributions = self.distributions
+        if distributions is not None:
+            distributions.start(
+                chain(
+                    chain.from_iterable(self.dateArray),
+                    *(self.deckLimits.newCards if self.deckLimits else ()),
+                ),
+                self.daysToSimulate,
+            )
+            # Resumed runs would skip the reviews before the checkpoint:
+            checkpoints = None
+        kernel = None
+        if self.jit:
+            # Imported on first use, as importing Numba takes a while:
+            from . import kernel
+        if kernel is not None and kernel.supports(self):
+            outputs = kernel.simulate(self)
+            # The compiled loop runs to the end without consulting the controller:
+            if controller and not controller.progress(sum(outputs[0]), 0):
+                return None
+            if dayFinished is not None:
+                for day in zip(*outputs):
+                    dayFinished(*day)
+            return outputs
+        fuzzDraws = self._fuzzDraws
+        random = self.rng.random
+        commonRandomNumbers = self.commonRandomNumbers
+        seed = self.seed
+        fuzzPerCard = commonRandomNumbers and self.fuzz and not self.loadBalancer
+        deckLimits = self.deckLimits
+        self._overflow = overflow = deque()
+        buryReviews = self.buryReviews
+        # With deck limits, new cards are buried when they are introduced:
+        buryNew = self.buryNew and deckLimits is None
+        noteShownOn = None
+        if self.buryNew or buryReviews:
+            numberOfNotes = 1 + max(
+                (
+                    card.note
+                    for card in chain(
+                        chain.from_iterable(self.dateArray),
+                        *(deckLimits.newCards if deckLimits else ()),
+                    )
+                ),
+                default=-1,
+            )
+            self._noteShownOn = noteShownOn = array("i", [0]) * numberOfNotes
+
+        # Instead of on every card, the controller is only consulted every
+        # `controller.check_interval` processed cards. It is told how many cards
+        # were processed and an estimate of how many are left, and returns False
+        # to cancel the simulation:
+        processed = 0
+        outputs = (
+            matureDeltas,
+            secondsPerDay,
+            learningReviewsPerDay,
+            learningSecondsPerDay,
+            reviewsPerDay,
+            peakIntervals,
+        )
+        resumed = checkpoints.resume(self) if checkpoints is not None else None
+        if resumed is not None:
+            dayIndex = resumed.day
+            processed = resumed.processed
+            for output, previous in zip(outputs, resumed.outputs):
+                output.extend(previous)
+            if dueIndex is not None:
+                assert resumed.due_index is not None
+                self._dueIndex = dueIndex = resumed.due_index.copy()
+            overflow.extend(
+                (dueDay, card.copy()) for dueDay, card in resumed.overflow
+            )
+        nextCheck = processed + controller.check_interval if controller else -1
+        reportedDays = 0
 
-            if controller:
-                controller.day_processed(dayIndex)
+        while dayIndex < len(self.dateArray):
+            if dayFinished is not None:
+                reportedDays = self._reportDays(
+                    dayFinished, outputs, reportedDays, dayIndex
+                )
+            if checkpoints is not None:
+                checkpoints.record(self, dayIndex, processed, outputs)
+            if distributions is not None:
+                distributions.take(dayIndex)
 
             reviewNumber = 0
             daysToAdd = None
-            idsDoneToday: List[int] = []
-            # some cards may be postponed to the next day. We need to remove them from
-            # the current day:
-            removeList = []
+            reviewsToday = 0
+            # Limited reviews done today, and postponed reviews that are still to be
+            # shown today:
+            limitedReviewsToday = 0
+            overflowPending = len(overflow)
+            # Buried reviews out of the postponed ones, which keep their place:
+            buriedOverflow: List[Tuple[int, SimulatedCard]] = []
+            self._dayStamp = dayStamp = dayIndex + 1
             matureDeltas.append(0)
+            secondsToday = 0.0
+            learningReviewsToday = 0
+            learningSecondsToday = 0.0
+            # Minutes since the user started studying:
+            clock = 0.0
+            todaysCards = self.dateArray[dayIndex]
+            self._peakInterval = 0
 
-            while reviewNumber < len(self.dateArray[dayIndex]):
-                if controller and controller.do_cancel:
-                    return None
+            if fuzzPerCard:
+                del fuzzDraws[:]
+            elif self.fuzz and not self.loadBalancer:
+                # Draw the fuzz offsets for the reviews of the day in one go:
+                fuzzDraws[:] = _randomShorts(
+                    self.rng.getrandbits, len(self.dateArray[dayIndex])
+                )
 
-                card = self.dateArray[dayIndex][reviewNumber]
-                original_state = card.state
+            if isRestDay[dayIndex]:
+                # Nothing is studied on rest days, so reviews are postponed and the
+                # other cards move to the next day:
+                nextDay = []
+                for card in todaysCards:
+                    if card.state == CARD_STATE_YOUNG or card.state == CARD_STATE_MATURE:
+                        overflow.append((dayIndex, card))
+                    else:
+                        nextDay.append(card)
+                if (dayIndex + 1) < self.daysToSimulate:
+                    self.dateArray[dayIndex + 1].extend(nextDay)
+                # Including the reviews that were postponed before:
+                self._postponeDue(dayIndex, len(nextDay) + len(overflow))
+                self.dateArray[dayIndex] = []
+                secondsPerDay.append(secondsToday)
+                learningReviewsPerDay.append(0)
+                learningSecondsPerDay.append(0.0)
+                reviewsPerDay.append(0)
+                peakIntervals.append(0)
+                dayIndex += 1
+                continue
 
-                # Postpone reviews > max reviews per day to the next day:
+            if deckLimits is not None:
+                deckLimits.start_day(dayIndex)
+            newCardsPending = deckLimits is not None
+
+            while True:
                 if (
-                    card.state == CARD_STATE_YOUNG
-                    or card.state == CARD_STATE_MATURE
-                    and card.id not in idsDoneToday
+                    newCardsPending
+                    and not overflowPending
+                    and reviewNumber >= len(todaysCards)
+                ):
+                    # New cards of the decks are shown after the reviews:
+                    newCardsPending = False
+                    todaysCards.extend(
+                        deckLimits.introduce_new_cards(
+                            self._siblingShown if self.buryNew else None
+                        )
+                    )
+                # Due learning cards come first, then the postponed reviews and the
+                # cards due today. When those are done, the user learns ahead or
+                # waits for the next learning card.
+                if learnQueue and (
+                    learnQueue[0][0] <= clock
+                    or (not overflowPending and reviewNumber >= len(todaysCards))
                 ):
-                    if len(idsDoneToday) + 1 > self.maxReviewsPerDay:
-                        if (dayIndex + 1) < self.daysToSimulate:
-                            card.delay += 1
-                            self.dateArray[dayIndex + 1].append(card)
-                        removeList.append(reviewNumber)
-                        reviewNumber += 1
+                    due, _, card = heappop(learnQueue)
+                    if due > clock + learnAheadLimit:
+                        clock = due
+                    fromLearnQueue = True
+                    dueDay = dayIndex
+                elif overflowPending:
+                    overflowPending -= 1
+                    dueDay, card = overflow.popleft()
+                    fromLearnQueue = False
+                elif reviewNumber < len(todaysCards):
+                    card = todaysCards[reviewNumber]
+                    reviewNumber += 1
+                    fromLearnQueue = False
+                    dueDay = dayIndex
+                else:
+                    break
+                processed += 1
+                if processed == nextCheck:
+                    # Every card that is still scheduled will be processed at least
+                    # once, and later days tend to be as busy as the days so far:
+                    scheduled = (
+                        len(todaysCards)
+                        - reviewNumber
+                        + len(learnQueue)
+                        + len(overflow)
+                        + sum(map(len, islice(self.dateArray, dayIndex + 1, None)))
+                    )
+                    daysLeft = len(self.dateArray) - dayIndex - 1
+                    remaining = max(
+                        scheduled, processed * daysLeft // (dayIndex + 1)
+                    )
+                    if not controller.progress(processed, remaining):
+                        return None
+                    nextCheck += controller.check_interval
+
+                original_state = card.state
+
+                note = -1
+                if noteShownOn is not None and not fromLearnQueue:
+                    note = card.note
+                    if (
+                        note >= 0
+                        and noteShownOn[note] == dayStamp
+                        and (
+                            (
+                                buryReviews
+                                and (
+                                    card.state == CARD_STATE_YOUNG
+                                    or card.state == CARD_STATE_MATURE
+                                )
+                            )
+                            or (buryNew and card.state == CARD_STATE_NEW)
+                        )
+                    ):
+                        # A sibling was shown today, so the card waits until
+                        # tomorrow without using up any limits:
+                        if card.state == CARD_STATE_NEW:
+                            if (dayIndex + 1) < self.daysToSimulate:
+                                self.dateArray[dayIndex + 1].append(card)
+                        elif dueDay == dayIndex or deckLimits is not None:
+                            overflow.append((dueDay, card))
+                        else:
+                            buriedOverflow.append((dueDay, card))
+                        self._postponeDue(dayIndex)
                         continue
-                    idsDoneToday.append(card.id)
 
-                review_answer = self.reviewAnswer(card.state, card.step)
+                # Postpone reviews > max reviews per day to the next day:
+                postpone = False
+                if deckLimits is not None:
+                    postpone = (
+                        card.state == CARD_STATE_YOUNG or card.state == CARD_STATE_MATURE
+                    ) and (
+                        (maxSecondsPerDay and secondsToday >= maxSecondsPerDay)
+                        or not deckLimits.take_review(card.deck)
+                    )
+                elif card.state == CARD_STATE_YOUNG or card.state == CARD_STATE_MATURE:
+                    postpone = limitedReviewsToday + 1 > self.maxReviewsPerDay or (
+                        maxSecondsPerDay and secondsToday >= maxSecondsPerDay
+                    )
+                    if not postpone:
+                        limitedReviewsToday += 1
+                if postpone:
+                    if dueDay == dayIndex:
+                        overflow.append((dueDay, card))
+                    elif deckLimits is None:
+                        # Without deck limits, the other postponed reviews would
+                        # exceed the limit as well and keep their place:
+                        overflow.appendleft((dueDay, card))
+                        self._postponeDue(dayIndex, overflowPending)
+                        overflowPending = 0
+                    else:
+                        # Only reviews of decks with limits left are taken out:
+                        overflow.append((dueDay, card))
+                    self._postponeDue(dayIndex)
+                    continue
+                if note >= 0:
+                    noteShownOn[note] = dayStamp
+                if not fromLearnQueue:
+                    reviewsToday += 1
+                # Delay of a postponed review, i.e. the days since it was due:
+                card.delay += dayIndex - dueDay
+
+                if commonRandomNumbers:
+                    bits = _commonRandomBits(seed, card.id, card.reviews)
+                    card.reviews += 1
+                    uniform = (bits >> 16) / 281474976710656  # 2 ** 48
+                    if fuzzPerCard:
+                        # Popped by adjustedIvl while handling this card:
+                        fuzzDraws.append(bits & 0xFFFF)
+                else:
+                    uniform = random()
+                if distributions is not None:
+                    previous = (original_state, card.ivl, card.ease)
+                if card.state == CARD_STATE_YOUNG or card.state == CARD_STATE_MATURE:
+                    review_answer = review(card, uniform)
+                else:
+                    review_answer = self.reviewAnswer(
+                        card.state, card.step, int(uniform * 100) + 1
+                    )
+                    if learn is not None and review_answer >= 0:
+                        learn(card, review_answer)
+                seconds = timeCosts[original_state * 4 + review_answer]
+                secondsToday += seconds
+                clock += seconds / 60
+                if fromLearnQueue:
+                    learningReviewsToday += 1
+                    learningSecondsToday += seconds
                 if card.state == CARD_STATE_NEW:
                     if review_answer == ANSWER_WRONG:
                         # New card was incorrect and will become/remain a learning card.
@@ -236,9 +783,11 @@ class ReviewSimulator:
                         else:
                             # There are no learning steps. Unseen card was correct and will become a young/mature card.
                             card.ivl = self.adjustedIvl(
-                                card.state, dayIndex, self.graduatingInterval
+                                CARD_STATE_YOUNG,
+                                dayIndex,
+                                self.graduatingInterval if learn is None else card.ivl,
                             )
-                            if self.graduatingInterval >= 21:
+                            if card.ivl >= 21:
                                 card.state = CARD_STATE_MATURE
                             else:
                                 card.state = CARD_STATE_YOUNG
@@ -269,9 +818,11 @@ class ReviewSimulator:
                             # There are no learning steps left. Learning card was correct and will become a
                             # young/mature card.
                             card.ivl = self.adjustedIvl(
-                                card.state, dayIndex, self.graduatingInterval
+                                CARD_STATE_YOUNG,
+                                dayIndex,
+                                self.graduatingInterval if learn is None else card.ivl,
                             )
-                            if self.graduatingInterval >= 21:
+                            if card.ivl >= 21:
                                 card.state = CARD_STATE_MATURE
                             else:
                                 card.state = CARD_STATE_YOUNG
@@ -283,9 +834,10 @@ class ReviewSimulator:
                         # Relearn card was incorrect and will remain a relearn card.
                         card.state = CARD_STATE_RELEARN
                         card.step = 0
-                        card.ivl = max(
-                            int(card.ivl * self.newLapseInterval), 1
-                        )  # 1 is the minimum interval
+                        if learn is None:
+                            card.ivl = max(
+                                int(card.ivl * self.newLapseInterval), 1
+                            )  # 1 is the minimum interval
                         daysToAdd = self.adjustedIvl(
                             card.state, dayIndex, int(self.lapseSteps[0] / 1440)
                         )
@@ -314,56 +866,19 @@ class ReviewSimulator:
                     elif review_answer == ANSWER_EASY:
                         raise ValueError("No support currently for 'easy' relearn cards.")
                 elif card.state == CARD_STATE_YOUNG or card.state == CARD_STATE_MATURE:
+                    # The scheduler has already updated ease/memory state and set the
+                    # ideal interval of the card.
                     if review_answer == ANSWER_WRONG:
                         card.state = CARD_STATE_RELEARN
                         card.step = 0
-                        card.delay = 0
-                        card.ease = max(card.ease - 20, 130)
-                        card.ivl = max(int(card.ivl * self.newLapseInterval), 1)
                         daysToAdd = self.adjustedIvl(
                             card.state, dayIndex, int(self.lapseSteps[0] / 1440)
                         )
-                    elif review_answer == ANSWER_HARD:
-                        idealInterval = self.nextRevInterval(
-                            card.ivl, card.delay, card.ease, ANSWER_HARD
-                        )
-                        adjustedInterval = self.adjustedIvl(
-                            card.state, dayIndex, idealInterval
-                        )
+                    elif review_answer >= 0:
                         card.ivl = min(
-                            max(adjustedInterval, card.ivl + 1), self.maxInterval
+                            self.adjustedIvl(card.state, dayIndex, card.ivl),
+                            self.maxInterval,
                         )
-                        card.delay = 0
-                        card.ease = max(card.ease - 15, 130)
-                        if card.ivl >= 21:
-                            card.state = CARD_STATE_MATURE
-                        daysToAdd = card.ivl
-                    elif review_answer == ANSWER_GOOD:
-                        idealInterval = self.nextRevInterval(
-                            card.ivl, card.delay, card.ease, ANSWER_GOOD
-                        )
-                        adjustedInterval = self.adjustedIvl(
-                            card.state, dayIndex, idealInterval
-                        )
-                        card.ivl = min(
-                            max(adjustedInterval, card.ivl + 1), self.maxInterval
-                        )
-                        card.delay = 0
-                        if card.ivl >= 21:
-                            card.state = CARD_STATE_MATURE
-                        daysToAdd = card.ivl
-                    elif review_answer == ANSWER_EASY:
-                        idealInterval = self.nextRevInterval(
-                            card.ivl, card.delay, card.ease, ANSWER_EASY
-                        )
-                        adjustedInterval = self.adjustedIvl(
-                            card.state, dayIndex, idealInterval
-                        )
-                        card.ivl = min(
-                            max(adjustedInterval, card.ivl + 1), self.maxInterval
-                        )
-                        card.delay = 0
-                        card.ease = card.ease + 15
                         if card.ivl >= 21:
                             card.state = CARD_STATE_MATURE
                         daysToAdd = card.ivl
@@ -372,36 +887,97 @@ class ReviewSimulator:
                     matureDeltas[dayIndex] += 1
                 elif original_state == CARD_STATE_MATURE and card.state != CARD_STATE_MATURE:
                     matureDeltas[dayIndex] -= 1
+                if distributions is not None:
+                    distributions.move(*previous, card)
 
-                if (
+                if daysToAdd == 0 and (
+                    card.state == CARD_STATE_LEARNING or card.state == CARD_STATE_RELEARN
+                ):
+                    # The card entered a learning step shorter than a day:
+                    steps = (
+                        self.learningSteps
+                        if card.state == CARD_STATE_LEARNING
+                        else self.lapseSteps
+                    )
+                    due = clock + steps[card.step]
+                    if due < minutesUntilCutoff:
+                        heappush(learnQueue, (due, next(tieBreaker), card))
+                    elif (dayIndex + 1) < self.daysToSimulate:
+                        self.dateArray[dayIndex + 1].append(card)
+                        if dueIndex is not None:
+                            dueIndex.add(dayIndex + 1)
+                elif (
                     daysToAdd is not None
                     and (dayIndex + daysToAdd) < self.daysToSimulate
                 ):
                     self.dateArray[dayIndex + daysToAdd].append(card)
+                    if dueIndex is not None:
+                        dueIndex.add(dayIndex + daysToAdd)
 
-                reviewNumber += 1
+            if buriedOverflow:
+                overflow.extendleft(reversed(buriedOverflow))
 
-            # We will now remove all postponed reviews from their original day:
-            for index in sorted(removeList, reverse=True):
-                del self.dateArray[dayIndex][index]
+            secondsPerDay.append(secondsToday)
+            learningReviewsPerDay.append(learningReviewsToday)
+            learningSecondsPerDay.append(learningSecondsToday)
+            reviewsPerDay.append(reviewsToday + learningReviewsToday)
+            peakIntervals.append(self._peakInterval)
 
             dayIndex += 1
 
-        today = date.today()
-
-        totalCardsPerDay = [len(day) for day in self.dateArray]
-        matureDeltas[0] += self.currentNumberMatureCards
-        return [
-            {
-                "x": (today + timedelta(days=index)).isoformat(),
-                "y": reviews,
-                "dayNumber": (index + 1),
-                "accumulate": accumulate,
-                "average": accumulate/(index+1),
-                "totalNumberOfCards": self.totalNumberOfCards,
-                "matureCount": matureCount
-            }
-            for index, (reviews, accumulate, matureCount) in enumerate(
-                zip(totalCardsPerDay, accumulate(totalCardsPerDay), accumulate(matureDeltas))
+        # The final count, which also tells wrappers like ReplicaController how
+        # many cards the whole run processed:
+        if controller and not controller.progress(processed, 0):
+            return None
+        if dayFinished is not None:
+            self._reportDays(dayFinished, outputs, reportedDays, dayIndex)
+        if distributions is not None:
+            distributions.take(dayIndex)
+        if checkpoints is not None:
+            checkpoints.finish(self, peakIntervals)
+        return (
+            reviewsPerDay,
+            matureDeltas,
+            secondsPerDay,
+            learningReviewsPerDay,
+            learningSecondsPerDay,
+        )
+
+    def _reportDays(
+        self, day_finished: Callable, outputs: tuple, first: int, last: int
+    ) -> int:
+        matureDeltas, secondsPerDay, learningReviewsPerDay, learningSecondsPerDay = (
+            outputs[:4]
+        )
+        reviewsPerDay = outputs[4]
+        for day in range(first, last):
+            day_finished(
+                reviewsPerDay[day],
+                matureDeltas[day],
+                secondsPerDay[day],
+                learningReviewsPerDay[day],
+                learningSecondsPerDay[day],
             )
-        ]  # Returns the number of reviews for each day
+        return last
+
+    def _results(
+        self,
+        reviewsPerDay: List[int],
+        matureDeltas: List[int],
+        secondsPerDay: List[float],
+        learningReviewsPerDay: List[int],
+        learningSecondsPerDay: List[float],
+    ) -> List[Dict[str, Union[str, int]]]:
+        dayResults = DayResults(self.totalNumberOfCards, self.currentNumberMatureCards)
+        # Returns the number of reviews and minutes spent for each day
+        results = list(
+            map(
+                dayResults.add,
+                reviewsPerDay,
+                matureDeltas,
+                secondsPerDay,
+                learningReviewsPerDay,
+                learningSecondsPerDay,
+            )
+        )
+        return results
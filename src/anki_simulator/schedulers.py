@@ -0,0 +1,417 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Interval models used by ReviewSimulator
+
+A scheduler is compiled once per simulation run into plain closures that have all
+deck options and model weights bound as locals. The simulation loop calls these
+closures directly, so swapping the interval model does not add any calls to the
+per-review path.
+"""
+
+from functools import lru_cache
+from math import exp
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .collection_simulator import (
+    CARD_STATE_MATURE,
+    CARD_STATE_YOUNG,
+    SimulatedCard,
+)
+
+if TYPE_CHECKING:
+    from .review_simulator import ReviewSimulator
+
+# Answers are duplicated from review_simulator to avoid a circular import:
+ANSWER_WRONG = 0
+ANSWER_HARD = 1
+ANSWER_GOOD = 2
+ANSWER_EASY = 3
+
+# Anki's fuzz ranges for the v3 scheduler and FSRS: (start, end, factor). The part of
+# an interval that falls into a range may be fuzzed by that factor.
+FUZZ_RANGES = ((2.5, 7.0, 0.15), (7.0, 20.0, 0.1), (20.0, float("inf"), 0.05))
+
+# review(card, uniform) -> answer. Picks the answer for a young/mature card from
+# a uniform random number in [0, 1) drawn by the simulator, and updates the card's
+# memory state and ``ivl`` to the ideal next interval. All randomness of a review
+# comes from that single number, so that runs with common random numbers stay in
+# sync.
+REVIEW_FUNCTION = Callable[[SimulatedCard, float], int]
+# learn(card, answer). Updates the memory state of a new/learning/relearning card
+# and sets ``ivl`` to the interval the card would get if it graduated now.
+LEARN_FUNCTION = Callable[[SimulatedCard, int], None]
+
+
+def fuzz_range(interval: int, minimum: int, maximum: int) -> Tuple[int, int]:
+    """Days that Anki may pick instead of the ideal interval, as (lower, upper)"""
+    if interval < 2.5:
+        return (interval, interval)
+    delta = 1.0
+    for start, end, factor in FUZZ_RANGES:
+        delta += factor * max(min(interval, end) - start, 0.0)
+    lower = max(int(interval - delta + 0.5), minimum, 1)
+    upper = max(min(int(interval + delta + 0.5), maximum), lower)
+    return (lower, upper)
+
+
+def legacy_fuzz_range(interval: int, maximum: int) -> Tuple[int, int]:
+    """Fuzz range of the v1 and v2 schedulers, as (lower, upper)"""
+    if interval < 2:
+        return (interval, interval)
+    elif interval == 2:
+        return (2, min(3, maximum))
+    elif interval < 7:
+        fuzz = int(interval * 0.25)
+    elif interval < 30:
+        fuzz = max(2, int(interval * 0.15))
+    else:
+        fuzz = max(4, int(interval * 0.05))
+    # fuzz at least a day
+    fuzz = max(fuzz, 1)
+    return (interval - fuzz, max(min(interval + fuzz, maximum), interval - fuzz))
+
+
+@lru_cache(maxsize=16)
+def fuzz_table(
+    legacy: bool, maximum: int, days: int
+) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """Lower and upper fuzz bounds of the intervals from 0 up to the maximum
+    interval, as (lowers, uppers). The table ends early at the first interval
+    whose range starts on or after `days`: the lower bounds never decrease, so
+    longer intervals are not fuzzed within a simulation of that many days, and
+    looking them up as that interval gives the same result."""
+    lowers = []
+    uppers = []
+    for interval in range(maximum + 1):
+        if legacy:
+            lower, upper = legacy_fuzz_range(interval, maximum)
+        else:
+            lower, upper = fuzz_range(interval, 1, maximum)
+        lowers.append(lower)
+        uppers.append(upper)
+        if lower >= days:
+            break
+    return tuple(lowers), tuple(uppers)
+
+
+class Scheduler:
+    """Base class for interval models"""
+
+    name = ""
+
+    def options(self) -> Dict[str, Any]:
+        """JSON serializable settings of the scheduler"""
+        return {"name": self.name}
+
+    def fuzz_ranges(
+        self, simulator: "ReviewSimulator"
+    ) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+        """Lower and upper fuzz bounds of the intervals of a run, see fuzz_table"""
+        return fuzz_table(False, simulator.maxInterval, simulator.daysToSimulate)
+
+    def compile(
+        self, simulator: "ReviewSimulator"
+    ) -> Tuple[REVIEW_FUNCTION, Optional[LEARN_FUNCTION]]:
+        """Bind the scheduler to the options of a simulation run
+
+        Returns a review function for young/mature cards and an optional learn
+        function for cards in (re)learning. Schedulers that do not track a memory
+        state during learning return None for the latter, and the simulator then
+        uses the graduating and new lapse intervals of the deck options.
+        """
+        raise NotImplementedError
+
+    def review_cards(
+        self, simulator: "ReviewSimulator", cards: Sequence[SimulatedCard]
+    ) -> List[int]:
+        """Batched review of young/mature cards, e.g. for engines that process all
+        reviews of a day at once"""
+        review = self.compile(simulator)[0]
+        random = simulator.rng.random
+        return [review(card, random()) for card in cards]
+
+
+class SM2Scheduler(Scheduler):
+    """Anki's SM-2 based v1/v2/v3 schedulers"""
+
+    name = "SM-2"
+
+    # Hard factor and easy bonus are not read from the deck options and use Anki's
+    # defaults. The user may have different actual settings.
+    hard_factor = 1.2
+    easy_bonus = 1.3
+
+    def options(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "hard_factor": self.hard_factor,
+            "easy_bonus": self.easy_bonus,
+        }
+
+    def compile(
+        self, simulator: "ReviewSimulator"
+    ) -> Tuple[REVIEW_FUNCTION, Optional[LEARN_FUNCTION]]:
+        hardFactor = self.hard_factor
+        easyBonus = self.easy_bonus
+        v1 = simulator.schedulerVersion == 1
+        intervalModifier = simulator.intervalModifier
+        maxInterval = simulator.maxInterval
+        newLapseInterval = simulator.newLapseInterval
+        # Cumulative answer thresholds for a draw from 1 to 100, per card state:
+        thresholds = {}
+        for state in (CARD_STATE_YOUNG, CARD_STATE_MATURE):
+            hard = simulator._percentage_hard[state]
+            good = simulator._percentage_good[state]
+            easy = simulator._percentage_easy[state]
+            wrong = 100 - hard - good - easy
+            thresholds[state] = (wrong, wrong + hard, wrong + hard + good)
+        youngThresholds = thresholds[CARD_STATE_YOUNG]
+        matureThresholds = thresholds[CARD_STATE_MATURE]
+
+        def review(card: SimulatedCard, uniform: float) -> int:
+            randNumber = int(uniform * 100) + 1
+            wrongUntil, hardUntil, goodUntil = (
+                matureThresholds
+                if card.state == CARD_STATE_MATURE
+                else youngThresholds
+            )
+            if wrongUntil < 0:
+                # percentage hard + percentage good + percentage easy was more than 100
+                return -1
+            if randNumber <= wrongUntil:
+                card.ease = max(card.ease - 20, 130)
+                card.ivl = max(int(card.ivl * newLapseInterval), 1)
+                card.delay = 0
+                return ANSWER_WRONG
+
+            currentInterval = card.ivl
+            delay = card.delay
+            if v1:
+                hardInterval = (currentInterval + delay // 4) * hardFactor
+            else:
+                hardInterval = currentInterval * hardFactor
+            hardInterval = max(hardInterval * intervalModifier, currentInterval + 1)
+            if randNumber <= hardUntil:
+                card.ease = max(card.ease - 15, 130)
+                answer = ANSWER_HARD
+                interval = hardInterval
+            else:
+                goodInterval = max(
+                    (currentInterval + delay // 2)
+                    * (card.ease / 100)
+                    * intervalModifier,
+                    hardInterval + 1,
+                )
+                if randNumber <= goodUntil:
+                    answer = ANSWER_GOOD
+                    interval = goodInterval
+                else:
+                    interval = max(
+                        (currentInterval + delay)
+                        * (card.ease / 100)
+                        * easyBonus
+                        * intervalModifier,
+                        goodInterval + 1,
+                    )
+                    card.ease = card.ease + 15
+                    answer = ANSWER_EASY
+            card.ivl = int(min(interval, maxInterval))
+            card.delay = 0
+            return answer
+
+        return review, None
+
+    def fuzz_ranges(
+        self, simulator: "ReviewSimulator"
+    ) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+        return fuzz_table(
+            simulator.schedulerVersion < 3,
+            simulator.maxInterval,
+            simulator.daysToSimulate,
+        )
+
+
+# FSRS-5 default weights
+FSRS_DEFAULT_PARAMETERS = (
+    0.40255, 1.18385, 3.173, 15.69105, 7.1949, 0.5345, 1.4604, 0.0046, 1.54575,
+    0.1192, 1.01925, 1.9395, 0.11, 0.29605, 2.2698, 0.2315, 2.9898, 0.51655,
+    0.6621,
+)
+
+
+class FSRSScheduler(Scheduler):
+    """Free Spaced Repetition Scheduler (FSRS-4.5, FSRS-5 and FSRS-6 weights)
+
+    Each card carries a stability and difficulty. Young/mature answers are drawn
+    from the card's retrievability on the day of the review instead of the fixed
+    retention rates, and intervals are chosen to hit the desired retention.
+    """
+
+    name = "FSRS"
+
+    def __init__(
+        self,
+        parameters: Optional[Sequence[float]] = None,
+        desired_retention: float = 0.9,
+    ):
+        parameters = list(parameters or FSRS_DEFAULT_PARAMETERS)
+        if len(parameters) < 17:
+            raise ValueError("FSRS needs at least 17 parameters")
+        # FSRS-4.5 uses linear difficulty formulas and has no short-term
+        # stability weights:
+        self.legacy_difficulty: bool = len(parameters) < 19
+        while len(parameters) < 19:
+            parameters.append(0.0)
+        self.parameters: List[float] = parameters
+        self.desired_retention: float = desired_retention
+
+    def options(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "parameters": self.parameters,
+            "desired_retention": self.desired_retention,
+        }
+
+    @property
+    def decay(self) -> float:
+        # FSRS-6 trains the decay, older versions use a fixed one:
+        if len(self.parameters) >= 21:
+            return -self.parameters[20]
+        return -0.5
+
+    def compile(
+        self, simulator: "ReviewSimulator"
+    ) -> Tuple[REVIEW_FUNCTION, Optional[LEARN_FUNCTION]]:
+        w = self.parameters
+        decay = self.decay
+        factor = 0.9 ** (1 / decay) - 1
+        # Multiplying the stability by this gives the interval for the desired retention:
+        intervalFactor = (self.desired_retention ** (1 / decay) - 1) / factor
+        maxInterval = simulator.maxInterval
+        initialStability = w[0:4]
+        legacyDifficulty = self.legacy_difficulty
+        if legacyDifficulty:
+            # FSRS-4.5: D0(G) = w4 - (G - 3) * w5, with answer = G - 1
+            initialDifficulty = [
+                min(max(w[4] - (answer - 2) * w[5], 1.0), 10.0) for answer in range(4)
+            ]
+            # Mean reversion targets D0(3) = w4:
+            targetDifficulty = w[4]
+        else:
+            initialDifficulty = [
+                min(max(w[4] - exp(w[5] * answer) + 1, 1.0), 10.0)
+                for answer in range(4)
+            ]
+            targetDifficulty = initialDifficulty[ANSWER_EASY]
+        shortTermDecay = w[19] if len(w) >= 21 else 0.0
+        expW8 = exp(w[8])
+        # Share of successful young/mature reviews that are answered hard or easy:
+        hardShares = {}
+        easyShares = {}
+        retentions = {}
+        for state in (CARD_STATE_YOUNG, CARD_STATE_MATURE):
+            hard = simulator._percentage_hard[state]
+            good = simulator._percentage_good[state]
+            easy = simulator._percentage_easy[state]
+            recalled = hard + good + easy
+            hardShares[state] = hard / recalled if recalled else 0.0
+            easyShares[state] = easy / recalled if recalled else 0.0
+            retentions[state] = min(max(recalled / 100, 0.5), 0.99)
+
+        def toInterval(stability: float) -> int:
+            return int(min(max(round(stability * intervalFactor), 1), maxInterval))
+
+        def nextDifficulty(difficulty: float, answer: int) -> float:
+            if legacyDifficulty:
+                difficulty -= w[6] * (answer - 2)
+            else:
+                difficulty += -w[6] * (answer - 2) * (10 - difficulty) / 9
+            difficulty = w[7] * targetDifficulty + (1 - w[7]) * difficulty
+            return min(max(difficulty, 1.0), 10.0)
+
+        def review(card: SimulatedCard, uniform: float) -> int:
+            state = card.state
+            stability = card.stability
+            difficulty = card.difficulty
+            if stability <= 0:
+                # Card was scheduled by SM-2 before. Estimate a memory state from
+                # its interval and ease, the same way Anki does when FSRS is enabled:
+                retention = retentions[state]
+                stability = max(card.ivl, 0.1) * factor / (retention ** (1 / decay) - 1)
+                difficulty = 11 - (card.ease / 100 - 1) / (
+                    expW8 * stability ** -w[9] * (exp((1 - retention) * w[10]) - 1)
+                )
+                difficulty = min(max(difficulty, 1.0), 10.0)
+            elapsedDays = card.ivl + card.delay
+            retrievability = (1 + factor * elapsedDays / stability) ** decay
+            if uniform >= retrievability:
+                card.stability = min(
+                    w[11]
+                    * difficulty ** -w[12]
+                    * ((stability + 1) ** w[13] - 1)
+                    * exp(w[14] * (1 - retrievability)),
+                    stability / exp(w[17] * w[18]),
+                )
+                card.difficulty = nextDifficulty(difficulty, ANSWER_WRONG)
+                card.ivl = toInterval(card.stability)
+                card.delay = 0
+                return ANSWER_WRONG
+
+            answer = ANSWER_GOOD
+            hardShare = hardShares[state]
+            easyShare = easyShares[state]
+            if hardShare or easyShare:
+                # Given a recall, uniform / retrievability is again uniform in [0, 1):
+                randNumber = uniform / retrievability
+                if randNumber < hardShare:
+                    answer = ANSWER_HARD
+                elif randNumber >= 1 - easyShare:
+                    answer = ANSWER_EASY
+            growth = (
+                expW8
+                * (11 - difficulty)
+                * stability ** -w[9]
+                * (exp(w[10] * (1 - retrievability)) - 1)
+            )
+            if answer == ANSWER_HARD:
+                growth *= w[15]
+            elif answer == ANSWER_EASY:
+                growth *= w[16]
+            card.stability = stability * (growth + 1)
+            card.difficulty = nextDifficulty(difficulty, answer)
+            card.ivl = toInterval(card.stability)
+            card.delay = 0
+            return answer
+
+        def learn(card: SimulatedCard, answer: int):
+            if card.stability <= 0:
+                card.stability = initialStability[answer]
+                card.difficulty = initialDifficulty[answer]
+            else:
+                stability = card.stability
+                card.stability = (
+                    stability
+                    * exp(w[17] * (answer - 2 + w[18]))
+                    * stability ** -shortTermDecay
+                )
+                card.difficulty = nextDifficulty(card.difficulty, answer)
+            card.ivl = toInterval(card.stability)
+
+        return review, learn
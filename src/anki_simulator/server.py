@@ -0,0 +1,354 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Local HTTP/JSON service that runs simulations outside of Anki
+
+Start it from the directory that contains the package, without Anki:
+
+    python -m anki_simulator.server --port 8765 --workers 4
+
+POST /simulate takes a simulation request, see simulation_requests.py. The
+response streams the per-day results of ReviewSimulator.simulate as they are
+produced, one JSON object per line, and ends with {"done": true} or
+{"error": "..."}. With "jit": true, supported simulations run in the compiled
+loop, which is much faster but only streams the days once the run has finished.
+Identical requests that arrive while a simulation is running share it, and
+recent results are answered from a cache. GET /status returns counters of the
+service.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from .review_simulator import DayResults, ReviewSimulator
+from .simulation_requests import (
+    generate_cards,
+    normalize_request,
+    request_key,
+    simulator_options,
+)
+
+_MAX_BODY_SIZE = 1 << 20
+# Workers send finished days at most this often, in seconds:
+_STREAM_INTERVAL = 0.05
+
+# Queue of (request key, finished days) messages from the workers to the service.
+# An empty list of days marks the end of a simulation, a string an error.
+_updates: Optional[Any] = None
+
+
+def _initWorker(updates):
+    global _updates
+    _updates = updates
+
+
+class _DayStream:
+    """Controller that sends finished days to the service in batches"""
+
+    # The service does not cancel simulations:
+    check_interval = 1 << 62
+
+    def __init__(self, key: str, total_number_of_cards: int, mature_cards: int):
+        self.key = key
+        self.results = DayResults(total_number_of_cards, mature_cards)
+        self.pending: List[Dict[str, Any]] = []
+        self.lastSent = time.monotonic()
+
+    def progress(self, processed: int, remaining: int) -> bool:
+        return True
+
+    def day_finished(self, *outputs):
+        self.pending.append(self.results.add(*outputs))
+        if time.monotonic() - self.lastSent >= _STREAM_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            assert _updates is not None
+            _updates.put((self.key, self.pending))
+            self.pending = []
+        self.lastSent = time.monotonic()
+
+
+def _simulate(key: str, request: Dict[str, Any]):
+    assert _updates is not None
+    try:
+        dateArray, totalNumberOfCards, numberOfMatureCards = generate_cards(request)
+        simulator = ReviewSimulator(
+            dateArray,
+            request["days"],
+            total_number_of_cards=totalNumberOfCards,
+            current_number_mature_cards=numberOfMatureCards,
+            seed=request["seed"],
+            **simulator_options(request),
+        )
+        stream = _DayStream(key, totalNumberOfCards, numberOfMatureCards)
+        simulator.simulate(stream)
+        stream.flush()
+    except Exception as error:  # reported to the clients of the request
+        _updates.put((key, "{}: {}".format(type(error).__name__, error)))
+        return
+    _updates.put((key, []))
+
+
+class _Job:
+    """A running simulation and the days it has produced so far"""
+
+    def __init__(self):
+        self.days: List[bytes] = []
+        self.done = False
+        self.error: Optional[str] = None
+        self.updated = asyncio.Event()
+
+    def notify(self):
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+
+class SimulationService:
+    """Runs simulations in a process pool, shares them between identical
+    requests and caches the results of the last `cache_size` ones"""
+
+    def __init__(self, workers: Optional[int] = None, cache_size: int = 256):
+        self.workers: int = workers or os.cpu_count() or 1
+        self.cacheSize = cache_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._updates = multiprocessing.Queue()
+        self._pool = ProcessPoolExecutor(
+            self.workers, initializer=_initWorker, initargs=(self._updates,)
+        )
+        self._jobs: Dict[str, _Job] = {}
+        # Lines of the per-day results of finished requests:
+        self._cache: "OrderedDict[str, List[bytes]]" = OrderedDict()
+        self._reader: Optional[threading.Thread] = None
+        self.counters: Dict[str, int] = {
+            "requests": 0,
+            "simulations": 0,
+            "coalesced": 0,
+            "cache_hits": 0,
+            "errors": 0,
+        }
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._reader = threading.Thread(target=self._readUpdates, daemon=True)
+        self._reader.start()
+
+    def close(self):
+        self._pool.shutdown(cancel_futures=True)
+        self._updates.put((None, []))
+        if self._reader is not None:
+            self._reader.join()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "running": len(self._jobs),
+            "cached": len(self._cache),
+            "workers": self.workers,
+        }
+
+    def _readUpdates(self):
+        assert self._loop is not None
+        while True:
+            key, update = self._updates.get()
+            if key is None:
+                break
+            self._loop.call_soon_threadsafe(self._received, key, update)
+
+    def _received(self, key: str, update):
+        job = self._jobs.get(key)
+        if job is None:
+            return
+        if isinstance(update, str):
+            job.error = update
+            job.done = True
+            self.counters["errors"] += 1
+        elif update:
+            job.days.extend(
+                json.dumps(day, separators=(",", ":")).encode("utf-8") + b"\n"
+                for day in update
+            )
+        else:
+            job.done = True
+            self._cache[key] = job.days
+            while len(self._cache) > self.cacheSize:
+                self._cache.popitem(last=False)
+        if job.done:
+            del self._jobs[key]
+        job.notify()
+
+    def _submitted(self, key: str, future: Future):
+        # Results arrive through the queue. Only failures of the pool itself, e.g.
+        # a crashed worker, are reported here:
+        error = future.exception()
+        if error is not None:
+            self._received(key, "{}: {}".format(type(error).__name__, error))
+
+    def job(self, request: Dict[str, Any]) -> Tuple[str, Any]:
+        """Cached lines or running job of a normalized request, and whether it
+        was "cached", "coalesced" with a running one or "started" """
+        self.counters["requests"] += 1
+        # Results are dated and rest days depend on the weekday:
+        key = request_key({**request, "today": date.today().isoformat()})
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.counters["cache_hits"] += 1
+            return "cached", cached
+        job = self._jobs.get(key)
+        if job is not None:
+            self.counters["coalesced"] += 1
+            return "coalesced", job
+        job = self._jobs[key] = _Job()
+        self.counters["simulations"] += 1
+        assert self._loop is not None
+        future = self._pool.submit(_simulate, key, request)
+        future.add_done_callback(
+            lambda future: self._loop.call_soon_threadsafe(self._submitted, key, future)
+        )
+        return "started", job
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            requestLine = await reader.readline()
+            method, path, _ = requestLine.decode("latin-1").split(" ", 2)
+            headers: Dict[str, str] = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > _MAX_BODY_SIZE:
+                await self._respond(writer, 413, {"error": "Request too large"})
+                return
+            body = await reader.readexactly(length)
+            if path == "/simulate" and method == "POST":
+                await self._simulateResponse(writer, body)
+            elif path == "/status" and method == "GET":
+                await self._respond(writer, 200, self.status())
+            else:
+                await self._respond(writer, 404, {"error": "Not found"})
+        except (ValueError, asyncio.IncompleteReadError):
+            await self._respond(writer, 400, {"error": "Malformed HTTP request"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(
+        self, writer: asyncio.StreamWriter, status: int, content: Dict[str, Any]
+    ):
+        body = json.dumps(content).encode("utf-8")
+        writer.write(
+            "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+            "Content-Length: {}\r\nConnection: close\r\n\r\n".format(
+                status, _REASONS.get(status, ""), len(body)
+            ).encode("latin-1")
+            + body
+        )
+        await writer.drain()
+
+    async def _simulateResponse(self, writer: asyncio.StreamWriter, body: bytes):
+        try:
+            request = normalize_request(json.loads(body))
+        except ValueError as error:  # includes JSON syntax errors
+            await self._respond(writer, 400, {"error": str(error)})
+            return
+        source, job = self.job(request)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: close\r\n"
+            + "X-Simulation-Source: {}\r\n\r\n".format(source).encode("latin-1")
+        )
+        if source == "cached":
+            await self._writeChunk(writer, b"".join(job))
+            last = {"done": True}
+        else:
+            sent = 0
+            while True:
+                updated = job.updated
+                if sent < len(job.days):
+                    await self._writeChunk(writer, b"".join(job.days[sent:]))
+                    sent = len(job.days)
+                    continue
+                if job.done:
+                    break
+                await updated.wait()
+            last = {"error": job.error} if job.error else {"done": True}
+        await self._writeChunk(writer, json.dumps(last).encode("utf-8") + b"\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _writeChunk(self, writer: asyncio.StreamWriter, data: bytes):
+        if data:
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await writer.drain()
+
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large"}
+
+
+async def serve(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    workers: Optional[int] = None,
+    cache_size: int = 256,
+):
+    service = SimulationService(workers, cache_size)
+    service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    print("Serving simulations on http://{}:{} with {} workers".format(
+        host, port, service.workers
+    ))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache-size", type=int, default=256)
+    arguments = parser.parse_args(argv)
+    try:
+        asyncio.run(
+            serve(arguments.host, arguments.port, arguments.workers, arguments.cache_size)
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
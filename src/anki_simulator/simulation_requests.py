@@ -0,0 +1,269 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Simulation requests of the simulation service (see server.py) and the other
+command line tools that simulate synthetic decks
+
+A request is a JSON object like
+
+    {
+        "days": 365,
+        "seed": 0,
+        "cards": {
+            "new_cards": 1000,
+            "review_cards": 5000,
+            "intervals": {"lognormal": {"median": 30, "sigma": 1.2}},
+            "eases": {"normal": {"mean": 250, "sd": 20, "low": 130, "high": 350}}
+        },
+        "options": {"new_cards_per_day": 20, "max_reviews_per_day": 200}
+    }
+
+Cards are generated with SyntheticCollection, or only as new cards if there are
+no review cards. Histograms are given as {"values": [...], "weights": [...]} or
+as one of the Histogram constructors with its arguments. Options are keyword
+arguments of ReviewSimulator, see _DEFAULT_OPTIONS, with the scheduler given
+like in ReviewSimulator.parameters.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from .collection_simulator import DATE_ARRAY_TYPE, CollectionSimulator
+from .review_simulator import ReviewSimulator
+from .schedulers import FSRSScheduler, Scheduler, SM2Scheduler
+from .synthetic import Histogram, SyntheticCollection
+
+# Options of a simulation that the request does not set. Percentages and retention
+# rates are those of a typical deck with Anki's default deck options.
+_DEFAULT_OPTIONS: Dict[str, Any] = {
+    "new_cards_per_day": 20,
+    "interval_modifier": 1.0,
+    "max_reviews_per_day": 200,
+    "learning_steps": [1.0, 10.0],
+    "lapse_steps": [10.0],
+    "graduating_interval": 1,
+    "new_lapse_interval": 0.0,
+    "max_interval": 36500,
+    "percentages_correct_for_learning_steps": [80, 90],
+    "percentages_correct_for_lapse_steps": [80],
+    "percentage_good_young": 90,
+    "percentage_good_mature": 90,
+    "percentage_hard_review": 0,
+    "percentage_easy_review": 0,
+    "scheduler_version": 3,
+    "time_costs": None,
+    "max_minutes_per_day": 0,
+    "scheduler": {"name": SM2Scheduler.name},
+    "load_balancer": False,
+    "rest_days": [],
+    "fuzz": False,
+    "common_random_numbers": False,
+    "learn_ahead_limit": 20,
+    "minutes_until_cutoff": 1440,
+    # The compiled loop does not report days until it finishes:
+    "jit": False,
+}
+
+_DEFAULT_CARDS: Dict[str, Any] = {
+    "new_cards": 0,
+    "review_cards": 0,
+    "starting_ease": 250,
+    "intervals": {"constant": 1},
+    "eases": {"constant": 250},
+    "relearning_share": 0.0,
+}
+
+
+_MAX_DAYS = 36500
+
+
+def _histogram(spec: Dict[str, Any]) -> Histogram:
+    if "values" in spec:
+        values = spec["values"]
+        return Histogram(values, spec.get("weights") or [1] * len(values))
+    if len(spec) != 1:
+        raise ValueError("A histogram needs values or a single distribution")
+    ((kind, arguments),) = spec.items()
+    if kind not in ("constant", "uniform", "normal", "lognormal"):
+        raise ValueError("Unknown distribution: {}".format(kind))
+    constructor = getattr(Histogram, kind)
+    if isinstance(arguments, dict):
+        return constructor(**arguments)
+    if isinstance(arguments, list):
+        return constructor(*arguments)
+    return constructor(arguments)
+
+
+def _scheduler(spec: Dict[str, Any]) -> Scheduler:
+    settings = dict(spec)
+    name = settings.pop("name", SM2Scheduler.name)
+    if name == FSRSScheduler.name:
+        return FSRSScheduler(**settings)
+    if name != SM2Scheduler.name:
+        raise ValueError("Unknown scheduler: {}".format(name))
+    scheduler = SM2Scheduler()
+    for setting, value in settings.items():
+        if setting not in ("hard_factor", "easy_bonus"):
+            raise ValueError("Unknown SM-2 setting: {}".format(setting))
+        setattr(scheduler, setting, float(value))
+    return scheduler
+
+
+def normalize_request(request: Any) -> Dict[str, Any]:
+    """Request with all defaults filled in. Raises ValueError for invalid
+    requests."""
+    if not isinstance(request, dict):
+        raise ValueError("The request must be a JSON object")
+    unknown = set(request) - {"days", "seed", "cards", "options"}
+    if unknown:
+        raise ValueError("Unknown keys: {}".format(", ".join(sorted(unknown))))
+    days = request.get("days", 365)
+    if not isinstance(days, int) or not 0 < days <= _MAX_DAYS:
+        raise ValueError("days must be an integer from 1 to {}".format(_MAX_DAYS))
+    seed = request.get("seed", 0)
+    if not isinstance(seed, int):
+        raise ValueError("seed must be an integer")
+    cards = request.get("cards", {})
+    options = request.get("options", {})
+    if not isinstance(cards, dict) or not isinstance(options, dict):
+        raise ValueError("cards and options must be JSON objects")
+    for given, defaults, kind in (
+        (cards, _DEFAULT_CARDS, "card"),
+        (options, _DEFAULT_OPTIONS, "option"),
+    ):
+        unknown = set(given) - set(defaults)
+        if unknown:
+            raise ValueError(
+                "Unknown {} keys: {}".format(kind, ", ".join(sorted(unknown)))
+            )
+    normalized = {
+        "days": days,
+        "seed": seed,
+        "cards": {**_DEFAULT_CARDS, **cards},
+        "options": {**_DEFAULT_OPTIONS, **options},
+    }
+    # Builds everything but the cards once, so that errors are reported before
+    # the request is queued:
+    try:
+        simulatorOptions = simulator_options(normalized)
+        _checkOptions(simulatorOptions)
+        ReviewSimulator(
+            [],
+            days,
+            total_number_of_cards=0,
+            current_number_mature_cards=0,
+            **simulatorOptions,
+        )
+        _syntheticCollection(normalized["cards"])
+    except (TypeError, ValueError, KeyError, IndexError, AttributeError) as error:
+        raise ValueError("Invalid request: {}".format(error)) from error
+    return normalized
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    """Key of a normalized request. Requests with the same key have the same
+    results."""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def simulator_options(request: Dict[str, Any]) -> Dict[str, Any]:
+    options = dict(request["options"])
+    options["scheduler"] = _scheduler(options["scheduler"])
+    if options["time_costs"] is not None:
+        options["time_costs"] = {
+            int(state): [float(cost) for cost in costs]
+            for state, costs in options["time_costs"].items()
+        }
+    return options
+
+
+def _checkOptions(options: Dict[str, Any]):
+    """Raises ValueError for options that ReviewSimulator accepts, but that would
+    make the simulation fail or answer every review with an error once it runs"""
+    for steps, percentages in (
+        ("learning_steps", "percentages_correct_for_learning_steps"),
+        ("lapse_steps", "percentages_correct_for_lapse_steps"),
+    ):
+        if not options[steps]:
+            raise ValueError("{} needs at least one step".format(steps))
+        if len(options[percentages]) != len(options[steps]):
+            raise ValueError("{} needs one value per step".format(percentages))
+        if not all(0 <= percentage <= 100 for percentage in options[percentages]):
+            raise ValueError("{} must be from 0 to 100".format(percentages))
+    for name in (
+        "percentage_good_young",
+        "percentage_good_mature",
+        "percentage_hard_review",
+        "percentage_easy_review",
+    ):
+        if not 0 <= options[name] <= 100:
+            raise ValueError("{} must be from 0 to 100".format(name))
+    for good in ("percentage_good_young", "percentage_good_mature"):
+        if (
+            options[good]
+            + options["percentage_hard_review"]
+            + options["percentage_easy_review"]
+            > 100
+        ):
+            raise ValueError(
+                "{} plus the hard and easy percentages exceeds 100".format(good)
+            )
+    restDays = set(options["rest_days"])
+    if not restDays <= set(range(7)) or len(restDays) == 7:
+        raise ValueError("rest_days must be weekdays from 0 to 6, but not all of them")
+    if options["scheduler_version"] not in (1, 2, 3):
+        raise ValueError("scheduler_version must be 1, 2 or 3")
+    for name in ("new_cards_per_day", "max_reviews_per_day", "max_minutes_per_day"):
+        if options[name] < 0:
+            raise ValueError("{} must not be negative".format(name))
+    if options["max_interval"] < 1 or options["graduating_interval"] < 1:
+        raise ValueError("max_interval and graduating_interval must be at least 1")
+
+
+def _syntheticCollection(cards: Dict[str, Any]) -> Optional[SyntheticCollection]:
+    if not cards["review_cards"]:
+        return None
+    return SyntheticCollection(
+        _histogram(cards["intervals"]),
+        _histogram(cards["eases"]),
+        relearning_share=cards["relearning_share"],
+    )
+
+
+def generate_cards(request: Dict[str, Any]) -> Tuple[DATE_ARRAY_TYPE, int, int]:
+    cards = request["cards"]
+    days = request["days"]
+    newCardsPerDay = request["options"]["new_cards_per_day"]
+    collection = _syntheticCollection(cards)
+    if collection is None:
+        dateArray = CollectionSimulator.generate_for_new_count(
+            days, newCardsPerDay, cards["new_cards"], cards["starting_ease"]
+        )
+        return dateArray, cards["new_cards"], 0
+    return collection.generate(
+        days,
+        cards["review_cards"],
+        new_cards=cards["new_cards"],
+        new_cards_per_day=newCardsPerDay,
+        starting_ease=cards["starting_ease"],
+        seed=request["seed"],
+    )
+
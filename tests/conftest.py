@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The add-on is not installed as a package, so the tests import it from src:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
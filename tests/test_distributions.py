@@ -0,0 +1,109 @@
+import datetime
+import time
+from types import SimpleNamespace
+
+from anki_simulator.collection_simulator import CollectionSimulator
+from anki_simulator.distributions import DistributionSnapshots
+from anki_simulator.review_simulator import ReviewSimulator
+from anki_simulator.synthetic import Histogram, SyntheticCollection
+
+# Creation time of the collection:
+_CRT = int(time.time()) - 100 * 86400
+
+
+class _Collection:
+    """Just enough of anki.collection.Collection for generate_for_deck"""
+
+    def __init__(self, cards):
+        self.crt = _CRT
+        self._cards = {card.id: card for card in cards}
+        self.decks = SimpleNamespace(
+            cids=lambda did, children: list(self._cards),
+            get=lambda did: {"newToday": [0, 0]},
+        )
+
+    def get_card(self, cid):
+        return self._cards[cid]
+
+
+def _deckCards():
+    today = (datetime.date.today() - datetime.date.fromtimestamp(_CRT)).days
+    cards = []
+    for cid in range(1, 301):
+        if cid % 3 == 0:
+            cards.append(
+                SimpleNamespace(
+                    id=cid, nid=cid, type=0, queue=0, due=cid, odue=0, ivl=0, factor=0, left=0
+                )
+            )
+        else:
+            cards.append(
+                SimpleNamespace(
+                    id=cid,
+                    nid=cid,
+                    type=2,
+                    queue=2,
+                    due=today + cid % 30,
+                    odue=0,
+                    ivl=1 + cid % 90,
+                    factor=1300 + 7 * cid,
+                    left=0,
+                )
+            )
+    return cards
+
+
+def _simulate(dateArray, total, mature, days=60):
+    # Cards due after the last day are not counted:
+    counted = sum(map(len, dateArray))
+    distributions = DistributionSnapshots([10, 30])
+    simulator = ReviewSimulator(
+        dateArray,
+        days,
+        new_cards_per_day=20,
+        interval_modifier=1.0,
+        max_reviews_per_day=200,
+        learning_steps=[1.0, 10.0],
+        lapse_steps=[10.0],
+        graduating_interval=1,
+        new_lapse_interval=0.0,
+        max_interval=36500,
+        percentages_correct_for_learning_steps=[80, 90],
+        percentages_correct_for_lapse_steps=[80],
+        percentage_good_young=90,
+        percentage_good_mature=90,
+        percentage_hard_review=0,
+        percentage_easy_review=0,
+        scheduler_version=3,
+        total_number_of_cards=total,
+        current_number_mature_cards=mature,
+        seed=1,
+        distributions=distributions,
+    )
+    assert simulator.simulate() is not None
+    return distributions, counted
+
+
+def test_snapshots_of_deck_cards():
+    mw = SimpleNamespace(col=_Collection(_deckCards()))
+    dateArray, total, mature = CollectionSimulator(mw).generate_for_deck(
+        1, 60, 20, 250, 2, 1, True, False, 0
+    )
+    assert any(isinstance(card.ease, float) for day in dateArray for card in day)
+    distributions, counted = _simulate(dateArray, total, mature)
+    assert [snapshot.day for snapshot in distributions.snapshots] == [10, 30, 60]
+    for snapshot in distributions.snapshots:
+        assert sum(snapshot.states) == counted
+        assert sum(snapshot.intervals) == sum(snapshot.eases) > 0
+        assert min(snapshot.eases) >= 0
+
+
+def test_snapshots_of_synthetic_cards():
+    collection = SyntheticCollection(
+        Histogram.lognormal(30, 1.2), Histogram.normal(250, 20, 130, 350)
+    )
+    dateArray, total, mature = collection.generate(60, 3000, 1000, 20, seed=1)
+    distributions, counted = _simulate(dateArray, total, mature)
+    for snapshot in distributions.snapshots:
+        assert sum(snapshot.states) == counted
+        assert sum(snapshot.intervals) == sum(snapshot.eases) > 0
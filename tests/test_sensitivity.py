@@ -0,0 +1,50 @@
+from anki_simulator.sensitivity import PairedComparison
+from anki_simulator.synthetic import Histogram, SyntheticCollection
+
+_OPTIONS = {
+    "days_to_simulate": 120,
+    "new_cards_per_day": 20,
+    "interval_modifier": 1.0,
+    "max_reviews_per_day": 9999,
+    "learning_steps": [1.0, 10.0],
+    "lapse_steps": [10.0],
+    "graduating_interval": 1,
+    "new_lapse_interval": 0.0,
+    "max_interval": 36500,
+    "percentages_correct_for_learning_steps": [80, 90],
+    "percentages_correct_for_lapse_steps": [80],
+    "percentage_good_young": 90,
+    "percentage_good_mature": 90,
+    "percentage_hard_review": 0,
+    "percentage_easy_review": 0,
+    "scheduler_version": 3,
+}
+
+
+def _comparison(**variant) -> PairedComparison:
+    collection = SyntheticCollection(
+        Histogram.lognormal(30, 1.2), Histogram.normal(250, 20, 130, 350)
+    )
+    dateArray, total, mature = collection.generate(120, 2000, 500, 20, seed=1)
+    options = dict(
+        _OPTIONS, total_number_of_cards=total, current_number_mature_cards=mature
+    )
+    return PairedComparison(
+        (dateArray, options), (dateArray, dict(options, **variant)), replicas=12
+    )
+
+
+def test_variance_reduction_of_interval_modifier():
+    comparison = _comparison(interval_modifier=1.1)
+    days = comparison.simulate()
+    assert comparison.varianceReduction >= 10
+    # Longer intervals mean fewer reviews:
+    assert days[-1]["difference"] < 0
+    assert abs(days[-1]["difference"]) > 3 * days[-1]["standardError"]
+
+
+def test_variance_reduction_of_retention():
+    comparison = _comparison(percentage_good_young=85, percentage_good_mature=85)
+    days = comparison.simulate()
+    assert comparison.varianceReduction >= 2
+    assert days[-1]["difference"] > 3 * days[-1]["standardError"]
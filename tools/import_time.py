@@ -0,0 +1,131 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Measures how long importing the add-on takes, i.e. what it adds to Anki's startup
+
+Each run imports the package in a fresh interpreter with -X importtime and adds up
+the time of every module that importing it loads. Anki's own modules (aqt, Qt)
+are imported beforehand when they are installed, as Anki has loaded them before
+it loads add-ons. Compare against a git revision with --revision:
+
+    python tools/import_time.py
+    python tools/import_time.py --revision HEAD
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+_MARKER = "-- anki_simulator --"
+
+# Anki has loaded these when it loads add-ons. Without aqt, the standard library
+# modules it uses stand in for it.
+_PRELUDE = """
+import sys
+import collections, datetime, enum, functools, json, os, re, typing
+try:
+    import aqt, aqt.qt
+except ImportError:
+    pass
+sys.stderr.write({marker!r} + "\\n")
+import {module}
+"""
+
+
+def measure(source: str, module: str) -> Tuple[int, Dict[str, int]]:
+    """Total microseconds of importing the module from the source directory, and
+    the time of each module it loaded"""
+    environment = dict(os.environ, PYTHONPATH=source)
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            _PRELUDE.format(marker=_MARKER, module=module),
+        ],
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    lines = process.stderr.splitlines()
+    modules: Dict[str, int] = {}
+    for line in lines[lines.index(_MARKER) + 1 :]:
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        selfTime, _, name = line[len("import time:") :].split("|")
+        modules[name.strip()] = int(selfTime)
+    return sum(modules.values()), modules
+
+
+def export_revision(revision: str, directory: str) -> str:
+    """Source directory of the package at a git revision"""
+    archive = subprocess.run(
+        ["git", "archive", revision, "src"], capture_output=True, check=True
+    ).stdout
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return os.path.join(directory, "src")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--source",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+        help="directory that contains the package",
+    )
+    parser.add_argument("--revision", help="measure this git revision instead")
+    parser.add_argument("--module", default="anki_simulator")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--top", type=int, default=10)
+    arguments = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = arguments.source
+        if arguments.revision:
+            source = export_revision(arguments.revision, directory)
+        runs = [measure(source, arguments.module) for _ in range(arguments.runs)]
+
+    totals = [total for total, _ in runs]
+    _, modules = runs[totals.index(sorted(totals)[len(totals) // 2])]
+    print(
+        "import {}: median {:.1f} ms, min {:.1f} ms over {} runs, {} modules".format(
+            arguments.module,
+            median(totals) / 1000,
+            min(totals) / 1000,
+            len(totals),
+            len(modules),
+        )
+    )
+    for name, selfTime in sorted(modules.items(), key=lambda item: -item[1])[
+        : arguments.top
+    ]:
+        print("  {:>8.1f} ms  {}".format(selfTime / 1000, name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# Anki Simulator Add-on for Anki
+#
+# Copyright (C) 2020  GiovanniHenriksen https://github.com/giovannihenriksen
+# Copyright (C) 2020  Aristotelis P. https://glutanimate.com/
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see https://www.gnu.org/licenses/.
+
+"""
+Load test for the simulation service (anki_simulator/server.py)
+
+Sends --requests simulation requests with --concurrency of them in flight, drawn
+from --distinct different requests so that some are coalesced or cached, and
+reports the throughput and latency percentiles. Example:
+
+    python tools/loadtest.py --requests 200 --concurrency 20 --distinct 10
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[min(max(int(fraction * len(ordered) + 0.5) - 1, 0), len(ordered) - 1)]
+
+
+def make_request(index: int, arguments) -> Dict[str, Any]:
+    return {
+        "days": arguments.days,
+        "seed": index,
+        "cards": {
+            "new_cards": arguments.new_cards,
+            "review_cards": arguments.review_cards,
+            "intervals": {"lognormal": {"median": 30, "sigma": 1.2}},
+            "eases": {"normal": {"mean": 250, "sd": 20, "low": 130, "high": 350}},
+        },
+        "options": {"new_cards_per_day": 20, "max_reviews_per_day": 9999},
+    }
+
+
+async def simulate(
+    host: str, port: int, body: bytes
+) -> Tuple[float, float, str, Optional[str], int]:
+    """Latency, time to the first day, source, error and number of days of one
+    request"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        "POST /simulate HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n"
+        "Content-Length: {}\r\n\r\n".format(host, len(body)).encode("latin-1")
+        + body
+    )
+    await writer.drain()
+    status = (await reader.readline()).decode("latin-1").split(" ")[1]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    firstDay = 0.0
+    days = 0
+    error: Optional[str] = None
+    last: Dict[str, Any] = {}
+    buffer = b""
+    # Chunks are decoded one at a time, so the first day is timed when it arrives:
+    while True:
+        size = int((await reader.readline()).strip() or b"0", 16)
+        if size == 0:
+            break
+        buffer += await reader.readexactly(size)
+        await reader.readexactly(2)
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if not firstDay:
+                firstDay = time.perf_counter() - start
+            last = json.loads(line)
+            if "dayNumber" in last:
+                days += 1
+    writer.close()
+    if status != "200":
+        error = "HTTP {}".format(status)
+    elif "error" in last:
+        error = last["error"]
+    elif not last.get("done"):
+        error = "incomplete response"
+    return (
+        time.perf_counter() - start,
+        firstDay,
+        headers.get("x-simulation-source", ""),
+        error,
+        days,
+    )
+
+
+async def run(arguments):
+    bodies = [
+        json.dumps(make_request(index, arguments)).encode("utf-8")
+        for index in range(arguments.distinct)
+    ]
+    rng = random.Random(arguments.seed)
+    queue = [rng.choice(bodies) for _ in range(arguments.requests)]
+    results: List[Tuple[float, float, str, Optional[str], int]] = []
+
+    async def client():
+        while queue:
+            body = queue.pop()
+            try:
+                results.append(await simulate(arguments.host, arguments.port, body))
+            except (OSError, asyncio.IncompleteReadError, ValueError) as error:
+                results.append((0.0, 0.0, "", str(error) or type(error).__name__, 0))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(arguments.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    succeeded = [result for result in results if result[3] is None]
+    errors = Counter(result[3] for result in results if result[3] is not None)
+    print("requests:      {} in {:.2f} s".format(len(results), elapsed))
+    print("throughput:    {:.1f} requests/s".format(len(results) / elapsed))
+    print("simulated:     {:.0f} days/s".format(sum(r[4] for r in succeeded) / elapsed))
+    print("sources:       {}".format(dict(Counter(r[2] for r in succeeded))))
+    if succeeded:
+        latencies = [result[0] * 1000 for result in succeeded]
+        firstDays = [result[1] * 1000 for result in succeeded]
+        for name, values in (("latency", latencies), ("first day", firstDays)):
+            print(
+                "{:<14} p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+                    name + ":",
+                    percentile(values, 0.5),
+                    percentile(values, 0.9),
+                    percentile(values, 0.99),
+                    max(values),
+                )
+            )
+    if errors:
+        print("errors:        {}".format(dict(errors)))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--distinct", type=int, default=10)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--new-cards", type=int, default=1000)
+    parser.add_argument("--review-cards", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()